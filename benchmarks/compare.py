@@ -0,0 +1,54 @@
+"""Compara dos ficheros de resultados de `benchmarks.run`.
+
+    python -m benchmarks.compare antes.json despues.json --fail-above 1.2
+
+Muestra, por escala y etapa, los segundos de cada ejecución y el cociente
+después/antes. Con `--fail-above` termina con error si alguna etapa es más
+lenta que ese factor, para usarlo en integración continua.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        report = json.load(f)
+    return report.get('meta', {}), {(r['rows'], r['stage']): r for r in report['results']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare', description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--fail-above', type=float, help="Cociente después/antes a partir del cual se considera regresión")
+    args = parser.parse_args(argv)
+
+    meta_before, before = load(args.before)
+    meta_after, after = load(args.after)
+    print(f"antes:   {meta_before.get('commit')}  {meta_before.get('fecha')}")
+    print(f"después: {meta_after.get('commit')}  {meta_after.get('fecha')}")
+    print(f"{'filas':>10}  {'etapa':<30} {'antes (s)':>11} {'después (s)':>12} {'cociente':>9} {'RSS (MB)':>9}")
+
+    regressions = []
+    for key in sorted(before.keys() & after.keys()):
+        rows, stage = key
+        a, b = before[key]['seconds'], after[key]['seconds']
+        ratio = b / a if a > 0 else float('inf')
+        rss = after[key].get('peak_rss_mb')
+        print(f"{rows:>10,}  {stage:<30} {a:>11.4f} {b:>12.4f} {ratio:>8.2f}x {rss or 0:>9.0f}")
+        if args.fail_above is not None and ratio > args.fail_above:
+            regressions.append(key)
+
+    for rows, stage in sorted(before.keys() ^ after.keys()):
+        print(f"{rows:>10,}  {stage:<30} solo en {'antes' if (rows, stage) in before else 'después'}")
+
+    if regressions:
+        print(f"{len(regressions)} etapas más lentas que {args.fail_above}x", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Mide tiempo, rendimiento y memoria de cada etapa del informe sobre exports sintéticos.
+
+    python -m benchmarks.run --rows 10000 100000 1000000 --output resultados.json
+    python -m benchmarks.compare antes.json despues.json
+
+Para cada escala se generan (una sola vez, se reutilizan entre ejecuciones) un
+export de electricidad separado por comas y otro de gas con punto y coma y BOM.
+Cada escala se mide en un proceso nuevo para que el pico de memoria de una no
+contamine a las demás. El resultado es un JSON con una entrada por escala y
+etapa: segundos (el mejor de `--repeat` repeticiones), filas por segundo y pico
+de RSS del proceso al terminar la etapa.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import GENERATOR_VERSION, generate
+
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+
+# Proporción de facturas de gas frente a electricidad en los exports reales.
+GAS_RATIO = 40
+
+
+def dataset_paths(workdir, rows, seed=0):
+    """Genera (si no existen) los exports sintéticos de una escala y devuelve sus rutas."""
+
+    paths = {}
+    for kind, n_rows, dialect in (('electricidad', rows, 'coma'), ('gas', max(1, rows // GAS_RATIO), 'punto_y_coma')):
+        path = os.path.join(workdir, f"{kind}-{n_rows}-s{seed}-v{GENERATOR_VERSION}.csv")
+        if not os.path.exists(path):
+            generate(path, kind, n_rows, dialect=dialect, seed=seed)
+        paths[kind] = path
+    return paths
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso en MB (None si no se puede medir)."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stages(paths, rows, repeat):
+    """Ejecuta todas las etapas sobre los exports de una escala y devuelve sus medidas."""
+
+    from consumo.anomalies import score_invoices
+    from consumo import sql
+    from consumo.cube import build_cube, build_cube_streaming
+    from consumo.emissions import add_emissions, factor_table, scope_report
+    from consumo.filters import FilterIndex, FilterSpec
+    from consumo.ingest import read_normalized
+    from consumo.loaders import active_invoices, normalize_electricity_data, normalize_gas_data, stream_invoices
+    from consumo.pipeline import sync_store
+    from consumo.periods import PeriodData, normalize_period_data, period_summary
+    from consumo.power import PowerData, normalize_power_data, optimize_power
+    from consumo.reactive import ReactiveData, normalize_reactive_data, reactive_summary
+    from consumo.report import (
+        community_report, compute_kpis, consumption_by, cost_breakdown, monthly_consumption
+    )
+    from consumo.schema import concat_frames
+    from consumo.series import MonthlySeries
+
+    results = []
+
+    def measure(stage, fn, n_rows=rows, times=repeat):
+        best, value = float('inf'), None
+        for _ in range(times):
+            start = time.perf_counter()
+            value = fn()
+            best = min(best, time.perf_counter() - start)
+        results.append({
+            'rows': rows, 'stage': stage, 'seconds': best,
+            'rows_per_s': n_rows / best if best > 0 else None, 'peak_rss_mb': peak_rss_mb(),
+        })
+        return value
+
+    elec_path, gas_path = paths['electricidad'], paths['gas']
+    gas_rows = max(1, rows // GAS_RATIO)
+
+    # --- Ingesta ---
+    df_elec = measure('ingesta_electricidad', lambda: normalize_electricity_data(elec_path))
+    df_gas = measure('ingesta_gas', lambda: normalize_gas_data(gas_path), n_rows=gas_rows)
+    cache_dir = tempfile.mkdtemp(prefix='consumo-bench-cache-')
+    try:
+        def write_cache():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return read_normalized(elec_path, 'electricidad', normalize_electricity_data, cache_dir)
+        measure('cache_arrow_escritura', write_cache, times=1)
+        measure('cache_arrow_lectura',
+                lambda: read_normalized(elec_path, 'electricidad', normalize_electricity_data, cache_dir))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    measure('ingesta_por_trozos', lambda: build_cube_streaming(stream_invoices(elec_path, 'electricidad')), times=1)
+
+    # --- Cubo y filtros ---
+    invoices = concat_frames([active_invoices(df_elec), active_invoices(df_gas)])
+    cube = measure('cubo', lambda: build_cube(invoices), n_rows=len(invoices))
+    index = measure('indice_filtros', lambda: FilterIndex(cube), n_rows=len(cube))
+    years = sorted(cube['Año'].dropna().unique())
+    year = years[-1]
+    communities = sorted(cube['Comunidad Autónoma'].unique().tolist())
+    spec = FilterSpec(year=year, communities=tuple(communities[::2]), tensions=('Baja Tensión', 'Alta Tensión'))
+    filtered = measure('filtro', lambda: index.apply(cube, spec), n_rows=len(cube))
+    invoice_index = FilterIndex(invoices)
+    measure('filtro_facturas', lambda: invoice_index.apply(invoices, spec), n_rows=len(invoices))
+
+    # --- KPIs y datos de los gráficos ---
+    measure('kpis', lambda: compute_kpis(filtered), n_rows=len(filtered))
+    measure('grafico_desglose_costes', lambda: cost_breakdown(filtered), n_rows=len(filtered))
+    measure('grafico_consumo_por_grupo', lambda: consumption_by(filtered, 'Comunidad Autónoma'), n_rows=len(filtered))
+    measure('grafico_mapa', lambda: filtered.groupby('Comunidad Autónoma', observed=True)['Consumo_kWh'].sum(),
+            n_rows=len(filtered))
+    measure('grafico_evolucion_mensual', lambda: monthly_consumption(filtered, year), n_rows=len(filtered))
+    # Comparativa anual: como en el dashboard, series de todo el histórico y años o acumulado de 12 meses sobre ellas.
+    series = measure('series_mensuales', lambda: MonthlySeries(cube), n_rows=len(cube))
+    comparison_spec = FilterSpec(energy='Electricidad', communities=spec.communities, tensions=spec.tensions)
+    measure('grafico_comparativa', lambda: series.yearly([int(y) for y in years[-3:]], series.select(comparison_spec)), n_rows=len(series.meta))
+    measure('grafico_comparativa_12m', lambda: series.rolling(series.select(comparison_spec)), n_rows=len(series.meta))
+    measure('informe_comunidades', lambda: community_report(cube, year), n_rows=len(cube))
+    measure('anomalias', lambda: score_invoices(invoices), n_rows=len(invoices))
+
+    # --- Emisiones ---
+    factors = factor_table([{'Tipo de Energía': 'Electricidad', 'Año': y, 'Factor': 0.15} for y in years]
+                           + [{'Tipo de Energía': 'Electricidad', 'Comercializadora': 'ENDESA', 'Año': year, 'Factor': 0.12}])
+    cube_emissions = measure('emisiones_cubo', lambda: add_emissions(cube, factors), n_rows=len(cube))
+    measure('emisiones_facturas', lambda: add_emissions(invoices, factors), n_rows=len(invoices))
+    measure('emisiones_alcances', lambda: scope_report(cube_emissions), n_rows=len(cube))
+
+    # --- Periodos tarifarios ---
+    periods = measure('periodos_ingesta', lambda: PeriodData.from_frames([normalize_period_data(elec_path)]))
+    period_rows = FilterIndex(periods.meta).select(spec)
+    measure('periodos_resumen_cups', lambda: period_summary(periods, 'CUPS', period_rows), n_rows=len(period_rows))
+    measure('periodos_resumen_comunidad', lambda: period_summary(periods, 'Comunidad Autónoma', period_rows),
+            n_rows=len(period_rows))
+
+    # --- Potencia contratada ---
+    power = measure('potencia_ingesta', lambda: PowerData.from_frames([normalize_power_data(elec_path)]))
+    power_rows = FilterIndex(power.meta).select(spec)
+    measure('potencia_optimizacion', lambda: optimize_power(power, power_rows), n_rows=len(power_rows))
+
+    # --- Energía reactiva ---
+    reactive = measure('reactiva_ingesta', lambda: ReactiveData.from_frames([normalize_reactive_data(elec_path)]))
+    measure('reactiva_resumen', lambda: reactive_summary(reactive), n_rows=len(reactive))
+
+    # --- Motor SQL (solo si DuckDB está instalado) ---
+    if sql.available():
+        data_dir = tempfile.mkdtemp(prefix='consumo-bench-sql-')
+        try:
+            for path in paths.values():
+                os.symlink(path, os.path.join(data_dir, os.path.basename(path)))
+            measure('sql_almacen', lambda: sync_store(data_dir, max_workers=1), times=1)
+            backend = measure('sql_conexion', lambda: sql.SqlBackend(data_dir))
+            measure('sql_cubo', lambda: backend.cube(), n_rows=len(invoices))
+            measure('sql_filtro', lambda: backend.cube(spec), n_rows=len(invoices))
+            measure('sql_kpis', lambda: backend.kpis(spec), n_rows=len(invoices))
+            backend.close()
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def metadata():
+    """Versión del código y del entorno, para poder comparar resultados entre commits."""
+
+    import numpy
+    import pandas
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'generador': GENERATOR_VERSION,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SCALES, help="Facturas de electricidad por escala")
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones por etapa (se guarda la mejor)")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'consumo-bench'),
+                        help="Carpeta donde se guardan los exports sintéticos")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument('--child', nargs=3, metavar=('ELECTRICIDAD', 'GAS', 'FILAS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        elec_path, gas_path, rows = args.child
+        json.dump(run_stages({'electricidad': elec_path, 'gas': gas_path}, int(rows), args.repeat), sys.stdout)
+        return 0
+
+    results = []
+    for rows in args.rows:
+        print(f"Escala {rows:,} filas: generando datos...", file=sys.stderr)
+        paths = dataset_paths(args.workdir, rows, args.seed)
+        print(f"Escala {rows:,} filas: midiendo...", file=sys.stderr)
+        child = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.run', '--repeat', str(args.repeat),
+             '--child', paths['electricidad'], paths['gas'], str(rows)],
+            capture_output=True, text=True,
+        )
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            return child.returncode
+        results.extend(json.loads(child.stdout))
+
+    report = {'meta': metadata(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""Generador de exports sintéticos con el esquema FacturaES de `Data/`.
+
+Produce CSV de electricidad (120 columnas) y de gas (44 columnas) con la misma
+cabecera, formato numérico (`1,232.05`), fechas `dd/mm/aaaa` y variantes de
+dialecto que los exports reales: separados por coma sin BOM o por punto y coma
+con BOM y todo entrecomillado. Los valores se generan con numpy por bloques, así
+que la memoria no depende del número de filas.
+
+    python -m benchmarks.synthetic --kind electricidad --rows 1000000 salida.csv
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from consumo.provinces import PROVINCE_COMMUNITY
+
+
+GENERATOR_VERSION = 2
+
+BLOCK_ROWS = 200_000
+
+PERIODS = ['P1', 'P2', 'P3', 'P4', 'P5', 'P6']
+
+_COMMON_HEAD = ['Número de factura', 'Estado de factura', 'Tipo de factura', 'CUPS', 'Fecha desde', 'Fecha hasta',
+                'Fecha emisión', 'Fecha inicio energia', 'Fecha fin energia']
+
+_COMMON_SITE = ['Base imponible (€)', 'Dirección', 'Municipio', 'Provincia', 'Nombre suministro', 'Código suministro',
+                'Razón social', 'CIF']
+
+ELECTRICITY_COLUMNS = (
+    _COMMON_HEAD + ['Fecha inicio potencia', 'Fecha fin potencia'] + _COMMON_SITE
+    + ['Tarifa de acceso', 'Comercializadora', 'Remesa', 'Tipo de lectura', 'Número de contador']
+    + [col for p in PERIODS for col in (f'Lectura inicio consumo activa {p} (kWh)',
+                                        f'Lectura fin consumo activa {p} (kWh)', f'Consumo activa {p} (kWh)')]
+    + ['Consumo activa total (kWh)']
+    + [col for p in PERIODS for col in (f'Lectura inicio consumo reactiva inductiva {p} (kVArh)',
+                                        f'Lectura fin consumo reactiva inductiva {p} (kVArh)',
+                                        f'Consumo reactiva inductiva {p} (kVarh)')]
+    + ['Consumo reactiva inductiva total (kVarh)']
+    + [col for p in PERIODS for col in (f'Lectura fin maxímetro {p} (kW)', f'Maxímetro {p} (kW)')]
+    + ['Maxímetro total (kW)']
+    + [f'Potencia contratada {p} (kW)' for p in PERIODS]
+    + ['Importe TE (€)', 'Importe TP (€)', 'Importe TR (€)', 'Importe IE', 'Importe alquiler (€)',
+       'Importe impuestos (€)', 'Importe otros conceptos (€)', 'Importe otros conceptos sin IE (€)',
+       'Cuenta bancaria', 'Factura rectificada', 'Importe total (€)']
+    + [f'Importe excesos {p}' for p in PERIODS]
+    + ['Importe excesos de potencia', 'Nombre del fichero']
+    + [f'Importe TE {p}(€)' for p in PERIODS]
+    + [f'Importe TP {p}(€)' for p in PERIODS]
+    + ['Consumo vertido (kWh)', 'Precio vertido (€/kWh)', 'Importe TE vertido (€)', 'Ajuste gas',
+       'Ignorar restricciones', 'Estado pago', 'Tensión lectura', 'Importe otros conceptos sin impuestos (€)']
+)
+
+GAS_COLUMNS = (
+    _COMMON_HEAD + ['Fecha inicio caudal', 'Fecha fin caudal'] + _COMMON_SITE
+    + ['Grupo peaje', 'Comercializadora', 'Remesa', 'Tipo de lectura', 'Consumo', 'Consumo excedido', 'Qmax',
+       'Qaplicado', 'Poder calorífico', 'Importe TE (€)', 'Importe TC (€)', 'Importe alquiler (€)',
+       'Importe IH (€)', 'Importe otros conceptos (€)', 'Cuenta bancaria', 'Factura rectificada',
+       'Importe impuestos (€)', 'Importe total (€)', 'Excesos de Caudal(kWh)', 'Excesos de Caudal(€)',
+       'Nombre del fichero', 'Número de contador', 'Ignorar restricciones', 'Estado pago',
+       'Importe otros conceptos sin IVA']
+)
+
+# Reparto de tarifas y periodos con consumo parecido al de los exports reales.
+TARIFFS = {'2.0TD': 0.08, '3.0TD': 0.90, '6.1TD': 0.02}
+
+PERIOD_SHARES = {
+    '2.0TD': [0.30, 0.30, 0.40, 0.0, 0.0, 0.0],
+    '3.0TD': [0.15, 0.18, 0.12, 0.12, 0.05, 0.38],
+    '6.1TD': [0.10, 0.14, 0.10, 0.12, 0.06, 0.48],
+}
+
+ENERGY_PRICES = [0.19, 0.16, 0.13, 0.12, 0.11, 0.10]
+
+GAS_TOLLS = {'RL.2': 0.1, 'RL.3': 0.15, 'RL.4': 0.45, 'RLTB.5': 0.15, 'RLTA.6': 0.15}
+
+DIALECTS = {
+    'coma': {'sep': ',', 'encoding': 'utf-8', 'quoting': csv.QUOTE_MINIMAL},
+    # Los exports con punto y coma entrecomillan todos los valores salvo los vacíos.
+    'punto_y_coma': {'sep': ';', 'encoding': 'utf-8-sig', 'quoting': csv.QUOTE_NONE, 'quote_values': True},
+}
+
+
+def format_amount(values, decimals=2):
+    """Formatea números como los exports: separador de miles `,` y decimal `.`.
+
+    Se construye el texto por grupos de tres cifras con operaciones de numpy
+    sobre arrays de cadenas, sin formatear cada valor en Python.
+    """
+
+    values = np.asarray(values, dtype='float64')
+    scale = 10 ** decimals
+    scaled = np.round(np.abs(values) * scale).astype(np.int64)
+    units, frac = np.divmod(scaled, scale)
+    n_groups = (len(str(int(units.max(initial=0)))) + 2) // 3
+    text = np.full(len(units), '', dtype='U1')
+    started = np.zeros(len(units), dtype=bool)
+    for level in reversed(range(n_groups)):
+        group = (units // 1000 ** level) % 1000
+        digits = group.astype('U')
+        show = started | (group > 0) | (level == 0)
+        piece = np.where(started, np.strings.add(',', np.strings.zfill(digits, 3)), digits)
+        text = np.where(show, np.strings.add(text, piece), text)
+        started |= show
+    if decimals:
+        text = np.strings.add(np.strings.add(text, '.'), np.strings.zfill(frac.astype('U'), decimals))
+    text = np.where((values < 0) & (scaled > 0), np.strings.add('-', text), text)
+    return text.astype(object)
+
+
+def format_date(dates):
+    """Formatea fechas como `dd/mm/aaaa` (cada fecha distinta se formatea una sola vez)."""
+
+    unique, inverse = np.unique(dates, return_inverse=True)
+    return pd.DatetimeIndex(unique).strftime('%d/%m/%Y').to_numpy(dtype=object)[inverse]
+
+
+def _supplies(n_supplies, rng, kind):
+    """Atributos fijos de cada suministro: CUPS, provincia, nombre y tamaño."""
+
+    provinces = np.array(list(PROVINCE_COMMUNITY), dtype=object)
+    digits = rng.integers(0, 10**16, size=n_supplies, dtype=np.int64)
+    letters = rng.integers(0, 26, size=(n_supplies, 2))
+    suffix = np.char.add(np.array([chr(65 + c) for c in letters[:, 0]]), np.array([chr(65 + c) for c in letters[:, 1]]))
+    prefix = 'ES00' if kind == 'electricidad' else 'ES02'
+    cups = np.char.add(np.char.add(prefix, np.char.zfill(digits.astype(str), 16)), suffix).astype(object)
+    ids = np.arange(n_supplies)
+    supplies = {
+        'CUPS': cups,
+        'Provincia': provinces[rng.integers(0, len(provinces), size=n_supplies)],
+        'Nombre suministro': np.char.add('CENTRO ', ids.astype(str)).astype(object),
+        'Código suministro': np.char.add(np.char.add(np.char.zfill(ids.astype(str), 4), ' - Centro '), ids.astype(str)).astype(object),
+        'Dirección': np.char.add('Calle Sintética, ', (ids % 200 + 1).astype(str)).astype(object),
+        'scale': rng.lognormal(mean=0.0, sigma=1.0, size=n_supplies),
+    }
+    if kind == 'electricidad':
+        supplies['tariff'] = rng.choice(list(TARIFFS), p=list(TARIFFS.values()), size=n_supplies)
+        supplies['power'] = rng.choice([10.0, 15.0, 30.0, 43.65, 60.0, 100.0, 450.0], size=n_supplies)
+        supplies['power_text'] = format_amount(supplies['power'])
+    else:
+        supplies['toll'] = rng.choice(list(GAS_TOLLS), p=list(GAS_TOLLS.values()), size=n_supplies)
+    return supplies
+
+
+def _block(kind, start, stop, supplies, rng, first_month):
+    """Columnas (como arrays de texto) de las filas `start:stop`."""
+
+    n_supplies = len(supplies['CUPS'])
+    rows = np.arange(start, stop)
+    n = len(rows)
+    supply = rows % n_supplies
+    zeros = np.full(n, '0.00', dtype=object)
+    month = first_month + rows // n_supplies
+    fecha_desde = (np.datetime64('2000-01', 'M') + month).astype('datetime64[D]')
+    fecha_hasta = (np.datetime64('2000-01', 'M') + month + 1).astype('datetime64[D]') - 1
+    fecha_emision = fecha_hasta + rng.integers(3, 30, size=n)
+    season = 1 + 0.25 * np.cos(2 * np.pi * (month % 12) / 12)
+
+    status = np.where(rng.random(n) < 0.01, 'ANULADA', 'ACTIVA').astype(object)
+    invoice_type = np.where(rng.random(n) < 0.03, 'COMPLEMENTARIA', 'NORMAL').astype(object)
+    cols = {
+        'Número de factura': np.char.add('SYN', np.char.zfill(rows.astype(str), 12)).astype(object),
+        'Estado de factura': status, 'Tipo de factura': invoice_type,
+        'Fecha desde': format_date(fecha_desde), 'Fecha hasta': format_date(fecha_hasta),
+        'Fecha emisión': format_date(fecha_emision),
+        'Razón social': np.full(n, 'ASEPEYO', dtype=object), 'CIF': np.full(n, 'G08215824', dtype=object),
+        'Tipo de lectura': np.full(n, 'REAL', dtype=object),
+    }
+    for col in ['CUPS', 'Provincia', 'Nombre suministro', 'Código suministro', 'Dirección']:
+        cols[col] = supplies[col][supply]
+    cols['Municipio'] = cols['Provincia']
+
+    if kind == 'electricidad':
+        tariff = supplies['tariff'][supply]
+        shares = np.stack([PERIOD_SHARES[t] for t in TARIFFS])[np.searchsorted(list(TARIFFS), tariff)]
+        total = 2500 * supplies['scale'][supply] * season * rng.uniform(0.8, 1.2, size=n)
+        kwh = np.round(shares * total[:, None], 2)
+        readings = (supply[:, None] * 997 + month[:, None] * 1500 + np.arange(6) * 10_000) % 1_000_000
+        energy = kwh @ np.array(ENERGY_PRICES)
+        power = supplies['power'][supply]
+        power_cost = power * 3.2 * rng.uniform(0.95, 1.05, size=n)
+        electricity_tax = 0.0511 * (energy + power_cost)
+        rent = np.round(rng.uniform(0, 30, size=n), 2)
+        base = energy + power_cost + electricity_tax + rent
+        vat = 0.21 * base
+        for j, p in enumerate(PERIODS):
+            cols[f'Lectura inicio consumo activa {p} (kWh)'] = readings[:, j].astype(str).astype(object)
+            cols[f'Lectura fin consumo activa {p} (kWh)'] = (readings[:, j] + kwh[:, j].astype(np.int64)).astype(str).astype(object)
+            cols[f'Consumo activa {p} (kWh)'] = format_amount(kwh[:, j])
+            cols[f'Consumo reactiva inductiva {p} (kVarh)'] = format_amount(kwh[:, j] * rng.uniform(0, 0.4, size=n))
+            cols[f'Maxímetro {p} (kW)'] = format_amount(power * rng.uniform(0.3, 1.1, size=n) * (shares[:, j] > 0))
+            cols[f'Potencia contratada {p} (kW)'] = supplies['power_text'][supply]
+        cols.update({
+            'Tarifa de acceso': tariff.astype(object), 'Comercializadora': np.full(n, 'ENDESA', dtype=object),
+            'Número de contador': (supply + 10_000_000).astype(str).astype(object),
+            'Consumo activa total (kWh)': format_amount(kwh.sum(axis=1)),
+            'Importe TE (€)': format_amount(energy), 'Importe TP (€)': format_amount(power_cost),
+            'Importe TR (€)': zeros, 'Importe IE': format_amount(electricity_tax),
+            'Importe alquiler (€)': format_amount(rent), 'Importe impuestos (€)': format_amount(vat),
+            'Importe otros conceptos (€)': zeros,
+            'Importe total (€)': format_amount(base + vat), 'Base imponible (€)': format_amount(base),
+            'Importe excesos de potencia': zeros,
+            'Ignorar restricciones': np.full(n, 'False', dtype=object),
+        })
+        columns = ELECTRICITY_COLUMNS
+    else:
+        toll = supplies['toll'][supply]
+        gas_season = 1 + 0.8 * np.cos(2 * np.pi * (month % 12) / 12)
+        kwh = np.round(9000 * supplies['scale'][supply] * gas_season * rng.uniform(0.7, 1.3, size=n), 0)
+        energy = 0.05 * kwh
+        fixed = rng.uniform(10, 120, size=n)
+        hydrocarbon_tax = 0.00234 * kwh
+        rent = np.round(rng.uniform(0, 30, size=n), 2)
+        base = energy + fixed + hydrocarbon_tax + rent
+        vat = 0.21 * base
+        cols.update({
+            'Grupo peaje': toll.astype(object), 'Comercializadora': np.full(n, '', dtype=object),
+            'Consumo': format_amount(kwh), 'Importe TE (€)': format_amount(energy),
+            'Importe TC (€)': format_amount(fixed), 'Importe alquiler (€)': format_amount(rent),
+            'Importe IH (€)': format_amount(hydrocarbon_tax), 'Importe otros conceptos (€)': zeros,
+            'Importe impuestos (€)': format_amount(vat), 'Importe total (€)': format_amount(base + vat),
+            'Base imponible (€)': format_amount(base), 'Nombre del fichero': cols['Número de factura'],
+            'Ignorar restricciones': np.full(n, 'No', dtype=object),
+        })
+        columns = GAS_COLUMNS
+
+    empty = np.full(n, np.nan, dtype=object)
+    return pd.DataFrame({col: cols.get(col, empty) for col in columns})
+
+
+def generate(path, kind, n_rows, n_supplies=None, dialect='coma', seed=0, first_year=2023):
+    """Escribe un export sintético de `n_rows` facturas (una por suministro y mes)."""
+
+    if n_supplies is None:
+        # Una factura al mes por suministro durante dos años, para que haya año anterior con el que comparar.
+        n_supplies = max(20, n_rows // 24)
+    rng = np.random.default_rng(seed)
+    supplies = _supplies(n_supplies, rng, kind)
+    first_month = (first_year - 2000) * 12
+    options = DIALECTS[dialect]
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding=options['encoding'], newline='') as f:
+        for start in range(0, n_rows, BLOCK_ROWS):
+            block = _block(kind, start, min(start + BLOCK_ROWS, n_rows), supplies, rng, first_month)
+            header = start == 0
+            if options.get('quote_values'):
+                header = [f'"{col}"' for col in block.columns] if header else False
+                block = block.apply(lambda col: '"' + col + '"')
+            block.to_csv(f, sep=options['sep'], quoting=options['quoting'], index=False, header=header,
+                         lineterminator='\r\n' if dialect == 'punto_y_coma' else '\n')
+    os.replace(tmp_path, path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic', description=__doc__.split('\n\n')[0])
+    parser.add_argument('path')
+    parser.add_argument('--kind', choices=['electricidad', 'gas'], default='electricidad')
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--supplies', type=int)
+    parser.add_argument('--dialect', choices=DIALECTS, default='coma')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(args.path, args.kind, args.rows, args.supplies, args.dialect, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
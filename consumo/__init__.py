@@ -0,0 +1 @@
+"""Utilidades de datos para el informe energético de Asepeyo."""
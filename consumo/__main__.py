@@ -0,0 +1,129 @@
+"""Genera el informe anual de todas las comunidades sin abrir el dashboard.
+
+    python -m consumo --data-dir Data --year 2025 --output informes --format csv html
+
+Carga todos los exports de la carpeta (sin duplicados entre exports), construye
+el cubo mensual una vez y escribe, para el año pedido:
+
+- `informe_<año>_<grupo>.<ext>`: KPIs por comunidad (o por centro).
+- `informe_<año>_<grupo>_emisiones.<ext>`: emisiones de Alcance 1 y 2 por grupo
+  y año, de todos los años cargados (ver `consumo.emissions`).
+- `informe_<año>_<grupo>_mensual.<ext>`: consumo y coste por grupo, mes y energía.
+- `informe_<año>_<grupo>_anomalias.<ext>`: facturas del año que se alejan del
+  histórico de su suministro (ver `consumo.anomalies`).
+- `informe_<año>_<grupo>.html`: todo en una página, con una sección por grupo.
+"""
+
+import argparse
+import html
+import os
+import sys
+
+from consumo.anomalies import DEFAULT_THRESHOLD, detect_anomalies
+from consumo.cube import build_cube
+from consumo.emissions import FACTORS_PATH, add_emissions, load_factors, scope_report
+from consumo.pipeline import load_all
+from consumo.report import MONTH_NAMES, community_report, latest_billed_year
+from consumo.schema import concat_frames
+
+
+FORMATS = ('csv', 'parquet', 'html')
+
+GROUPS = {'comunidades': 'Comunidad Autónoma', 'centros': 'Centro'}
+
+ANOMALY_SUMMARY_COLUMNS = ['Puntuación', 'Motivo', 'CUPS', 'Centro', 'Tipo de Energía', 'Fecha desde', 'Fecha hasta',
+                           'Consumo_kWh', 'kWh/día', 'kWh/día esperado', '€/kWh', '€/kWh esperado', 'Número de factura']
+
+
+def monthly_report(cube, year, by):
+    """Consumo y coste por grupo, mes y tipo de energía."""
+
+    monthly = cube[cube['Año'] == year].groupby([by, 'Mes', 'Tipo de Energía'], observed=True)[
+        ['Consumo_kWh', 'Coste Total']].sum().reset_index()
+    monthly.insert(2, 'Mes_str', [MONTH_NAMES[m - 1] for m in monthly['Mes']])
+    return monthly
+
+
+def write_html(path, year, by, report, monthly, anomalies, emissions):
+    """Escribe una página autocontenida con el resumen, las emisiones, las anomalías y una sección por grupo."""
+
+    sections = [f"<h1>Informe Energético Anual - {year}</h1>",
+                "<h2>Resumen</h2>", report.to_html(index=False, float_format='{:,.2f}'.format),
+                "<h2>Emisiones de Alcance 1 y 2</h2>", emissions.to_html(index=False, float_format='{:,.2f}'.format)]
+    if not anomalies.empty:
+        sections += [f"<h2>Facturas anómalas ({len(anomalies)})</h2>",
+                     anomalies[ANOMALY_SUMMARY_COLUMNS].to_html(index=False, float_format='{:,.2f}'.format)]
+    for name, group in monthly.groupby(by, observed=True, sort=True):
+        pivot = group.pivot_table(index=['Mes', 'Mes_str'], columns='Tipo de Energía',
+                                  values='Consumo_kWh', aggfunc='sum', fill_value=0, observed=True)
+        sections += [f"<h2>{html.escape(str(name))}</h2>", pivot.to_html(float_format='{:,.0f}'.format)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html><html lang="es"><head><meta charset="utf-8">'
+                f'<title>Informe Energético {year}</title></head><body>')
+        f.write('\n'.join(sections))
+        f.write('</body></html>')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m consumo', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default='Data', help="Carpeta con los exports (por defecto: Data)")
+    parser.add_argument('--year', type=int, help="Año del informe (por defecto: el del último periodo facturado)")
+    parser.add_argument('--output', default='informes', help="Carpeta de salida (por defecto: informes)")
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=['csv', 'html'], dest='formats')
+    parser.add_argument('--by', choices=GROUPS, default='comunidades', help="Agrupación del informe")
+    parser.add_argument('--factores', default=FACTORS_PATH,
+                        help="CSV de factores de emisión por energía, año, mes, comercializadora o CUPS")
+    parser.add_argument('--workers', type=int, help="Procesos para normalizar los exports")
+    parser.add_argument('--anomaly-threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="z robusto a partir del cual una factura se marca como anómala")
+    args = parser.parse_args(argv)
+
+    dataset, errors = load_all(args.data_dir, max_workers=args.workers)
+    for path, e in errors.items():
+        print(f"Error procesando '{os.path.basename(path)}': {e}", file=sys.stderr)
+    invoices = concat_frames(list(dataset.values()))
+    cube = add_emissions(build_cube(invoices), load_factors(args.factores))
+    if cube.empty:
+        print(f"No hay facturas activas en '{args.data_dir}'.", file=sys.stderr)
+        return 1
+
+    year = args.year if args.year is not None else latest_billed_year(invoices, cube)
+    by = GROUPS[args.by]
+    report = community_report(cube, year, by=by)
+    if report.empty:
+        print(f"No hay datos para {year}.", file=sys.stderr)
+        return 1
+    monthly = monthly_report(cube, year, by)
+    emissions = scope_report(cube, by)
+    anomalies = detect_anomalies(invoices, threshold=args.anomaly_threshold)
+    anomalies = anomalies[anomalies['Año'] == year]
+
+    os.makedirs(args.output, exist_ok=True)
+    stem = os.path.join(args.output, f"informe_{year}_{args.by}")
+    written = []
+    if 'csv' in args.formats:
+        report.to_csv(f"{stem}.csv", index=False)
+        monthly.to_csv(f"{stem}_mensual.csv", index=False)
+        anomalies.to_csv(f"{stem}_anomalias.csv", index=False)
+        emissions.to_csv(f"{stem}_emisiones.csv", index=False)
+        written += [f"{stem}.csv", f"{stem}_mensual.csv", f"{stem}_anomalias.csv", f"{stem}_emisiones.csv"]
+    if 'parquet' in args.formats:
+        report.to_parquet(f"{stem}.parquet", index=False)
+        monthly.to_parquet(f"{stem}_mensual.parquet", index=False)
+        anomalies.to_parquet(f"{stem}_anomalias.parquet", index=False)
+        emissions.to_parquet(f"{stem}_emisiones.parquet", index=False)
+        written += [f"{stem}.parquet", f"{stem}_mensual.parquet", f"{stem}_anomalias.parquet", f"{stem}_emisiones.parquet"]
+    if 'html' in args.formats:
+        write_html(f"{stem}.html", year, by, report, monthly, anomalies, emissions)
+        written.append(f"{stem}.html")
+
+    print(f"Informe {year}: {len(report)} grupos, {report['total_kwh'].sum():,.0f} kWh, "
+          f"€ {report['total_cost'].sum():,.2f}, {report['emisiones_co2'].sum():,.2f} tCO2e, "
+          f"{len(anomalies)} facturas anómalas")
+    for path in written:
+        print(f"  {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
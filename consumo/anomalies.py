@@ -0,0 +1,118 @@
+"""Detección de facturas anómalas comparando cada factura con el histórico de su suministro.
+
+Para cada factura se calcula el consumo diario (kWh entre los días facturados,
+para que las facturas largas o cortas sean comparables) y el precio medio
+(€/kWh). El consumo se desestacionaliza con un índice por tipo de energía y mes
+(la mediana, entre todos los suministros, del consumo de ese mes frente al
+habitual de cada suministro), de modo que la calefacción de enero no se marque
+como anomalía. Después cada valor se compara con la mediana de su propio CUPS
+usando la desviación absoluta mediana (MAD), que no se deja arrastrar por las
+propias anomalías: la puntuación es el z robusto `|x - mediana| / (1,4826·MAD)`.
+
+Todo se calcula con `groupby` sobre el conjunto completo, sin recorrer los
+suministros uno a uno.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Umbral habitual para el z robusto (Iglewicz y Hoaglin).
+DEFAULT_THRESHOLD = 3.5
+
+# Facturas mínimas de un suministro para poder puntuar las suyas.
+MIN_HISTORY = 4
+
+# La dispersión nunca se considera menor que esta fracción de la mediana, para
+# que un suministro muy estable no convierta cualquier variación en anomalía.
+MIN_RELATIVE_SPREAD = 0.05
+
+MAD_SCALE = 1.4826
+
+INVOICE_COLUMNS = ['CUPS', 'Centro', 'Comunidad Autónoma', 'Tipo de Energía', 'Tipo de Tensión', 'Número de factura',
+                   'Fecha desde', 'Fecha hasta', 'Año', 'Mes', 'Consumo_kWh', 'Coste Total']
+
+ANOMALY_COLUMNS = INVOICE_COLUMNS + ['kWh/día', 'kWh/día esperado', 'Desviación consumo (%)', 'z consumo',
+                                     '€/kWh', '€/kWh esperado', 'z precio', 'Puntuación', 'Motivo']
+
+
+def _robust_z(values, groups, floor):
+    """z robusto de cada valor frente a la mediana y la MAD de su grupo."""
+
+    median = values.groupby(groups, observed=True).transform('median')
+    mad = (values - median).abs().groupby(groups, observed=True).transform('median')
+    spread = np.maximum(MAD_SCALE * mad, floor * median.abs())
+    return (values - median) / spread.where(spread > 0), median
+
+
+def score_invoices(df, min_history=MIN_HISTORY):
+    """Puntúa todas las facturas frente al histórico de su CUPS.
+
+    `df` son facturas normalizadas de uno o varios años, de electricidad y gas.
+    Devuelve una fila por factura con el consumo diario observado y esperado,
+    el precio observado y esperado, los z robustos de ambos y la `Puntuación`
+    (el mayor de los dos en valor absoluto). Las facturas de suministros con
+    menos de `min_history` facturas quedan sin puntuar (NaN).
+    """
+
+    if df.empty:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+    # El gas no tiene tipo de tensión: las columnas ausentes quedan vacías.
+    out = df.reindex(columns=INVOICE_COLUMNS)
+    kwh = df['Consumo_kWh'].astype('float64')
+    cost = df['Coste Total'].astype('float64')
+    days = (df['Fecha hasta'] - df['Fecha desde']).dt.days.clip(lower=1) if 'Fecha hasta' in df else 30
+    daily = (kwh / days).where(kwh > 0)
+    price = (cost / kwh).where(kwh > 0)
+
+    cups = df['CUPS'].astype(str)
+    # Mes central del periodo facturado, para el índice estacional.
+    if 'Fecha hasta' in df:
+        month = (df['Fecha desde'] + (df['Fecha hasta'] - df['Fecha desde']) / 2).dt.month.fillna(df['Mes'])
+    else:
+        month = df['Mes']
+    energy = df['Tipo de Energía'].astype(str)
+
+    typical = daily.groupby(cups).transform('median')
+    seasonal = (daily / typical).groupby([energy, month.to_numpy()]).transform('median')
+    seasonal = seasonal.where(seasonal > 0, 1.0).fillna(1.0)
+    deseasonalized = daily / seasonal
+
+    z_kwh, median_kwh = _robust_z(deseasonalized, cups, MIN_RELATIVE_SPREAD)
+    z_price, median_price = _robust_z(price, cups, MIN_RELATIVE_SPREAD)
+    enough = daily.notna().groupby(cups).transform('sum') >= min_history
+    z_kwh, z_price = z_kwh.where(enough), z_price.where(enough)
+
+    out['kWh/día'] = daily
+    out['kWh/día esperado'] = median_kwh * seasonal
+    out['Desviación consumo (%)'] = (daily / out['kWh/día esperado'] - 1) * 100
+    out['z consumo'] = z_kwh
+    out['€/kWh'] = price
+    out['€/kWh esperado'] = median_price
+    out['z precio'] = z_price
+    out['Puntuación'] = np.fmax(z_kwh.abs(), z_price.abs())
+
+    reasons = np.full(len(out), '', dtype=object)
+    larger_kwh = z_kwh.abs().fillna(0).to_numpy() >= z_price.abs().fillna(0).to_numpy()
+    reasons[larger_kwh & (z_kwh > 0).to_numpy()] = 'Consumo alto'
+    reasons[larger_kwh & (z_kwh < 0).to_numpy()] = 'Consumo bajo'
+    reasons[~larger_kwh & (z_price > 0).to_numpy()] = 'Precio alto'
+    reasons[~larger_kwh & (z_price < 0).to_numpy()] = 'Precio bajo'
+    out['Motivo'] = reasons
+    return out[ANOMALY_COLUMNS]
+
+
+def detect_anomalies(df, threshold=DEFAULT_THRESHOLD, since=None, min_history=MIN_HISTORY):
+    """Facturas con `Puntuación` mayor que `threshold`, de mayor a menor.
+
+    Todo el histórico sirve de referencia, pero con `since` solo se devuelven las
+    facturas que empiezan en esa fecha o después (por ejemplo, las del último
+    export ingerido).
+    """
+
+    scored = score_invoices(df, min_history)
+    flagged = scored['Puntuación'] > threshold
+    if since is not None:
+        flagged &= scored['Fecha desde'] >= pd.Timestamp(since)
+    return scored[flagged].sort_values('Puntuación', ascending=False).reset_index(drop=True)
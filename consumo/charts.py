@@ -0,0 +1,124 @@
+"""Datos de los gráficos preparados en el servidor.
+
+Con el filtro por centro activo un gráfico de barras puede tener cientos de
+grupos: Plotly los dibuja todos, ilegibles, y la figura completa viaja al
+navegador en cada interacción. Aquí se dejan los `TOP_N` grupos mayores y el
+resto se suma en "Otros", y las figuras se construyen directamente con arrays
+numpy `float32`, que Plotly serializa como arrays tipados en base64 en lugar de
+listas de números en texto.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+TOP_N = 25
+
+OTHERS_LABEL = 'Otros'
+
+
+def bucket_top_n(df, by, value_columns, rank_by='Consumo_kWh', n=TOP_N, keys=()):
+    """Suma `value_columns` por `by` (y `keys`) conservando los `n` grupos con mayor `rank_by`.
+
+    Los demás grupos se suman en una única categoría `OTHERS_LABEL`. Devuelve el
+    DataFrame agregado y el orden de los grupos (de mayor a menor, "Otros" al final).
+    """
+
+    totals = df.groupby(by, observed=True)[rank_by].sum().sort_values(ascending=False)
+    top = [str(label) for label in totals.index[:n]]
+    labels = df[by].astype(str)
+    if len(totals) > n:
+        labels = labels.where(labels.isin(top), OTHERS_LABEL)
+        top.append(OTHERS_LABEL)
+    columns = list(dict.fromkeys([rank_by, *value_columns]))
+    bucketed = df[list(keys) + columns].assign(**{by: labels}).groupby([by, *keys], sort=False, observed=True)[columns].sum()
+    return bucketed.reset_index(), top
+
+
+def stacked_bar(categories, series, x_title=None, y_title=None, legend_title=None, value_format=',.0f'):
+    """Barras apiladas con una traza por serie (`{nombre: valores alineados con categories}`)."""
+
+    # Plotly se importa al dibujar el primer gráfico, no al arrancar la app.
+    import plotly.graph_objects as go
+
+    categories = list(categories)
+    fig = go.Figure([
+        go.Bar(name=str(name), x=categories, y=np.asarray(values, dtype=np.float32),
+               hovertemplate=f'%{{x}}<br>{name}: %{{y:{value_format}}}<extra></extra>')
+        for name, values in series.items()
+    ])
+    fig.update_layout(barmode='stack', legend_title_text=legend_title, yaxis_title=y_title,
+                      xaxis={'title': x_title, 'categoryorder': 'array', 'categoryarray': categories})
+    return fig
+
+
+def energy_by_group_figure(df_grouped, by, n=TOP_N):
+    """Consumo apilado por tipo de energía de cada grupo (la salida de `report.consumption_by`)."""
+
+    bucketed, order = bucket_top_n(df_grouped, by, ['Consumo_kWh'], n=n, keys=['Tipo de Energía'])
+    wide = bucketed.pivot_table(index=by, columns='Tipo de Energía', values='Consumo_kWh',
+                                aggfunc='sum', fill_value=0, observed=True).reindex(order, fill_value=0)
+    return stacked_bar(order, {energy: wide[energy].to_numpy() for energy in wide.columns},
+                       x_title=by, y_title='Consumo_kWh', legend_title='Tipo de Energía')
+
+
+def period_mix_figure(df_periods, by, periods, n=TOP_N):
+    """Reparto porcentual del consumo por periodo de cada grupo (la salida de `periods.period_summary`).
+
+    Los grupos se ordenan por cuota de punta; "Otros" se calcula a partir de los
+    kWh sumados, no promediando porcentajes.
+    """
+
+    kwh_columns = [f'kWh {p}' for p in periods]
+    bucketed, order = bucket_top_n(df_periods, by, kwh_columns, n=n)
+    kwh = bucketed[kwh_columns].to_numpy(dtype=np.float64)
+    total = kwh.sum(axis=1, keepdims=True)
+    mix = np.divide(kwh, total, out=np.zeros_like(kwh), where=total > 0) * 100
+    named = [label for label in bucketed[by] if label != OTHERS_LABEL]
+    ranking = pd.Series(mix[:, 0], index=bucketed[by]).loc[named].sort_values(ascending=False)
+    order = list(ranking.index) + [label for label in order if label == OTHERS_LABEL]
+    positions = pd.Index(bucketed[by]).get_indexer(order)
+    return stacked_bar(order, {p: mix[positions, j] for j, p in enumerate(periods)},
+                       x_title=by, y_title='% Consumo', legend_title='Periodo', value_format='.1f')
+
+
+def price_box_figure(df_periods, by, periods, n=TOP_N):
+    """Distribución del precio efectivo por periodo, con los cuartiles calculados aquí.
+
+    Solo viajan al navegador los cuartiles de cada periodo y los puntos: todos si
+    hay como mucho `n` grupos y, si hay más, solo los valores atípicos.
+    """
+
+    stats = {key: [] for key in ('q1', 'median', 'q3', 'lowerfence', 'upperfence')}
+    points_x, points_y, points_name = [], [], []
+    labels = df_periods[by].astype(str).to_numpy()
+    for p in periods:
+        values = df_periods[f'€/kWh {p}'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        values, names = values[valid], labels[valid]
+        if not len(values):
+            for key in stats:
+                stats[key].append(np.nan)
+            continue
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        # Los bigotes llegan al valor más extremo dentro de 1,5 veces el rango intercuartílico.
+        lower = values[values >= q1 - 1.5 * iqr].min()
+        upper = values[values <= q3 + 1.5 * iqr].max()
+        for key, value in zip(stats, (q1, median, q3, lower, upper)):
+            stats[key].append(value)
+        shown = slice(None) if len(values) <= n else (values < lower) | (values > upper)
+        points_x += [p] * len(values[shown])
+        points_y.append(values[shown])
+        points_name += list(names[shown])
+
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Box(x=list(periods), name='€/kWh', boxpoints=False,
+                           **{key: np.asarray(value, dtype=np.float32) for key, value in stats.items()}))
+    fig.add_trace(go.Scatter(x=points_x, y=np.concatenate(points_y).astype(np.float32) if points_y else [],
+                             text=points_name, mode='markers', name=by, marker={'size': 5, 'opacity': 0.6},
+                             hovertemplate='%{text}<br>%{x}: %{y:.4f} €/kWh<extra></extra>'))
+    fig.update_layout(showlegend=False, yaxis_title='€/kWh', xaxis={'title': 'Periodo', 'categoryorder': 'array',
+                                                                    'categoryarray': list(periods)})
+    return fig
@@ -0,0 +1,75 @@
+"""Cubo mensual preagregado para los KPIs y gráficos del informe.
+
+El cubo se construye una vez por carga de datos y conserva las mismas columnas
+de dimensión y de medida que las facturas, de modo que los filtros y los
+`groupby` del informe funcionan igual sobre él pero recorren unos pocos miles de
+celdas en lugar de todas las facturas.
+"""
+
+import pandas as pd
+
+from consumo.prorate import split_by_month
+from consumo.schema import concat_frames
+
+
+# El CUPS se incluye en el grano porque el número de suministros activos es un
+# recuento de valores distintos que no se puede sumar; como cada centro tiene
+# prácticamente un único CUPS, apenas aumenta el número de celdas. Lo mismo pasa
+# con la comercializadora, que hace falta para sus factores de emisión.
+CUBE_DIMENSIONS = ['Año', 'Mes', 'Comunidad Autónoma', 'Centro', 'CUPS', 'Comercializadora', 'Tipo de Energía',
+                   'Tipo de Tensión']
+
+CUBE_MEASURES = ['Consumo_kWh', 'Coste Total', 'Coste Energía', 'Coste Potencia',
+                 'Coste Impuestos', 'Coste Alquiler', 'Coste Otros']
+
+# Periodo de facturación con el que se reparte cada factura entre meses naturales.
+DATE_COLUMNS = ['Fecha desde', 'Fecha hasta']
+
+
+def build_cube(df):
+    """Agrega las facturas al grano del cubo sumando consumo y componentes de coste.
+
+    Si las facturas traen `Fecha desde` y `Fecha hasta`, cada una se reparte
+    entre los meses naturales que cubre (ver `consumo.prorate`); si no, cuenta
+    entera en su `Año` y `Mes`. Las columnas de medida que no existan (por
+    ejemplo, el desglose de costes en gas) se tratan como cero; las dimensiones
+    ausentes quedan como nulas.
+    """
+
+    if df.empty:
+        return pd.DataFrame(columns=CUBE_DIMENSIONS + CUBE_MEASURES)
+
+    dates = [col for col in DATE_COLUMNS if col in df.columns]
+    df = df.reindex(columns=list(dict.fromkeys(CUBE_DIMENSIONS + CUBE_MEASURES + dates)))
+    # El consumo se guarda en float32 por fila, pero se suma en float64.
+    df[CUBE_MEASURES] = df[CUBE_MEASURES].fillna(0).astype('float64')
+    if len(dates) == len(DATE_COLUMNS):
+        df = split_by_month(df, CUBE_MEASURES, *DATE_COLUMNS)
+    cube = df.groupby(CUBE_DIMENSIONS, dropna=False, observed=True, sort=False)[CUBE_MEASURES].sum()
+    return cube.reset_index()
+
+
+def merge_cubes(cubes):
+    """Combina varios cubos (o cubos parciales) sumando las celdas comunes."""
+
+    cubes = [cube for cube in cubes if not cube.empty]
+    if not cubes:
+        return pd.DataFrame(columns=CUBE_DIMENSIONS + CUBE_MEASURES)
+    if len(cubes) == 1:
+        return cubes[0]
+    merged = concat_frames(cubes)
+    return merged.groupby(CUBE_DIMENSIONS, dropna=False, observed=True, sort=False)[CUBE_MEASURES].sum().reset_index()
+
+
+def build_cube_streaming(chunks):
+    """Construye el cubo a partir de trozos de facturas normalizadas.
+
+    Cada trozo se agrega y se suma al cubo acumulado en cuanto llega, así que la
+    memoria depende del número de celdas del cubo y del tamaño del trozo, no del
+    total de facturas.
+    """
+
+    cube = build_cube(pd.DataFrame())
+    for chunk in chunks:
+        cube = merge_cubes([cube, build_cube(chunk)])
+    return cube
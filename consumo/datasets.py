@@ -0,0 +1,167 @@
+"""Caché de datasets compartida por todo el proceso.
+
+`st.cache_data` guarda una copia serializada de cada resultado y entrega otra
+copia a cada sesión, y su clave es solo la ruta del archivo: un CSV sustituido
+con el mismo nombre devuelve datos antiguos y nada limita la memoria total.
+
+`DatasetCache` guarda una única copia en memoria de cada dataset y entrega
+vistas: DataFrames que comparten los bloques de la copia cacheada y que, con
+Copy-on-Write, copian solo lo que el llamador modifique, de modo que nadie
+puede alterar los datos de las demás sesiones. Copy-on-Write es el único modo
+de pandas 3; con pandas 2.2 este módulo lo activa al importarse (para todo el
+proceso), y sin él las vistas no serían seguras. Los archivos se identifican por
+el hash de su contenido (memorizado por ruta, tamaño y fecha), las entradas
+menos usadas se descartan al superar el presupuesto de memoria y se lleva la
+cuenta de aciertos, fallos y descartes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from consumo.ingest import file_digest
+
+
+# Las vistas de `view` solo protegen la copia cacheada con Copy-on-Write (siempre activo desde pandas 3).
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def nbytes(value):
+    """Memoria aproximada de un valor cacheado (DataFrames, arrays, objetos con `nbytes` y tuplas de ellos)."""
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    # Arrays numpy y objetos que declaran su tamaño (por ejemplo, `MonthlySeries`).
+    return int(getattr(value, 'nbytes', 0))
+
+
+def view(value):
+    """Vista de un valor cacheado sin copiar los datos; modificarla no altera la copia cacheada."""
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # Con Copy-on-Write (activado arriba) la copia superficial comparte los datos hasta que se modifica.
+        return value.copy(deep=False)
+    if isinstance(value, np.ndarray):
+        array = value.view()
+        array.flags.writeable = False
+        return array
+    if isinstance(value, tuple):
+        return tuple(view(v) for v in value)
+    if isinstance(value, list):
+        return [view(v) for v in value]
+    if isinstance(value, dict):
+        return {k: view(v) for k, v in value.items()}
+    return value
+
+
+class DatasetCache:
+    """Caché LRU con presupuesto de memoria, segura para varias sesiones a la vez."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clave -> (valor, bytes)
+        self._paths = {}  # ruta -> clave de la versión cacheada del archivo
+        self._lock = threading.Lock()
+        self._loading = {}  # clave -> lock de la carga en curso
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+
+    def get(self, key, loader):
+        """Devuelve una vista del valor de `key`, calculándolo con `loader()` si no está.
+
+        Si varias sesiones piden a la vez la misma clave, solo una la calcula y
+        las demás esperan a su resultado. Los errores de `loader` no se cachean.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return view(self._entries[key][0])
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return view(self._entries[key][0])
+                self.misses += 1
+            try:
+                value = loader()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            self._put(key, value)
+            return view(value)
+
+    def get_file(self, file_path, kind, loader):
+        """Carga un archivo con `loader(file_path)`; la clave es el hash de su contenido.
+
+        Si el archivo ha cambiado desde la última carga, la versión anterior se
+        descarta de inmediato en lugar de esperar a que la expulse el LRU.
+        """
+
+        path = os.path.abspath(file_path)
+        key = ('archivo', kind, file_digest(path))
+        with self._lock:
+            previous = self._paths.get((path, kind))
+            if previous is not None and previous != key:
+                self._drop(previous)
+            self._paths[(path, kind)] = key
+        return self.get(key, lambda: loader(file_path))
+
+    def _put(self, key, value):
+        size = nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size)
+            self.bytes += size
+            # La entrada recién añadida se conserva aunque supere el presupuesto por sí sola.
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, file_path=None):
+        """Descarta las entradas de un archivo o, sin argumentos, todas."""
+
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+                self._paths.clear()
+                self.bytes = 0
+                return
+            path = os.path.abspath(file_path)
+            for path_kind in [pk for pk in self._paths if pk[0] == path]:
+                self._drop(self._paths.pop(path_kind))
+
+    def stats(self):
+        """Aciertos, fallos, descartes y ocupación actual."""
+
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'aciertos': self.hits, 'fallos': self.misses, 'descartes': self.evictions,
+                'tasa_aciertos': self.hits / requests if requests else None,
+                'entradas': len(self._entries), 'memoria_mb': self.bytes / (1024 * 1024),
+                'limite_mb': self.max_bytes / (1024 * 1024),
+            }
@@ -0,0 +1,154 @@
+"""Detección del formato de los exports a partir de una muestra de bytes.
+
+Los exports llegan con formatos distintos según la plataforma que los genera:
+con o sin BOM, separados por coma, punto y coma o tabulador, con cabeceras
+entrecomilladas y con números en formato español (`1.232,05`) o anglosajón
+(`1,232.05`). En lugar de adivinarlo por el nombre del archivo, se examinan los
+primeros kilobytes una sola vez y se pasan a `pd.read_csv` los parámetros
+exactos, de modo que el parser en C convierte números y fechas directamente.
+"""
+
+import codecs
+import csv
+import os
+import re
+from dataclasses import dataclass
+
+
+SAMPLE_BYTES = 64 * 1024
+
+SEPARATORS = [';', ',', '\t', '|']
+
+_NUMBER = re.compile(r'^-?\d[\d.,]*$')
+
+_DATE = re.compile(r'^(\d{1,4})([/.-])(\d{1,2})\2(\d{1,4})$')
+
+_dialects = {}
+
+
+@dataclass(frozen=True)
+class Dialect:
+    """Parámetros de lectura de un export."""
+
+    encoding: str = 'utf-8'
+    sep: str = ','
+    quotechar: str = '"'
+    decimal: str = '.'
+    thousands: str = ','
+    date_format: str = '%d/%m/%Y'
+
+    def read_csv_kwargs(self):
+        """Argumentos equivalentes para `pd.read_csv` (junto con `parse_dates`)."""
+
+        return {
+            'encoding': self.encoding, 'sep': self.sep, 'quotechar': self.quotechar,
+            'decimal': self.decimal, 'thousands': self.thousands, 'date_format': self.date_format,
+        }
+
+
+def _detect_encoding(sample):
+    """Devuelve la codificación de la muestra, distinguiendo UTF-8 con BOM."""
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # La muestra puede cortar un carácter multibyte al final.
+        sample.decode('utf-8', errors='strict')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        return 'utf-8' if e.start >= len(sample) - 3 else 'cp1252'
+
+
+def _detect_separator(lines):
+    """Elige el separador que produce más columnas con un número constante de campos."""
+
+    best, best_fields = ',', 1
+    for sep in SEPARATORS:
+        counts = [len(row) for row in csv.reader(lines, delimiter=sep)]
+        if not counts or counts[0] <= 1:
+            continue
+        consistent = sum(c == counts[0] for c in counts) / len(counts)
+        if consistent >= 0.9 and counts[0] > best_fields:
+            best, best_fields = sep, counts[0]
+    return best
+
+
+def _detect_decimal(cells):
+    """Decide el separador decimal por votación sobre las celdas numéricas de la muestra.
+
+    Una celda con punto y coma a la vez es concluyente (el último es el decimal);
+    con uno solo, solo cuenta si no va seguido de exactamente tres dígitos,
+    que podría ser un separador de miles.
+    """
+
+    votes = {'.': 0, ',': 0}
+    for cell in cells:
+        if not _NUMBER.match(cell):
+            continue
+        last_dot, last_comma = cell.rfind('.'), cell.rfind(',')
+        if last_dot >= 0 and last_comma >= 0:
+            votes['.' if last_dot > last_comma else ','] += 1
+        elif last_dot >= 0 or last_comma >= 0:
+            pos = max(last_dot, last_comma)
+            if len(cell) - pos - 1 != 3 and cell.count(cell[pos]) == 1:
+                votes[cell[pos]] += 1
+    return ',' if votes[','] > votes['.'] else '.'
+
+
+def _detect_date_format(cells):
+    """Deduce el formato de fecha (día primero salvo que la muestra indique lo contrario)."""
+
+    sep, found = '/', False
+    year_first = day_first = month_first = False
+    for cell in cells:
+        match = _DATE.match(cell)
+        if not match:
+            continue
+        first, sep, second = match.group(1), match.group(2), int(match.group(3))
+        found = True
+        if len(first) == 4:
+            year_first = True
+            continue
+        day_first |= int(first) > 12
+        month_first |= second > 12
+    if not found:
+        return '%d/%m/%Y'
+    if year_first:
+        return f'%Y{sep}%m{sep}%d'
+    if month_first and not day_first:
+        return f'%m{sep}%d{sep}%Y'
+    return f'%d{sep}%m{sep}%Y'
+
+
+def sniff_dialect(sample):
+    """Detecta el formato a partir de los primeros bytes de un export."""
+
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    lines = text.splitlines()
+    # La última línea de la muestra puede estar incompleta.
+    if len(lines) > 2 and not text.endswith(('\n', '\r')):
+        lines = lines[:-1]
+    sep = _detect_separator(lines)
+    # Comilla doble salvo que la cabecera venga entre comillas simples.
+    quotechar = "'" if lines and lines[0].startswith("'") and '"' not in lines[0] else '"'
+
+    cells = [cell.strip() for row in csv.reader(lines[1:], delimiter=sep, quotechar=quotechar) for cell in row]
+    decimal = _detect_decimal(cells)
+    return Dialect(
+        encoding=encoding, sep=sep, quotechar=quotechar,
+        decimal=decimal, thousands='.' if decimal == ',' else ',',
+        date_format=_detect_date_format(cells),
+    )
+
+
+def detect_dialect(file_path, sample_bytes=SAMPLE_BYTES):
+    """Devuelve el `Dialect` de un archivo, memorizado por ruta, tamaño y fecha."""
+
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _dialects:
+        with open(file_path, 'rb') as f:
+            _dialects[key] = sniff_dialect(f.read(sample_bytes))
+    return _dialects[key]
+
@@ -0,0 +1,163 @@
+"""Emisiones de gases de efecto invernadero (tCO₂e) de las facturas y del cubo.
+
+Las emisiones de cada fila son su consumo por un factor de emisión en tCO₂e
+por MWh (el mismo número que kgCO₂e por kWh). Los factores se leen de una tabla
+en la que cada fila fija el factor de una energía y, opcionalmente, de un año,
+un mes, una comercializadora o un CUPS concreto (vacío significa "cualquiera").
+A cada fila de datos se le aplica la fila de factores más específica que
+coincide: la de su CUPS antes que la de su comercializadora, y en ambos casos la
+del mes y el año antes que la general; a igualdad, la última de la tabla.
+
+La tabla parte de `DEFAULT_FACTORS` y se completa con
+`consumo/data/factores_emision.csv`, que se distribuye con los mismos factores
+generales y se amplía, por ejemplo, con el mix de cada comercializadora y año
+que publica la CNMC o con factor 0 para los suministros con garantía de origen
+renovable:
+
+    Tipo de Energía,Año,Mes,Comercializadora,CUPS,Factor
+    Electricidad,2024,,,,0.15
+    Electricidad,2025,,ENDESA,,0.12
+    Electricidad,,,,ES0000000000000000XX,0
+
+El factor se resuelve una vez por combinación distinta de las claves y se
+asigna a las filas por su código, así que aplicarlo al cubo (una fila por
+suministro y mes) cuesta lo mismo que un `groupby`. El gas cuenta como
+Alcance 1 (combustión en las propias instalaciones) y la electricidad como
+Alcance 2 (energía comprada).
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from consumo.report import CO2_FACTOR
+
+
+EMISSIONS_COLUMN = 'Emisiones_tCO2e'
+
+FACTOR_KEYS = ['Tipo de Energía', 'Año', 'Mes', 'Comercializadora', 'CUPS']
+
+# Peso de cada clave opcional en la prioridad de una fila de factores (la suma de las claves que fija).
+KEY_PRIORITY = {'CUPS': 8, 'Comercializadora': 4, 'Año': 2, 'Mes': 1}
+
+GAS_CO2_FACTOR = 0.182 # tCO2e por MWh de gas natural (PCS), factor de referencia de MITECO
+
+DEFAULT_FACTORS = [
+    {'Tipo de Energía': 'Electricidad', 'Factor': CO2_FACTOR},
+    {'Tipo de Energía': 'Gas', 'Factor': GAS_CO2_FACTOR},
+]
+
+FACTORS_PATH = os.path.join(os.path.dirname(__file__), "data", "factores_emision.csv")
+
+SCOPES = {'Gas': 'Alcance 1', 'Electricidad': 'Alcance 2'}
+
+SCOPE_COLUMNS = ['Alcance 1 (tCO₂e)', 'Alcance 2 (tCO₂e)', 'Total (tCO₂e)', 'Consumo_kWh', 'Intensidad (kgCO₂e/kWh)']
+
+
+def factor_table(rows=()):
+    """Tabla de factores: `DEFAULT_FACTORS` seguidos de `rows`, con la prioridad y el orden de cada fila."""
+
+    table = pd.DataFrame([*DEFAULT_FACTORS, *rows]).reindex(columns=FACTOR_KEYS + ['Factor'])
+    for col in ['Tipo de Energía', 'Comercializadora', 'CUPS']:
+        text = table[col].astype(object).where(table[col].notna(), '').astype(str).str.strip()
+        table[col] = text.where(text != '', None)
+    for col in ['Año', 'Mes']:
+        table[col] = pd.to_numeric(table[col], errors='coerce').astype('Int64')
+    table['Factor'] = pd.to_numeric(table['Factor'], errors='coerce')
+    table = table.dropna(subset=['Tipo de Energía', 'Factor']).reset_index(drop=True)
+    table['Prioridad'] = sum(weight * table[col].notna().to_numpy() for col, weight in KEY_PRIORITY.items())
+    table['Orden'] = table['Prioridad'] * len(table) + np.arange(len(table))
+    return table
+
+
+def load_factors(path=FACTORS_PATH):
+    """Factores por defecto más los del CSV de `path`, si existe."""
+
+    if path is None or not os.path.exists(path):
+        return factor_table()
+    rows = pd.read_csv(path, dtype=str, keep_default_na=False, skipinitialspace=True)
+    rows.columns = rows.columns.str.strip()
+    return factor_table(rows.to_dict('records'))
+
+
+def factors_signature(path=FACTORS_PATH):
+    """Tamaño y fecha del CSV de factores (None si no existe), para invalidar lo calculado con ellos."""
+
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime)
+
+
+def _as_text(values):
+    """Texto de cada valor (None si falta), convirtiendo solo las categorías distintas."""
+
+    values = values.astype('category')
+    text = values.cat.categories.astype(str).to_numpy(dtype=object)
+    codes = values.cat.codes.to_numpy()
+    return np.where(codes >= 0, text[np.maximum(codes, 0)], None)
+
+
+def emission_factors(df, factors):
+    """Factor (tCO₂e/MWh) de cada fila de `df`, o NaN si ninguna fila de `factors` le corresponde.
+
+    Las claves ausentes de `df` solo coinciden con filas de factores que no las fijan.
+    """
+
+    # Solo se distinguen las claves que fija alguna fila de la tabla: sin factores por CUPS, las
+    # combinaciones son energía × mes × comercializadora y no crecen con el número de suministros.
+    keys = [col for col in FACTOR_KEYS if col in df.columns and (col == 'Tipo de Energía' or factors[col].notna().any())]
+    if df.empty or 'Tipo de Energía' not in keys:
+        return np.full(len(df), np.nan)
+
+    codes = df.groupby(keys, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+    first_row = np.unique(codes, return_index=True)[1]
+    combos = df[keys].take(first_row).reset_index(drop=True)
+    for col in keys:
+        if col in ('Año', 'Mes'):
+            combos[col] = pd.to_numeric(combos[col], errors='coerce').astype('Int64')
+        else:
+            combos[col] = _as_text(combos[col])
+
+    resolved = np.full(len(combos), np.nan)
+    # De menos a más específica: cada nivel sobrescribe lo que resolvieron los anteriores.
+    for priority, level in factors.groupby('Prioridad', sort=True):
+        on = ['Tipo de Energía'] + [col for col, weight in KEY_PRIORITY.items() if priority & weight]
+        if any(col not in combos.columns for col in on):
+            continue
+        level = level.sort_values('Orden').drop_duplicates(on, keep='last')
+        matched = combos[on].merge(level[on + ['Factor']], how='left', on=on)['Factor'].to_numpy(dtype='float64')
+        resolved = np.where(np.isnan(matched), resolved, matched)
+    return resolved[codes]
+
+
+def add_emissions(df, factors):
+    """Copia de `df` con las emisiones (tCO₂e) de cada fila; las filas sin factor aplicable suman 0."""
+
+    kwh = df['Consumo_kWh'].to_numpy(dtype='float64') if 'Consumo_kWh' in df.columns else np.zeros(len(df))
+    emissions = np.nan_to_num(kwh * emission_factors(df, factors) / 1000)
+    return df.assign(**{EMISSIONS_COLUMN: emissions})
+
+
+def scope_report(df, by='Comunidad Autónoma'):
+    """Emisiones de Alcance 1 y 2 por grupo y año, con el consumo y la intensidad (kgCO₂e/kWh).
+
+    `df` es un cubo o unas facturas con la columna de emisiones (ver `add_emissions`).
+    """
+
+    keys = [by, 'Año']
+    if df.empty:
+        return pd.DataFrame(columns=keys + SCOPE_COLUMNS)
+
+    scope = df['Tipo de Energía'].astype(str).map(SCOPES).to_numpy()
+    emissions = df[EMISSIONS_COLUMN].to_numpy(dtype='float64')
+    measures = pd.DataFrame({col: df[col] for col in keys})
+    measures['Alcance 1 (tCO₂e)'] = np.where(scope == 'Alcance 1', emissions, 0)
+    measures['Alcance 2 (tCO₂e)'] = np.where(scope == 'Alcance 2', emissions, 0)
+    measures['Consumo_kWh'] = df['Consumo_kWh'].to_numpy(dtype='float64')
+
+    report = measures.groupby(keys, observed=True, sort=True).sum()
+    report['Total (tCO₂e)'] = report['Alcance 1 (tCO₂e)'] + report['Alcance 2 (tCO₂e)']
+    report['Intensidad (kgCO₂e/kWh)'] = report['Total (tCO₂e)'] * 1000 / report['Consumo_kWh'].where(report['Consumo_kWh'] > 0)
+    return report.reset_index()[keys + SCOPE_COLUMNS]
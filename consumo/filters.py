@@ -0,0 +1,106 @@
+"""Motor de filtros sobre códigos de categoría precalculados.
+
+Un `FilterIndex` se construye una vez por conjunto de datos: guarda para cada
+dimensión filtrable el código entero de cada fila y, para el año, un índice
+invertido con las filas de cada año. Aplicar un `FilterSpec` no crea DataFrames
+intermedios: se parte de las filas del año pedido y cada dimensión descarta las
+suyas con una búsqueda en una tabla de booleanos indexada por código.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+FILTER_COLUMNS = ['Año', 'Tipo de Energía', 'Comunidad Autónoma', 'Centro', 'Tipo de Tensión']
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Selección de la barra lateral. `None` significa "sin filtrar" en esa dimensión.
+
+    El filtro de tensión solo afecta a las filas de electricidad.
+    """
+
+    year: object = None
+    energy: object = None
+    communities: tuple = None
+    centros: tuple = None
+    tensions: tuple = None
+
+
+class FilterIndex:
+    """Códigos por dimensión de un DataFrame, listos para evaluar filtros."""
+
+    def __init__(self, df):
+        self._n_rows = len(df)
+        self._codes = {}
+        self._categories = {}
+        for col in FILTER_COLUMNS:
+            if col not in df.columns:
+                continue
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codes, categories = df[col].cat.codes.to_numpy(), df[col].cat.categories
+            else:
+                codes, categories = pd.factorize(df[col])
+            self._codes[col] = codes
+            self._categories[col] = pd.Index(categories)
+
+        self._rows_by_year = {}
+        if 'Año' in self._codes:
+            codes = self._codes['Año']
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(self._categories['Año']) + 1))
+            for code, year in enumerate(self._categories['Año'].tolist()):
+                self._rows_by_year[year] = order[bounds[code]:bounds[code + 1]]
+
+        self._is_electricity = self._allowed('Tipo de Energía', ['Electricidad'])
+
+    def _allowed(self, col, values):
+        """Tabla de booleanos por código; la última posición corresponde a los nulos (código -1)."""
+
+        if col not in self._codes:
+            return None
+        allowed = np.zeros(len(self._categories[col]) + 1, dtype=bool)
+        positions = self._categories[col].get_indexer(list(values))
+        allowed[positions[positions >= 0]] = True
+        return allowed
+
+    def values(self, col, rows=None):
+        """Valores distintos de una dimensión, opcionalmente limitados a unas filas."""
+
+        codes = self._codes[col] if rows is None else self._codes[col][rows]
+        present = np.unique(codes[codes >= 0])
+        return self._categories[col][present].tolist()
+
+    def select(self, spec):
+        """Devuelve las posiciones (ordenadas) de las filas que cumplen el filtro."""
+
+        if spec.year is not None:
+            rows = self._rows_by_year.get(spec.year, np.empty(0, dtype=np.intp))
+        else:
+            rows = np.arange(self._n_rows)
+
+        for col, values in (('Tipo de Energía', None if spec.energy is None else [spec.energy]),
+                            ('Comunidad Autónoma', spec.communities),
+                            ('Centro', spec.centros)):
+            if values is None:
+                continue
+            allowed = self._allowed(col, values)
+            if allowed is None:
+                return np.empty(0, dtype=np.intp)
+            rows = rows[allowed[self._codes[col][rows]]]
+
+        if spec.tensions is not None and 'Tipo de Tensión' in self._codes:
+            allowed = self._allowed('Tipo de Tensión', spec.tensions)
+            keep = allowed[self._codes['Tipo de Tensión'][rows]]
+            if self._is_electricity is not None:
+                keep |= ~self._is_electricity[self._codes['Tipo de Energía'][rows]]
+            rows = rows[keep]
+        return rows
+
+    def apply(self, df, spec):
+        """Filtra el DataFrame con el que se construyó el índice."""
+
+        return df.take(self.select(spec))
@@ -0,0 +1,156 @@
+"""Geometría local de las comunidades autónomas para el mapa.
+
+El GeoJSON se guarda simplificado dentro del paquete para que el mapa funcione
+sin conexión: la app nunca lo descarga. Se genera (descarga y simplificación)
+en una máquina con acceso a Internet, se incluye en `consumo/data/` y se
+comprueba antes de desplegar:
+
+    python -m consumo.geo            # descarga, simplifica y guarda el fichero
+    python -m consumo.geo --check    # falla si el fichero no está
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+
+GEOJSON_URL = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/spain-communities.geojson"
+
+GEOJSON_PATH = os.path.join(os.path.dirname(__file__), "data", "spain-communities.geojson")
+
+# Tolerancia de simplificación en grados (~1 km) y decimales conservados en las coordenadas.
+SIMPLIFY_TOLERANCE = 0.01
+
+COORD_DECIMALS = 4
+
+
+def _simplify_ring(coords, tolerance):
+    """Simplifica un anillo con Douglas-Peucker; devuelve None si degenera."""
+
+    pts = np.asarray(coords, dtype=float)[:, :2]
+    if len(pts) <= 4:
+        return pts
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        seg = pts[end] - pts[start]
+        rel = pts[start + 1:end] - pts[start]
+        norm = np.hypot(seg[0], seg[1])
+        if norm == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = start + 1 + k
+            keep[mid] = True
+            stack.extend([(start, mid), (mid, end)])
+    out = pts[keep]
+    return out if len(out) >= 4 else None
+
+
+def simplify_geojson(geojson, tolerance=SIMPLIFY_TOLERANCE, decimals=COORD_DECIMALS):
+    """Devuelve una copia del GeoJSON con polígonos simplificados y coordenadas redondeadas."""
+
+    def polygon(rings):
+        simplified = [_simplify_ring(ring, tolerance) for ring in rings]
+        if simplified[0] is None:
+            return None
+        return [np.round(ring, decimals).tolist() for ring in simplified if ring is not None]
+
+    features = []
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coords = polygon(geometry["coordinates"])
+        elif geometry["type"] == "MultiPolygon":
+            coords = [p for p in (polygon(rings) for rings in geometry["coordinates"]) if p]
+            # Las islas pequeñas pueden desaparecer; si no queda nada se conserva la mayor.
+            if not coords:
+                largest = max(geometry["coordinates"], key=lambda rings: len(rings[0]))
+                coords = [np.round(np.asarray(largest[0])[:, :2], decimals).tolist()]
+        else:
+            coords = geometry["coordinates"]
+        features.append({
+            "type": "Feature",
+            "properties": {"name": feature["properties"]["name"]},
+            "geometry": {"type": geometry["type"], "coordinates": coords},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def download_geojson(url=GEOJSON_URL, path=GEOJSON_PATH, timeout=30):
+    """Descarga el GeoJSON, lo simplifica y lo guarda en `path`."""
+
+    import requests
+
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    geojson = simplify_geojson(response.json())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return geojson
+
+
+def load_geojson(path=GEOJSON_PATH):
+    """Carga el GeoJSON local; si falta, el despliegue está incompleto y se lanza `FileNotFoundError`."""
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Falta la geometría de las comunidades ({path}); genérala con 'python -m consumo.geo' "
+                                "en una máquina con acceso a Internet e inclúyela en el despliegue.")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_name_index(geojson, names, threshold=80):
+    """Relaciona cada nombre de comunidad con el nombre de su polígono en el GeoJSON.
+
+    La coincidencia aproximada se hace una sola vez por nombre conocido; los
+    nombres sin una coincidencia por encima del umbral no se incluyen.
+    """
+
+    from thefuzz import process
+
+    feature_names = sorted({f["properties"]["name"] for f in geojson["features"]})
+    index = {}
+    for name in set(names):
+        if name in feature_names:
+            index[name] = name
+            continue
+        match = process.extractOne(name, feature_names)
+        if match and match[1] > threshold:
+            index[name] = match[0]
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m consumo.geo', description="Geometría simplificada de las comunidades para el mapa.")
+    parser.add_argument('--check', action='store_true', help="Solo comprueba que el fichero existe y se puede leer")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        try:
+            data = load_geojson()
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"{len(data['features'])} comunidades en {GEOJSON_PATH}")
+        return 0
+
+    data = download_geojson()
+    print(f"{len(data['features'])} comunidades guardadas en {GEOJSON_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
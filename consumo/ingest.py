@@ -0,0 +1,95 @@
+"""Caché persistente de ingesta.
+
+Cada CSV de facturas se normaliza una única vez y el resultado se guarda como
+fichero Arrow (Feather v2) junto a los datos, identificado por el hash del
+contenido del CSV. Las cargas posteriores leen el fichero mapeado en memoria en
+lugar de volver a interpretar el CSV, y la caché sobrevive a reinicios del
+proceso.
+"""
+
+import hashlib
+import os
+import tempfile
+
+
+# Se incrementa cada vez que cambia la normalización para invalidar los ficheros
+# ya generados.
+SCHEMA_VERSION = 8
+
+CACHE_DIR_NAME = ".cache"
+
+_digests = {}
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """Devuelve el hash del contenido del archivo, memorizado por ruta, tamaño y fecha."""
+
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        h = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def detect_energy_type(file_path):
+    """Clasifica un export como 'electricidad' o 'gas' a partir de su cabecera."""
+
+    with open(file_path, encoding="utf-8-sig", errors="replace") as f:
+        header = f.readline()
+    if "Tarifa de acceso" in header:
+        return "electricidad"
+    if "Grupo peaje" in header or "Poder calorífico" in header:
+        return "gas"
+    return None
+
+
+def sidecar_path(file_path, kind, cache_dir=None):
+    """Ruta del fichero Arrow asociado a un CSV para un tipo de normalización."""
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIR_NAME)
+    name = f"{kind}-v{SCHEMA_VERSION}-{file_digest(file_path)}.arrow"
+    return os.path.join(cache_dir, name)
+
+
+def read_normalized(file_path, kind, normalize, cache_dir=None):
+    """Carga un CSV normalizado, usando la caché Arrow si ya existe.
+
+    `normalize` recibe la ruta del CSV y devuelve el DataFrame normalizado; solo
+    se invoca la primera vez que se ve un contenido concreto. Si pyarrow no está
+    disponible se normaliza directamente sin caché.
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return normalize(file_path)
+
+    path = sidecar_path(file_path, kind, cache_dir)
+    if os.path.exists(path):
+        try:
+            return feather.read_table(path, memory_map=True).to_pandas()
+        except (OSError, pa.ArrowException):
+            # Fichero truncado o corrupto: se regenera a continuación.
+            pass
+
+    df = normalize(file_path)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Un temporal único por escritura: el hilo de recarga y el script pueden normalizar el mismo export a la vez.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        os.close(fd)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    except (OSError, pa.ArrowException):
+        # La caché es una optimización: si no se puede escribir, se sigue sin ella.
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
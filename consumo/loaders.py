@@ -0,0 +1,184 @@
+"""Lectura y normalización de los exports de facturas de electricidad y gas.
+
+Las funciones no dependen de Streamlit para que puedan usarse desde procesos
+auxiliares (ingesta en paralelo) y desde scripts.
+"""
+
+import os
+
+import pandas as pd
+
+from consumo.dialect import detect_dialect
+from consumo.provinces import alias_cache_path, assign_communities
+from consumo.schema import compact_frame
+
+
+CHUNK_ROWS = 100_000 # Filas por trozo en la ingesta por trozos
+
+
+def get_voltage_type(rate):
+    if rate in ["6.1TD", "6.2TD", "6.3TD", "6.4TD"]: return "Alta Tensión"
+    elif rate in ["2.0TD", "3.0TD"]: return "Baja Tensión"
+    return "No definido"
+
+
+def active_invoices(df):
+    """Filtra las facturas en estado ACTIVA."""
+    if df.empty:
+        return df
+    return df[df['Estado de factura'].str.upper() == 'ACTIVA'].reset_index(drop=True)
+
+
+def read_electricity_csv(file_path, chunksize=None, extra_columns=()):
+    """Lee las columnas relevantes de un CSV o TSV de electricidad; con `chunksize` devuelve un iterador por trozos.
+
+    `extra_columns` añade columnas del export que no forman parte de la normalización básica.
+    """
+    cols_to_use = [
+        'Número de factura', 'CUPS', 'Estado de factura', 'Fecha desde', 'Fecha hasta', 'Provincia', 'Nombre suministro',
+        'Tarifa de acceso', 'Consumo activa total (kWh)', 'Base imponible (€)',
+        'Importe TE (€)', 'Importe TP (€)', 'Importe impuestos (€)', 'Importe alquiler (€)',
+        'Importe otros conceptos (€)', 'Comercializadora', *extra_columns
+    ]
+    # Separador, comillas, formato numérico y de fecha se detectan una vez por archivo.
+    return pd.read_csv(
+        file_path,
+        usecols=lambda c: c.strip() in cols_to_use,
+        parse_dates=['Fecha desde', 'Fecha hasta'],
+        chunksize=chunksize,
+        **detect_dialect(file_path).read_csv_kwargs()
+    )
+
+
+def coerce_dates(df, columns=('Fecha desde', 'Fecha hasta')):
+    """Convierte a fecha las columnas que `read_csv` dejó como texto por alguna celda ilegible (que queda como NaT)."""
+    for col in columns:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce', dayfirst=True, format='mixed')
+
+
+def province_cache(file_path):
+    """Caché de provincias de los exports de la carpeta de `file_path` (ver `consumo.provinces`)."""
+    return alias_cache_path(os.path.dirname(file_path))
+
+
+def transform_electricity_data(df, province_cache_path=None):
+    """Normaliza un DataFrame (o un trozo) leído con `read_electricity_csv`."""
+    df.columns = df.columns.str.strip()
+    coerce_dates(df)
+    df.rename(columns={
+        'Nombre suministro': 'Centro', 'Base imponible (€)': 'Coste Total',
+        'Consumo activa total (kWh)': 'Consumo_kWh', 'Importe TE (€)': 'Coste Energía',
+        'Importe TP (€)': 'Coste Potencia', 'Importe impuestos (€)': 'Coste Impuestos',
+        'Importe alquiler (€)': 'Coste Alquiler', 'Importe otros conceptos (€)': 'Coste Otros'
+    }, inplace=True)
+
+    numeric_cols = ['Coste Total', 'Consumo_kWh', 'Coste Energía', 'Coste Potencia',
+                    'Coste Impuestos', 'Coste Alquiler', 'Coste Otros']
+    for col in numeric_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # La comercializadora se mantiene como texto (vacío si falta) para poder cruzarla con los factores de emisión.
+    if 'Comercializadora' in df.columns:
+        df['Comercializadora'] = df['Comercializadora'].fillna('').astype(str).str.strip()
+    # Las fechas vacías se quedan como NaT: una columna de fechas no admite 0 como relleno.
+    df.fillna({col: 0 for col in df.columns if not pd.api.types.is_datetime64_any_dtype(df[col])}, inplace=True)
+
+    df['Año'] = df['Fecha desde'].dt.year
+    df['Mes'] = df['Fecha desde'].dt.month
+    # Las provincias que no se reconocen quedan con comunidad 'Sin asignar' en lugar de descartarse.
+    df['Provincia'], df['Comunidad Autónoma'] = assign_communities(df['Provincia'], province_cache_path)
+    df['Tipo de Tensión'] = df['Tarifa de acceso'].apply(get_voltage_type)
+    df['Tipo de Energía'] = 'Electricidad'
+    return compact_frame(df)
+
+
+def normalize_electricity_data(file_path):
+    """Lee y normaliza un CSV o TSV de facturas de electricidad."""
+    return transform_electricity_data(read_electricity_csv(file_path), province_cache(file_path))
+
+
+def read_gas_csv(file_path, chunksize=None):
+    """Lee las columnas relevantes de un CSV de gas; con `chunksize` devuelve un iterador por trozos."""
+    # Columnas relevantes para el gas. 'Consumo' es el nombre genérico.
+    cols_to_use = [
+        'Número de factura', 'CUPS', 'Estado de factura', 'Fecha desde', 'Fecha hasta', 'Provincia', 'Nombre suministro',
+        'Consumo', 'Base imponible (€)', 'Comercializadora'
+    ]
+    return pd.read_csv(
+        file_path,
+        usecols=lambda c: c.strip() in cols_to_use,
+        parse_dates=['Fecha desde', 'Fecha hasta'],
+        chunksize=chunksize,
+        **detect_dialect(file_path).read_csv_kwargs()
+    )
+
+
+def transform_gas_data(df, province_cache_path=None):
+    """Normaliza un DataFrame (o un trozo) leído con `read_gas_csv`."""
+    df.columns = df.columns.str.strip()
+    coerce_dates(df)
+
+    # Renombra columnas para estandarizar
+    df.rename(columns={
+        'Nombre suministro': 'Centro',
+        'Base imponible (€)': 'Coste Total',
+        'Consumo': 'Consumo_kWh' # Asume que la columna 'Consumo' está en kWh
+    }, inplace=True)
+
+    # Convierte a numérico y rellena NAs
+    numeric_cols = ['Coste Total', 'Consumo_kWh']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # La comercializadora se mantiene como texto (vacío si falta) para poder cruzarla con los factores de emisión.
+    if 'Comercializadora' in df.columns:
+        df['Comercializadora'] = df['Comercializadora'].fillna('').astype(str).str.strip()
+    # Las fechas vacías se quedan como NaT: una columna de fechas no admite 0 como relleno.
+    df.fillna({col: 0 for col in df.columns if not pd.api.types.is_datetime64_any_dtype(df[col])}, inplace=True)
+
+    # Crea columnas adicionales
+    df['Año'] = df['Fecha desde'].dt.year
+    df['Mes'] = df['Fecha desde'].dt.month
+    # Las provincias que no se reconocen quedan con comunidad 'Sin asignar' en lugar de descartarse
+    df['Provincia'], df['Comunidad Autónoma'] = assign_communities(df['Provincia'], province_cache_path)
+    df['Tipo de Energía'] = 'Gas'
+
+    # Selecciona las columnas finales para mantener la consistencia
+    final_cols = ['Número de factura', 'Estado de factura', 'Fecha desde', 'Fecha hasta', 'Centro', 'Provincia',
+                  'Comunidad Autónoma', 'Consumo_kWh', 'Coste Total', 'Tipo de Energía', 'Año', 'Mes', 'CUPS']
+    final_cols += [col for col in ['Comercializadora'] if col in df.columns]
+    return compact_frame(df[final_cols])
+
+
+def normalize_gas_data(file_path):
+    """Lee y normaliza un único archivo CSV de gas, de forma similar a la electricidad."""
+    return transform_gas_data(read_gas_csv(file_path), province_cache(file_path))
+
+
+# --- Ingesta por trozos para exportaciones muy grandes ---
+
+READERS = {
+    'electricidad': (read_electricity_csv, transform_electricity_data),
+    'gas': (read_gas_csv, transform_gas_data),
+}
+
+
+def stream_invoices(file_path, kind, chunksize=CHUNK_ROWS, active_only=True):
+    """Lee un archivo por trozos de `chunksize` filas y devuelve cada trozo ya normalizado.
+
+    Solo las columnas necesarias se leen y, con `active_only`, las facturas no activas se descartan antes de normalizar,
+    de modo que la memoria máxima depende del tamaño del trozo y no del archivo.
+    """
+    read_csv, transform = READERS[kind]
+    for chunk in read_csv(file_path, chunksize=chunksize):
+        if active_only:
+            estado = chunk[next(c for c in chunk.columns if c.strip() == 'Estado de factura')]
+            chunk = chunk[estado.str.upper() == 'ACTIVA']
+        if not chunk.empty:
+            yield transform(chunk, province_cache(file_path))
+
+
+NORMALIZERS = {
+    'electricidad': normalize_electricity_data,
+    'gas': normalize_gas_data,
+}
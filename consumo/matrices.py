@@ -0,0 +1,50 @@
+"""Base común de los datos factura × periodo de los exports de electricidad.
+
+`consumo.periods`, `consumo.power` y `consumo.reactive` normalizan cada uno sus
+propias columnas por periodo y construyen sus matrices en `__init__`; unir
+varios exports quedándose con la última versión de cada factura, los días
+facturados y los cocientes sin divisiones por cero son comunes y están aquí.
+"""
+
+import numpy as np
+
+from consumo.schema import concat_frames
+
+
+# Clave de una factura entre exports: las repetidas se quedan con la versión del export más reciente.
+KEY_COLUMNS = ('Número de factura', 'CUPS', 'Fecha desde')
+
+# Días que se suponen a una factura sin fechas.
+DEFAULT_DAYS = 30
+
+
+def ratio(num, den):
+    """`num / den` elemento a elemento, con NaN donde `den` no es positivo."""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / np.where(den > 0, den, 1), np.nan)
+
+
+def billed_days(meta):
+    """Días facturados de cada factura (al menos 1; `DEFAULT_DAYS` si le faltan las fechas)."""
+
+    if meta.empty:
+        return np.zeros(0)
+    days = (meta['Fecha hasta'] - meta['Fecha desde']).dt.days
+    return days.fillna(DEFAULT_DAYS).clip(lower=1).to_numpy(dtype='float64')
+
+
+class InvoiceMatrices:
+    """Facturas con matrices factura × periodo; `meta` guarda las dimensiones de cada factura."""
+
+    def __len__(self):
+        return len(self.meta)
+
+    @classmethod
+    def from_frames(cls, frames, keys=KEY_COLUMNS):
+        """Une varios exports quedándose con la última versión de cada factura."""
+
+        df = concat_frames(frames)
+        if not df.empty:
+            df = df.drop_duplicates(subset=list(keys), keep='last').reset_index(drop=True)
+        return cls(df)
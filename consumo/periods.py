@@ -0,0 +1,146 @@
+"""Análisis del consumo eléctrico por periodo tarifario (P1 a P6).
+
+Las facturas se cargan como dos matrices factura × periodo (kWh e importe del
+término de energía) junto a un DataFrame con las dimensiones de cada factura.
+Los resúmenes por CUPS o por comunidad se calculan con `np.bincount` sobre los
+códigos de grupo, sin `groupby` ni bucles por suministro.
+
+Muchos exports traen vacío el importe de energía por periodo (`Importe TE
+P1(€)`...). En esas facturas el `Importe TE (€)` total se reparte en proporción
+a los kWh de cada periodo, de modo que el precio por periodo coincide con el
+medio de la factura; la columna `Desglose TE (%)` del resumen indica qué parte
+del importe procede de un desglose real.
+"""
+
+import numpy as np
+import pandas as pd
+
+from consumo.loaders import active_invoices, province_cache, read_electricity_csv, transform_electricity_data
+from consumo.matrices import InvoiceMatrices, ratio
+from consumo.schema import compact_frame
+
+
+PERIODS = ['P1', 'P2', 'P3', 'P4', 'P5', 'P6']
+
+KWH_COLUMNS = [f'kWh {p}' for p in PERIODS]
+
+COST_COLUMNS = [f'Coste TE {p}' for p in PERIODS]
+
+SOURCE_COLUMNS = {
+    **{f'Consumo activa {p} (kWh)': col for p, col in zip(PERIODS, KWH_COLUMNS)},
+    **{f'Importe TE {p}(€)': col for p, col in zip(PERIODS, COST_COLUMNS)},
+}
+
+META_COLUMNS = ['Número de factura', 'CUPS', 'Fecha desde', 'Año', 'Mes', 'Centro', 'Comunidad Autónoma',
+                'Tarifa de acceso', 'Tipo de Tensión', 'Tipo de Energía', 'Coste Energía']
+
+# Periodo valle (índice en PERIODS) de cada tarifa: en 2.0TD solo hay punta,
+# llano y valle (P1 a P3); en 3.0TD y 6.xTD el más barato es P6.
+OFFPEAK_PERIOD = {'2.0TD': 2}
+
+DEFAULT_OFFPEAK_PERIOD = 5
+
+
+def normalize_period_data(file_path):
+    """Lee un export de electricidad con el consumo y el importe de energía de cada periodo."""
+
+    df = transform_electricity_data(read_electricity_csv(file_path, extra_columns=list(SOURCE_COLUMNS)),
+                                    province_cache(file_path))
+    df = df.rename(columns=SOURCE_COLUMNS).reindex(columns=META_COLUMNS + ['Estado de factura'] + KWH_COLUMNS + COST_COLUMNS)
+    for col in KWH_COLUMNS + COST_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df[KWH_COLUMNS] = df[KWH_COLUMNS].astype('float32')
+    return compact_frame(df)
+
+
+class PeriodData(InvoiceMatrices):
+    """Facturas activas de electricidad con sus matrices de kWh e importe por periodo."""
+
+    def __init__(self, df):
+        df = active_invoices(df) if not df.empty else df
+        self.meta = df.reindex(columns=META_COLUMNS)
+        self.kwh = df.reindex(columns=KWH_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.cost = df.reindex(columns=COST_COLUMNS).to_numpy(dtype='float64', na_value=0)
+
+        # Facturas sin desglose por periodo: el importe de energía se reparte según los kWh.
+        energy_cost = self.meta['Coste Energía'].to_numpy(dtype='float64', na_value=0)
+        self.itemized = (self.cost != 0).any(axis=1)
+        missing = ~self.itemized & (energy_cost != 0)
+        share = np.nan_to_num(ratio(self.kwh[missing], self.kwh[missing].sum(axis=1)[:, None]))
+        self.cost[missing] = share * energy_cost[missing, None]
+
+
+def _group_sum(codes, values, n_groups):
+    """Suma las filas de una matriz factura × periodo por código de grupo."""
+
+    return np.stack([np.bincount(codes, weights=values[:, j], minlength=n_groups)
+                     for j in range(values.shape[1])], axis=1)
+
+
+def period_summary(data, by='CUPS', rows=None, shift_share=0.1):
+    """Resume el reparto por periodos de cada grupo (`'CUPS'`, `'Centro'` o `'Comunidad Autónoma'`).
+
+    Devuelve, por grupo, el consumo de cada periodo y su porcentaje, la cuota de
+    punta (P1), el precio efectivo del término de energía por periodo y el ahorro
+    estimado si `shift_share` del consumo en punta se desplazase al periodo valle
+    de su tarifa, al precio que ese mismo suministro ya paga en valle (cero si no
+    hay facturas con desglose por periodo). `rows`
+    limita el cálculo a unas posiciones (por ejemplo, las de un `FilterIndex`).
+    """
+
+    meta, kwh, cost, itemized = data.meta, data.kwh, data.cost, data.itemized
+    if rows is not None:
+        meta, kwh, cost, itemized = meta.take(rows), kwh[rows], cost[rows], itemized[rows]
+
+    cups_codes, cups = pd.factorize(meta['CUPS'])
+    valid = cups_codes >= 0
+    meta, kwh, cost, itemized, cups_codes = meta[valid], kwh[valid], cost[valid], itemized[valid], cups_codes[valid]
+
+    # Primero por suministro: el ahorro depende de los precios de cada CUPS.
+    n_cups = len(cups)
+    first_row = np.unique(cups_codes, return_index=True)[1]
+    kwh_cups = _group_sum(cups_codes, kwh, n_cups)
+    cost_cups = _group_sum(cups_codes, cost, n_cups)
+    itemized_cups = np.bincount(cups_codes, weights=cost.sum(axis=1) * itemized, minlength=n_cups)
+    # El diferencial punta-valle solo se calcula con facturas que traen desglose real.
+    price_cups = ratio(_group_sum(cups_codes, cost * itemized[:, None], n_cups),
+                       _group_sum(cups_codes, kwh * itemized[:, None], n_cups))
+    tariffs = meta['Tarifa de acceso'].astype(object).to_numpy()[first_row]
+    offpeak = np.array([OFFPEAK_PERIOD.get(t, DEFAULT_OFFPEAK_PERIOD) for t in tariffs], dtype=np.intp)
+    spread = price_cups[:, 0] - price_cups[np.arange(n_cups), offpeak]
+    savings_cups = np.nan_to_num(shift_share * kwh_cups[:, 0] * np.clip(spread, 0, None))
+
+    if by == 'CUPS':
+        labels = cups
+        kwh_g, cost_g, savings_g, itemized_g = kwh_cups, cost_cups, savings_cups, itemized_cups
+    else:
+        group_codes, labels = pd.factorize(meta[by])
+        cups_group = group_codes[first_row]
+        keep = cups_group >= 0
+        n_groups = len(labels)
+        kwh_g = _group_sum(cups_group[keep], kwh_cups[keep], n_groups)
+        cost_g = _group_sum(cups_group[keep], cost_cups[keep], n_groups)
+        savings_g = np.bincount(cups_group[keep], weights=savings_cups[keep], minlength=n_groups)
+        itemized_g = np.bincount(cups_group[keep], weights=itemized_cups[keep], minlength=n_groups)
+
+    total_kwh = kwh_g.sum(axis=1)
+    mix = ratio(kwh_g, total_kwh[:, None]) * 100
+    price = ratio(cost_g, kwh_g)
+
+    summary = pd.DataFrame({by: np.asarray(labels, dtype=object)})
+    if by == 'CUPS':
+        for col in ['Centro', 'Comunidad Autónoma', 'Tarifa de acceso']:
+            summary[col] = meta[col].astype(object).to_numpy()[first_row]
+    summary['Consumo_kWh'] = total_kwh
+    for j, p in enumerate(PERIODS):
+        summary[f'kWh {p}'] = kwh_g[:, j]
+    for j, p in enumerate(PERIODS):
+        summary[f'% {p}'] = mix[:, j]
+    for j, p in enumerate(PERIODS):
+        summary[f'€/kWh {p}'] = price[:, j]
+    summary['Cuota punta (%)'] = mix[:, 0]
+    summary['€/kWh medio'] = ratio(cost_g.sum(axis=1), total_kwh)
+    summary['Ahorro potencial (€)'] = savings_g
+    summary['Desglose TE (%)'] = ratio(itemized_g, cost_g.sum(axis=1)) * 100
+    summary = summary[summary['Consumo_kWh'] > 0]
+    return summary.sort_values('Ahorro potencial (€)', ascending=False).reset_index(drop=True)
@@ -0,0 +1,121 @@
+"""Ingesta en paralelo de todos los exports de la carpeta de datos.
+
+Cada archivo se clasifica como electricidad o gas por su cabecera y los que aún
+no tienen caché Arrow se normalizan a la vez en un grupo de procesos. Los
+procesos solo escriben la caché; el proceso principal la lee después mapeada en
+memoria, así que los DataFrames no tienen que viajar entre procesos.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from consumo.ingest import detect_energy_type, read_normalized, sidecar_path
+from consumo.loaders import NORMALIZERS, active_invoices, stream_invoices
+from consumo.schema import concat_frames
+from consumo.store import KEY_COLUMNS, InvoiceStore
+
+
+DATA_EXTENSIONS = ('.csv', '.tsv')
+
+
+def discover_files(data_dir):
+    """Devuelve `(ruta, tipo)` de cada export reconocido, del más antiguo al más reciente."""
+
+    files = []
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if not name.endswith(DATA_EXTENSIONS) or not os.path.isfile(path):
+            continue
+        kind = detect_energy_type(path)
+        if kind:
+            files.append((path, kind))
+    return sorted(files, key=lambda f: (os.path.getmtime(f[0]), f[0]))
+
+
+def _normalize_file(path, kind):
+    """Trabajo de cada proceso: normaliza el archivo y deja escrita su caché Arrow."""
+
+    return len(read_normalized(path, kind, NORMALIZERS[kind]))
+
+
+def normalize_parallel(files, max_workers=None):
+    """Normaliza en paralelo los archivos `(ruta, tipo)` que aún no tienen caché.
+
+    Devuelve un diccionario `{ruta: excepción}` con los archivos que fallaron.
+    """
+
+    pending = [(path, kind) for path, kind in files if not os.path.exists(sidecar_path(path, kind))]
+    errors = {}
+    if len(pending) <= 1 or max_workers == 1:
+        for path, kind in pending:
+            try:
+                _normalize_file(path, kind)
+            except Exception as e:
+                errors[path] = e
+        return errors
+
+    # 'spawn' evita heredar los hilos del servidor de Streamlit en los procesos hijos.
+    workers = min(max_workers or os.cpu_count() or 1, len(pending))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(_normalize_file, path, kind): path for path, kind in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+    return errors
+
+
+def sync_store(data_dir, max_workers=None, streaming_threshold=None):
+    """Incorpora al almacén incremental los exports nuevos de la carpeta.
+
+    Los archivos nuevos se normalizan en paralelo y luego se ingieren uno a uno,
+    del más antiguo al más reciente. Los que superan `streaming_threshold` bytes
+    se ingieren por trozos sin pasar por la caché. Devuelve los almacenes por
+    tipo de energía y los errores por archivo.
+    """
+
+    stores = {kind: InvoiceStore(data_dir, kind) for kind in NORMALIZERS}
+    new_files = [(path, kind) for path, kind in discover_files(data_dir) if not stores[kind].has_file(path)]
+
+    def is_large(path):
+        return streaming_threshold is not None and os.path.getsize(path) > streaming_threshold
+
+    errors = normalize_parallel([f for f in new_files if not is_large(f[0])], max_workers)
+    for path, kind in new_files:
+        if path in errors:
+            continue
+        try:
+            if is_large(path):
+                stores[kind].ingest_chunks(path, stream_invoices(path, kind, active_only=False))
+            else:
+                stores[kind].ingest(path, NORMALIZERS[kind])
+        except Exception as e:
+            errors[path] = e
+    return stores, errors
+
+
+def load_all(data_dir, max_workers=None):
+    """Carga todos los exports de la carpeta como un único histórico por tipo de energía.
+
+    No usa el almacén: las facturas repetidas entre exports se resuelven
+    quedándose con la del archivo más reciente. Devuelve `({tipo: facturas
+    activas}, {ruta: excepción})`.
+    """
+
+    files = discover_files(data_dir)
+    errors = normalize_parallel(files, max_workers)
+    frames = {kind: [] for kind in NORMALIZERS}
+    for path, kind in files:
+        if path not in errors:
+            frames[kind].append(read_normalized(path, kind, NORMALIZERS[kind]))
+
+    dataset = {}
+    for kind, dfs in frames.items():
+        df = concat_frames(dfs)
+        if not df.empty:
+            df = df.drop_duplicates(subset=KEY_COLUMNS, keep='last').reset_index(drop=True)
+        dataset[kind] = active_invoices(df)
+    return dataset, errors
@@ -0,0 +1,292 @@
+"""Optimización de la potencia contratada de cada suministro eléctrico.
+
+Las facturas se cargan como matrices factura × periodo (maxímetro, potencia
+contratada, importe del término de potencia y de los excesos) junto a las
+dimensiones de cada factura, igual que en `consumo.periods`.
+
+Para cada CUPS se simula el coste de potencia del histórico con distintos
+vectores de potencia contratada P1..P6: el término de potencia (precio por kW
+y día de cada periodo × potencia × días facturados) más los excesos (cada kW
+de maxímetro por encima de la potencia, a su precio de exceso). Como el coste
+es la suma de un término por periodo, primero se calcula una tabla suministro
+× nivel × periodo con el coste de cada nivel candidato en cada periodo; después
+todos los vectores candidatos (miles por suministro) se evalúan a la vez
+indexando esa tabla, sin recorrer los suministros uno a uno.
+
+Los niveles candidatos de cada CUPS son cuantiles de sus propios maxímetros, el
+maxímetro máximo de cada periodo y sus potencias actuales. En 3.0TD y 6.xTD las
+potencias deben ser crecientes de P1 a P6: los candidatos son todas las
+secuencias no decrecientes de niveles. En 2.0TD cada periodo se elige por
+separado.
+
+Los excesos de los suministros pequeños (contadores tipo 4 y 5) se facturan con
+el maxímetro de cada periodo, que es lo que traen los exports. En los mayores se
+facturan cuarto de hora a cuarto de hora y el maxímetro mensual no basta para
+estimarlos: en ellos solo se proponen potencias que cubren el maxímetro de cada
+periodo, igual que en 2.0TD, donde superar la potencia corta el suministro.
+Muchas facturas traen el maxímetro a cero en algunos periodos (sin lectura): los
+excesos se extrapolan de los meses leídos al resto, y los periodos con menos de
+`MIN_READINGS` lecturas conservan la potencia actual.
+
+El precio del término de potencia por periodo sale del desglose de la factura
+(`Importe TP P1(€)`...) cuando lo trae; si no, el `Importe TP (€)` total se
+reparte entre periodos según los precios de referencia de cada tarifa. Los
+excesos se valoran con lo facturado en `Importe excesos P1`... cuando lo hay y,
+si no, con el término de excesos regulado (2·tep·Kp por kW).
+
+Con la potencia actual, el término de potencia simulado coincide con el
+facturado mientras la potencia no haya cambiado en el periodo analizado, pero
+los excesos simulados no: salen de los maxímetros, y muchos exports no traen
+los excesos facturados (o se facturan por cuartos de hora). En esos suministros
+el coste actual simulado supera al facturado (en los exports reales, la mediana
+es un 0,7 % mayor, pero en algunos CUPS llega a más del triple); el resumen
+incluye el `Coste anual facturado (€)` para compararlos. Los ahorros se miden
+siempre entre costes simulados.
+"""
+
+import itertools
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from consumo.loaders import active_invoices, province_cache, read_electricity_csv, transform_electricity_data
+from consumo.periods import PERIODS
+from consumo.matrices import InvoiceMatrices, billed_days, ratio
+from consumo.schema import compact_frame
+
+
+MAXIMETER_COLUMNS = [f'Maxímetro {p}' for p in PERIODS]
+
+CONTRACTED_COLUMNS = [f'Potencia {p}' for p in PERIODS]
+
+POWER_COST_COLUMNS = [f'Coste TP {p}' for p in PERIODS]
+
+EXCESS_COLUMNS = [f'Excesos {p}' for p in PERIODS]
+
+SOURCE_COLUMNS = {
+    **{f'Maxímetro {p} (kW)': col for p, col in zip(PERIODS, MAXIMETER_COLUMNS)},
+    **{f'Potencia contratada {p} (kW)': col for p, col in zip(PERIODS, CONTRACTED_COLUMNS)},
+    **{f'Importe TP {p}(€)': col for p, col in zip(PERIODS, POWER_COST_COLUMNS)},
+    **{f'Importe excesos {p}': col for p, col in zip(PERIODS, EXCESS_COLUMNS)},
+}
+
+META_COLUMNS = ['Número de factura', 'CUPS', 'Fecha desde', 'Fecha hasta', 'Año', 'Mes', 'Centro',
+                'Comunidad Autónoma', 'Tarifa de acceso', 'Tipo de Tensión', 'Tipo de Energía', 'Coste Potencia']
+
+# Precios de referencia del término de potencia (peajes y cargos, €/kW y año). Solo
+# se usan para repartir el importe total entre periodos o, sin importe, como precio.
+REFERENCE_POWER_PRICES = {
+    '2.0TD': [26.93, 0.70, 0.0, 0.0, 0.0, 0.0],
+    '3.0TD': [19.42, 10.11, 4.23, 3.66, 2.29, 1.37],
+    '6.1TD': [29.10, 15.27, 6.59, 5.27, 1.80, 0.91],
+}
+
+DEFAULT_TARIFF = '3.0TD'
+
+# Término de excesos de potencia: 2·tep·Kp € por kW de exceso en cada periodo.
+EXCESS_TEP = 1.4064
+
+EXCESS_K = [1.0, 0.5, 0.37, 0.37, 0.37, 0.17]
+
+# Tarifas en las que cada periodo se contrata libremente (sin potencias crecientes).
+FREE_TARIFFS = ('2.0TD',)
+
+# Tarifas con limitador de potencia: la potencia contratada debe cubrir el maxímetro.
+LIMITER_TARIFFS = ('2.0TD',)
+
+# Potencia mínima del último periodo por tarifa (en 3.0TD, más de 15 kW).
+MIN_LAST_PERIOD_POWER = {'3.0TD': 15.0}
+
+# Potencia a partir de la cual los excesos se miden por cuartos de hora (contadores tipo 1 a 3).
+QUARTER_HOUR_EXCESS_KW = 50.0
+
+# Lecturas de maxímetro necesarias para proponer otra potencia en un periodo.
+MIN_READINGS = 3
+
+# Cuantiles de los maxímetros de cada suministro que se prueban como potencia.
+QUANTILES = (0.5, 0.75, 0.9)
+
+# Suministros que se evalúan juntos: acota la memoria de la matriz suministro × candidato × periodo.
+CHUNK_SUPPLIES = 16
+
+SUMMARY_COLUMNS = (
+    ['CUPS', 'Centro', 'Comunidad Autónoma', 'Tarifa de acceso', 'Facturas', 'Días']
+    + [f'Potencia actual {p}' for p in PERIODS] + [f'Potencia óptima {p}' for p in PERIODS]
+    + ['Coste anual facturado (€)', 'Coste anual actual (€)', 'Coste anual óptimo (€)', 'Ahorro anual (€)',
+       'Ahorro (%)', 'Excesos facturados (€)', 'Desglose TP (%)', 'Lecturas maxímetro']
+)
+
+
+def normalize_power_data(file_path):
+    """Lee un export de electricidad con el maxímetro, la potencia y los importes de potencia de cada periodo."""
+
+    df = transform_electricity_data(read_electricity_csv(file_path, extra_columns=list(SOURCE_COLUMNS)),
+                                    province_cache(file_path))
+    df = df.rename(columns=SOURCE_COLUMNS).reindex(columns=META_COLUMNS + ['Estado de factura'] + list(SOURCE_COLUMNS.values()))
+    for col in SOURCE_COLUMNS.values():
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    return compact_frame(df)
+
+
+class PowerData(InvoiceMatrices):
+    """Facturas activas de electricidad con sus matrices de potencia por periodo."""
+
+    def __init__(self, df):
+        df = active_invoices(df) if not df.empty else df
+        self.meta = df.reindex(columns=META_COLUMNS)
+        self.maximeter = df.reindex(columns=MAXIMETER_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.contracted = df.reindex(columns=CONTRACTED_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.power_cost = df.reindex(columns=POWER_COST_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.excess_cost = df.reindex(columns=EXCESS_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.days = billed_days(self.meta)
+
+
+@lru_cache(maxsize=None)
+def monotone_candidates(n_levels, n_periods=len(PERIODS)):
+    """Todas las secuencias no decrecientes de `n_periods` índices de nivel (una por fila)."""
+
+    return np.array(list(itertools.combinations_with_replacement(range(n_levels), n_periods)), dtype=np.intp)
+
+
+def _reference_prices(tariffs):
+    """Precio de referencia por kW y día de cada periodo para cada tarifa."""
+
+    default = REFERENCE_POWER_PRICES[DEFAULT_TARIFF]
+    return np.array([REFERENCE_POWER_PRICES.get(t, default) for t in tariffs], dtype='float64') / 365
+
+
+def optimize_power(data, rows=None, quantiles=QUANTILES):
+    """Potencia contratada de coste mínimo de cada CUPS y ahorro frente a la actual.
+
+    El coste de cada vector candidato se simula sobre las facturas de `rows`
+    (por ejemplo, las del año seleccionado según un `FilterIndex`) y se
+    anualiza con los días facturados. La potencia actual es la de la factura
+    más reciente. Devuelve una fila por CUPS ordenada por `Ahorro anual (€)`;
+    si ningún candidato mejora la potencia actual, la óptima es la actual. Los
+    CUPS sin lecturas de maxímetro (`Lecturas maxímetro` a 0) conservan su
+    potencia actual.
+    """
+
+    meta, maximeter, contracted = data.meta, data.maximeter, data.contracted
+    power_cost, excess_cost, days = data.power_cost, data.excess_cost, data.days
+    if rows is not None:
+        meta, maximeter, contracted = meta.take(rows), maximeter[rows], contracted[rows]
+        power_cost, excess_cost, days = power_cost[rows], excess_cost[rows], days[rows]
+
+    codes, cups = pd.factorize(meta['CUPS'])
+    valid = codes >= 0
+    if not valid.any():
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    # Facturas agrupadas por suministro y, dentro de cada uno, por fecha: las sumas por CUPS son `reduceat`.
+    dates = meta['Fecha desde'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    order = np.lexsort((dates, codes))[np.count_nonzero(~valid):]
+    meta, codes = meta.take(order), codes[order]
+    maximeter, contracted, days = maximeter[order], contracted[order], days[order]
+    power_cost, excess_cost = power_cost[order], excess_cost[order]
+    n_cups = len(cups)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    last = np.r_[starts[1:], len(codes)] - 1
+
+    def group_sum(values):
+        return np.add.reduceat(values, starts, axis=0)
+
+    current = contracted[last]
+    used = current > 0
+    tariffs = meta['Tarifa de acceso'].astype(object).to_numpy()[last]
+    days_cups = group_sum(days)
+
+    # Precio por kW y día de cada periodo: desglose real o importe total repartido con los precios de referencia.
+    reference = _reference_prices(tariffs)
+    kw_days = contracted * days[:, None]
+    itemized = (power_cost > 0).any(axis=1)
+    weights = reference[codes] * kw_days
+    billed = meta['Coste Potencia'].to_numpy(dtype='float64', na_value=0)
+    split = np.nan_to_num(ratio(weights, weights.sum(axis=1)[:, None])) * billed[:, None]
+    estimated = np.where(itemized[:, None], power_cost, split)
+    price = ratio(group_sum(estimated), group_sum(kw_days))
+    price = np.where(np.isnan(price) | (price <= 0), reference, price)
+
+    # Precio del kW de exceso: el facturado cuando la factura lo desglosa, si no el regulado.
+    regulated = 2 * EXCESS_TEP * np.array(EXCESS_K)
+    hinge_billed = group_sum(np.clip(maximeter - contracted, 0, None))
+    excess_billed = group_sum(excess_cost)
+    excess_price = np.where((excess_billed > 0) & (hinge_billed > 0), ratio(excess_billed, hinge_billed), regulated)
+
+    # Niveles candidatos de cada CUPS (redondeados al alza a 0,1 kW): cuantiles de sus maxímetros,
+    # el maxímetro máximo de cada periodo y sus potencias actuales.
+    readings = pd.DataFrame({'code': np.repeat(codes, len(PERIODS)), 'kW': maximeter.ravel()})
+    readings = readings[readings['kW'] > 0]
+    # Sin ninguna lectura el `unstack` no tiene columnas: se completan los CUPS y los cuantiles que falten.
+    levels = readings.groupby('code')['kW'].quantile(list(quantiles)).unstack()
+    levels = levels.reindex(index=range(n_cups), columns=list(quantiles)).to_numpy(dtype='float64')
+    levels = np.where(np.isnan(levels), current.max(axis=1)[:, None], np.ceil(levels * 10) / 10)
+    peak = np.ceil(np.maximum.reduceat(maximeter, starts, axis=0) * 10) / 10
+    peak_levels = np.where(peak > 0, peak, current)
+    current_levels = np.where(used, current, current.max(axis=1)[:, None])
+    levels = np.sort(np.concatenate([levels, peak_levels, current_levels], axis=1), axis=1)
+
+    # Tabla suministro × nivel × periodo con el coste de potencia y de excesos de cada nivel.
+    # Los excesos de los meses con lectura se extrapolan a los meses sin ella.
+    n_readings = group_sum((maximeter > 0).astype(np.int64))
+    coverage = np.nan_to_num(ratio(np.diff(np.r_[starts, len(codes)])[:, None], n_readings))
+    hinge = group_sum(np.clip(maximeter[:, None, :] - levels[codes][:, :, None], 0, None)) * coverage[:, None, :]
+    table = price[:, None, :] * levels[:, :, None] * days_cups[:, None, None] + excess_price[:, None, :] * hinge
+    observed = n_readings >= MIN_READINGS
+    table = np.where(used[:, None, :], table, 0.0)
+    # Sin lecturas de maxímetro en un periodo no hay con qué simular: se mantiene la potencia actual.
+    fixed = used & ~observed
+    table = np.where(fixed[:, None, :] & (levels[:, :, None] != current[:, None, :]), np.inf, table)
+    cover_peak = (current.max(axis=1) > QUARTER_HOUR_EXCESS_KW) | np.isin(tariffs, LIMITER_TARIFFS)
+    uncovered = cover_peak[:, None, None] & observed[:, None, :] & (levels[:, :, None] < peak[:, None, :])
+    table = np.where(uncovered, np.inf, table)
+    for tariff, minimum in MIN_LAST_PERIOD_POWER.items():
+        below = (tariffs == tariff)[:, None] & (levels <= minimum)
+        table[:, :, -1] = np.where(below, np.inf, table[:, :, -1])
+
+    current_hinge = group_sum(np.clip(maximeter - current[codes], 0, None)) * coverage
+    current_cost = np.where(used, price * current * days_cups[:, None] + excess_price * current_hinge, 0.0).sum(axis=1)
+
+    # Periodos libres: el mejor nivel de cada periodo por separado.
+    best_levels = table.argmin(axis=1)
+    best_cost = table.min(axis=1).sum(axis=1)
+
+    # Potencias crecientes: todas las secuencias no decrecientes de niveles, por bloques de suministros.
+    monotone = np.flatnonzero(~np.isin(tariffs, FREE_TARIFFS))
+    candidates = monotone_candidates(levels.shape[1])
+    period_index = np.arange(len(PERIODS))
+    for start in range(0, len(monotone), CHUNK_SUPPLIES):
+        block = monotone[start:start + CHUNK_SUPPLIES]
+        costs = table[block][:, candidates, period_index].sum(axis=2)
+        best = costs.argmin(axis=1)
+        best_levels[block] = candidates[best]
+        best_cost[block] = costs[np.arange(len(block)), best]
+
+    optimal = np.where(used, np.take_along_axis(levels, best_levels, axis=1), 0.0)
+    improves = best_cost < current_cost
+    optimal = np.where(improves[:, None], optimal, current)
+    best_cost = np.where(improves, best_cost, current_cost)
+
+    annual = ratio(365.0, days_cups)
+    first = starts
+    summary = pd.DataFrame({'CUPS': np.asarray(cups, dtype=object)})
+    for col in ['Centro', 'Comunidad Autónoma']:
+        summary[col] = meta[col].astype(object).to_numpy()[first]
+    summary['Tarifa de acceso'] = tariffs
+    summary['Facturas'] = np.diff(np.r_[starts, len(codes)])
+    summary['Días'] = days_cups
+    for j, p in enumerate(PERIODS):
+        summary[f'Potencia actual {p}'] = current[:, j]
+    for j, p in enumerate(PERIODS):
+        summary[f'Potencia óptima {p}'] = optimal[:, j]
+    summary['Coste anual facturado (€)'] = (group_sum(billed) + excess_billed.sum(axis=1)) * annual
+    summary['Coste anual actual (€)'] = current_cost * annual
+    summary['Coste anual óptimo (€)'] = best_cost * annual
+    summary['Ahorro anual (€)'] = (current_cost - best_cost) * annual
+    summary['Ahorro (%)'] = ratio(current_cost - best_cost, current_cost) * 100
+    summary['Excesos facturados (€)'] = excess_billed.sum(axis=1)
+    summary['Desglose TP (%)'] = ratio(group_sum(power_cost.sum(axis=1)), group_sum(estimated.sum(axis=1))) * 100
+    summary['Lecturas maxímetro'] = n_readings.sum(axis=1)
+    summary = summary[current.sum(axis=1) > 0]
+    return summary.sort_values('Ahorro anual (€)', ascending=False).reset_index(drop=True)[SUMMARY_COLUMNS]
@@ -0,0 +1,179 @@
+"""Instrumentación por etapas: tiempo, filas y memoria de cada parte del informe.
+
+Cada etapa se envuelve en un span con nombre:
+
+    profiler = Profiler()
+    with profiler.span('cubo', rows_in=len(df)) as span:
+        cube = build_cube(df)
+        span.rows_out = len(cube)
+
+Los spans se pueden anidar y se exportan como tabla, como JSON o en el formato
+de trazas de Chrome (`chrome://tracing`, Perfetto). Un `Profiler(enabled=False)`
+no mide nada y apenas cuesta, así que la instrumentación puede quedarse siempre
+en el código.
+
+Con `trace_memory` se mide además la memoria asignada en cada span con
+`tracemalloc`. Como `tracemalloc` es global al proceso y ralentiza a todas sus
+sesiones, no se enciende por sesión: se activa al arrancar el proceso con la
+variable de entorno `CONSUMO_TRACE_MEMORY=1` (ver `memory_tracing_enabled`) y
+no se detiene. Las cifras son del proceso entero, así que con varias sesiones
+midiendo a la vez incluyen lo que asignan las demás; el pico solo se reinicia
+cuando ningún otro profiler tiene un span abierto.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+MEMORY_TRACING_ENV = 'CONSUMO_TRACE_MEMORY'
+
+# Profilers con algún span abierto que mide memoria: mientras haya más de uno, nadie reinicia el pico.
+_measuring = set()
+
+_measuring_lock = threading.Lock()
+
+
+def memory_tracing_enabled():
+    """Indica si el proceso se arrancó con la medición de memoria activada (`CONSUMO_TRACE_MEMORY=1`)."""
+
+    return os.environ.get(MEMORY_TRACING_ENV, '').strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+
+
+def start_memory_tracing():
+    """Activa `tracemalloc` para todo el proceso; no se vuelve a detener."""
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+class Span:
+    """Una etapa medida. `rows_out` y `attrs` se pueden rellenar dentro del bloque."""
+
+    __slots__ = ('name', 'depth', 'start', 'duration', 'rows_in', 'rows_out', 'attrs',
+                 'mem_start', 'mem_alloc', 'mem_peak', '_peak')
+
+    def __init__(self, name, depth, rows_in=None, attrs=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.attrs = attrs or {}
+        self.start = self.duration = None
+        self.mem_start = self.mem_alloc = self.mem_peak = self._peak = None
+
+    def to_dict(self, origin):
+        return {
+            'etapa': self.name, 'nivel': self.depth,
+            'inicio_ms': (self.start - origin) * 1000, 'duracion_ms': self.duration * 1000,
+            'filas_entrada': self.rows_in, 'filas_salida': self.rows_out,
+            'memoria_asignada_kb': None if self.mem_alloc is None else self.mem_alloc / 1024,
+            'memoria_pico_kb': None if self.mem_peak is None else self.mem_peak / 1024,
+            **self.attrs,
+        }
+
+
+class _NullSpan:
+    """Span que descarta todo lo que se le asigna."""
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Registro de los spans de una ejecución del script."""
+
+    def __init__(self, enabled=True, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._stack = []
+        if self.trace_memory:
+            start_memory_tracing()
+
+    @contextmanager
+    def span(self, name, rows_in=None, **attrs):
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+
+        span = Span(name, len(self._stack), rows_in, attrs)
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            with _measuring_lock:
+                alone = not (_measuring - {self})
+                _measuring.add(self)
+                current, peak = tracemalloc.get_traced_memory()
+                if alone:
+                    # El pico se reinicia para cada span; se conserva el del span padre antes de perderlo.
+                    if self._stack and self._stack[-1]._peak is not None:
+                        self._stack[-1]._peak = max(self._stack[-1]._peak, peak)
+                    tracemalloc.reset_peak()
+            span.mem_start = current
+            # Con otro profiler midiendo, el pico no es solo de este span: no se mide.
+            span._peak = current if alone else None
+        self.spans.append(span)
+        self._stack.append(span)
+        span.start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - span.start
+            self._stack.pop()
+            if tracing:
+                with _measuring_lock:
+                    current, peak = tracemalloc.get_traced_memory()
+                    span.mem_alloc = current - span.mem_start
+                    alone = not (_measuring - {self})
+                    if span._peak is not None and alone:
+                        span._peak = max(span._peak, peak)
+                        span.mem_peak = span._peak - span.mem_start
+                        if self._stack and self._stack[-1]._peak is not None:
+                            self._stack[-1]._peak = max(self._stack[-1]._peak, span._peak)
+                        tracemalloc.reset_peak()
+                    elif self._stack:
+                        # Otro profiler midió a la vez: el pico del padre tampoco es fiable.
+                        self._stack[-1]._peak = None
+                    if not self._stack:
+                        _measuring.discard(self)
+
+    def total_ms(self):
+        """Tiempo transcurrido desde que se creó el profiler."""
+
+        return (time.perf_counter() - self.origin) * 1000
+
+    def to_frame(self):
+        """Spans como DataFrame, en orden de inicio."""
+
+        return pd.DataFrame([span.to_dict(self.origin) for span in self.spans if span.duration is not None])
+
+    def to_json(self):
+        """Spans y tiempo total como JSON."""
+
+        records = [span.to_dict(self.origin) for span in self.spans if span.duration is not None]
+        return json.dumps({'total_ms': self.total_ms(), 'spans': records}, ensure_ascii=False, indent=2, default=str)
+
+    def to_chrome_trace(self):
+        """Spans en el formato de eventos de trazas de Chrome (se abre en chrome://tracing o Perfetto)."""
+
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        for span in self.spans:
+            if span.duration is None:
+                continue
+            args = {k: v for k, v in span.to_dict(self.origin).items()
+                    if k not in ('etapa', 'nivel', 'inicio_ms', 'duracion_ms') and v is not None}
+            events.append({
+                'name': span.name, 'cat': 'informe', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': (span.start - self.origin) * 1e6, 'dur': span.duration * 1e6, 'args': args,
+            })
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, ensure_ascii=False, default=str)
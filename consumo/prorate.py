@@ -0,0 +1,81 @@
+"""Reparto de cada factura entre los meses naturales que cubre.
+
+Las facturas van de lectura a lectura: una factura "desde 31/07 hasta 31/08"
+corresponde a agosto, y una de "15/01 a 14/02" se reparte entre enero y
+febrero. Asignarla entera al mes de `Fecha desde` desplaza el consumo un mes y
+deforma la evolución mensual y las comparativas.
+
+`split_by_month` convierte cada factura en una fila por mes natural y reparte
+consumo y costes en proporción a los días de cada mes. `Fecha hasta` siempre
+es el último día cubierto, pero `Fecha desde` depende de la energía (ver
+`START_OFFSET_DAYS`). Todo se calcula con arrays sobre el conjunto completo,
+sin recorrer las facturas.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Días entre `Fecha desde` y el primer día cubierto. En electricidad es el de la lectura anterior (la
+# factura siguiente empieza en la `Fecha hasta` de la anterior); en gas ya es el primer día (la
+# siguiente empieza el día después). Las energías que no aparecen siguen el criterio de la electricidad.
+START_OFFSET_DAYS = {'Electricidad': 1, 'Gas': 0}
+
+DEFAULT_START_OFFSET = 1
+
+
+def _start_offsets(df, energy_column):
+    if energy_column not in df.columns:
+        return np.full(len(df), DEFAULT_START_OFFSET)
+    energy = df[energy_column].astype('category')
+    offsets = np.array([START_OFFSET_DAYS.get(e, DEFAULT_START_OFFSET) for e in energy.cat.categories] +
+                       [DEFAULT_START_OFFSET], dtype=np.int64)
+    return offsets[energy.cat.codes.to_numpy()]
+
+
+def split_by_month(df, measures, start_column='Fecha desde', end_column='Fecha hasta', energy_column='Tipo de Energía'):
+    """Devuelve una fila por factura y mes cubierto, con `measures` repartidas por días.
+
+    `Año` y `Mes` pasan a ser los del mes natural de cada fila. Las facturas sin
+    `end_column`, o que terminan antes de su primer día cubierto, quedan enteras
+    en el mes de `start_column`; las que no tienen `start_column` quedan como
+    están.
+    """
+
+    if df.empty:
+        return df
+
+    start = df[start_column].to_numpy(dtype='datetime64[D]')
+    end = df[end_column].to_numpy(dtype='datetime64[D]')
+    first_day = start + _start_offsets(df, energy_column).astype('timedelta64[D]')
+    missing = np.isnat(start) | np.isnat(end) | (end < first_day)
+    start = np.where(missing, start, first_day)
+    end = np.where(missing, start, end)
+
+    first_month = start.astype('datetime64[M]')
+    last_month = end.astype('datetime64[M]')
+    n_months = np.where(np.isnat(start), 1, (last_month - first_month).astype(np.int64) + 1)
+
+    # Una fila por factura y mes: el desplazamiento de cada fila dentro de su factura da el mes.
+    rows = np.repeat(np.arange(len(df)), n_months)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_months) - n_months, n_months)
+    month = first_month[rows] + offsets.astype('timedelta64[M]')
+
+    month_start = month.astype('datetime64[D]')
+    next_month_start = (month + np.timedelta64(1, 'M')).astype('datetime64[D]')
+    piece_start = np.maximum(start[rows], month_start)
+    piece_end = np.minimum(end[rows] + np.timedelta64(1, 'D'), next_month_start)
+    days = (piece_end - piece_start).astype(np.float64)
+    total_days = ((end - start).astype(np.int64) + 1).astype(np.float64)
+    share = np.where(np.isnat(month), 1.0, days / total_days[rows])
+
+    split = df.take(rows).reset_index(drop=True)
+    for col in measures:
+        if col in split.columns:
+            split[col] = split[col].to_numpy(dtype=np.float64) * share
+    # Sin mes natural (sin `start_column`) se conservan el año y el mes que tuviera la fila.
+    dated = pd.Series(~np.isnat(month))
+    months = month.astype(np.int64)
+    for col, values in (('Año', months // 12 + 1970), ('Mes', months % 12 + 1)):
+        split[col] = pd.Series(values).where(dated, split[col]).astype(split[col].dtype) if col in split else values
+    return split
@@ -0,0 +1,229 @@
+"""Normalización de provincias y asignación de su comunidad autónoma.
+
+Los exports escriben la provincia de formas distintas según el origen del
+suministro: con o sin tildes, en castellano o en la lengua cooficial
+("Gipuzkoa", "Guipúzcoa"), con el artículo detrás ("Palmas, Las") o con
+erratas. Cada valor distinto se resuelve una sola vez:
+
+1. Se pliega (sin tildes, minúsculas, sin puntuación) y se busca entre los
+   nombres oficiales y sus variantes, con el artículo delante o detrás y cada
+   parte de los nombres bilingües ("Valencia/València") por separado.
+2. Si no aparece, se busca la variante más parecida con `thefuzz`. Estas
+   resoluciones, las únicas costosas, se guardan en una caché persistente
+   dentro de la carpeta de caché de los datos (`alias_cache_path`).
+
+La columna se asigna después a través de los códigos de la categoría, de modo
+que el coste depende del número de valores distintos y no de filas. Los
+valores sin resolver no se descartan: su comunidad queda como
+`UNRESOLVED_COMMUNITY` y `unresolved_provinces` los enumera.
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from consumo.ingest import CACHE_DIR_NAME
+
+
+# Nombres oficiales (INE) de cada provincia y su comunidad autónoma.
+PROVINCE_COMMUNITY = {
+    'Almería': 'Andalucía', 'Cádiz': 'Andalucía', 'Córdoba': 'Andalucía', 'Granada': 'Andalucía',
+    'Huelva': 'Andalucía', 'Jaén': 'Andalucía', 'Málaga': 'Andalucía', 'Sevilla': 'Andalucía',
+    'Huesca': 'Aragón', 'Teruel': 'Aragón', 'Zaragoza': 'Aragón',
+    'Asturias': 'Principado de Asturias',
+    'Balears, Illes': 'Islas Baleares',
+    'Araba/Álava': 'País Vasco', 'Bizkaia': 'País Vasco', 'Gipuzkoa': 'País Vasco',
+    'Palmas, Las': 'Canarias', 'Santa Cruz de Tenerife': 'Canarias',
+    'Cantabria': 'Cantabria',
+    'Ávila': 'Castilla y León', 'Burgos': 'Castilla y León', 'León': 'Castilla y León',
+    'Palencia': 'Castilla y León', 'Salamanca': 'Castilla y León', 'Segovia': 'Castilla y León',
+    'Soria': 'Castilla y León', 'Valladolid': 'Castilla y León', 'Zamora': 'Castilla y León',
+    'Albacete': 'Castilla-La Mancha', 'Ciudad Real': 'Castilla-La Mancha', 'Cuenca': 'Castilla-La Mancha',
+    'Guadalajara': 'Castilla-La Mancha', 'Toledo': 'Castilla-La Mancha',
+    'Barcelona': 'Cataluña', 'Girona': 'Cataluña', 'Lleida': 'Cataluña', 'Tarragona': 'Cataluña',
+    'Ceuta': 'Ceuta',
+    'Badajoz': 'Extremadura', 'Cáceres': 'Extremadura',
+    'Coruña, A': 'Galicia', 'Lugo': 'Galicia', 'Ourense': 'Galicia', 'Pontevedra': 'Galicia',
+    'Rioja, La': 'La Rioja',
+    'Madrid': 'Comunidad de Madrid',
+    'Melilla': 'Melilla',
+    'Murcia': 'Región de Murcia',
+    'Navarra': 'Comunidad Foral de Navarra',
+    'Valencia/València': 'Comunidad Valenciana', 'Alicante/Alacant': 'Comunidad Valenciana',
+    'Castellón/Castelló': 'Comunidad Valenciana',
+}
+
+# Otras denominaciones habituales de cada provincia (las tildes, mayúsculas y el orden del artículo ya se ignoran).
+PROVINCE_ALIASES = {
+    'Araba/Álava': ['Álava', 'Araba'],
+    'Balears, Illes': ['Baleares', 'Islas Baleares', 'Illes Balears'],
+    'Bizkaia': ['Vizcaya', 'Biscay'],
+    'Gipuzkoa': ['Guipúzcoa'],
+    'Palmas, Las': ['Las Palmas de Gran Canaria', 'Gran Canaria'],
+    'Santa Cruz de Tenerife': ['S.C. Tenerife', 'Sta. Cruz de Tenerife', 'Tenerife'],
+    'Asturias': ['Principado de Asturias', 'Oviedo'],
+    'Cantabria': ['Santander'],
+    'Coruña, A': ['La Coruña', 'Coruña'],
+    'Ourense': ['Orense'],
+    'Girona': ['Gerona'],
+    'Lleida': ['Lérida'],
+    'Rioja, La': ['Logroño'],
+    'Murcia': ['Región de Murcia'],
+    'Navarra': ['Nafarroa', 'Comunidad Foral de Navarra'],
+    'Castellón/Castelló': ['Castellón de la Plana', 'Castelló de la Plana'],
+    'Madrid': ['Comunidad de Madrid'],
+}
+
+COMMUNITIES = sorted(set(PROVINCE_COMMUNITY.values()))
+
+UNRESOLVED_COMMUNITY = 'Sin asignar'
+
+# Puntuación mínima (0-100) de la coincidencia aproximada.
+FUZZY_THRESHOLD = 85
+
+CACHE_NAME = "provincias.json"
+
+_caches = {}
+
+_cache_lock = threading.Lock()
+
+
+def alias_cache_path(data_dir):
+    """Ruta de la caché de resoluciones aproximadas para los exports de `data_dir`."""
+
+    return os.path.join(data_dir, CACHE_DIR_NAME, CACHE_NAME)
+
+
+def fold(text):
+    """Texto sin tildes, en minúsculas y sin puntuación, para comparar nombres."""
+
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text).split())
+
+
+def _variants(name):
+    """Formas plegadas de un nombre: cada parte bilingüe y el artículo delante o detrás."""
+
+    variants = set()
+    for part in str(name).split('/'):
+        variants.add(fold(part))
+        if ',' in part:
+            base, article = part.rsplit(',', 1)
+            variants.add(fold(f"{article} {base}"))
+    variants.discard('')
+    return variants
+
+
+def _build_lookup():
+    lookup = {}
+    for province in PROVINCE_COMMUNITY:
+        for name in [province, *PROVINCE_ALIASES.get(province, [])]:
+            for variant in _variants(name):
+                lookup[variant] = province
+    return lookup
+
+
+_LOOKUP = _build_lookup()
+
+
+def _load_cache(path):
+    if path is None:
+        return _caches.setdefault(None, {})
+    if path not in _caches:
+        try:
+            with open(path, encoding="utf-8") as f:
+                _caches[path] = json.load(f)
+        except (OSError, ValueError):
+            _caches[path] = {}
+    return _caches[path]
+
+
+def _save_cache(path, entries):
+    """Añade resoluciones a la caché en disco (mezclando con lo que hayan escrito otros procesos)."""
+
+    if path is None:
+        return
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    stored.update(entries)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Sin permisos de escritura la caché sigue en memoria para este proceso.
+        pass
+
+
+def _exact_match(value):
+    return next((_LOOKUP[v] for v in sorted(_variants(value)) if v in _LOOKUP), None)
+
+
+def _fuzzy_match(key):
+    from thefuzz import fuzz, process
+
+    found = process.extractOne(key, list(_LOOKUP), scorer=fuzz.ratio, score_cutoff=FUZZY_THRESHOLD)
+    return _LOOKUP[found[0]] if found else None
+
+
+def resolve_provinces(values, cache_path=None):
+    """Nombre oficial (o None) de cada uno de `values`, que deberían ser valores distintos.
+
+    Sin `cache_path` las resoluciones aproximadas solo se recuerdan en memoria.
+    """
+
+    values = [str(v) for v in values]
+    exact = [_exact_match(v) for v in values]
+    with _cache_lock:
+        cache = _load_cache(cache_path)
+        # También se guardan los valores sin resolver, para no volver a buscarlos en cada export.
+        pending = {fold(v) for v, match in zip(values, exact) if match is None} - set(cache) - {''}
+        if pending:
+            found = {key: _fuzzy_match(key) for key in sorted(pending)}
+            cache.update(found)
+            _save_cache(cache_path, found)
+        return [match or cache.get(fold(v)) for v, match in zip(values, exact)]
+
+
+def assign_communities(provinces, cache_path=None):
+    """Provincia con su nombre oficial y comunidad autónoma de cada fila, ambas categóricas.
+
+    Cada valor distinto se resuelve una vez y las filas se asignan por sus
+    códigos. Las provincias sin resolver conservan su texto (vacío si falta) y
+    su comunidad es `UNRESOLVED_COMMUNITY`.
+    """
+
+    categorical = provinces.array if isinstance(provinces.dtype, pd.CategoricalDtype) else pd.Categorical(provinces)
+    # Los valores vacíos (código -1) se tratan como una categoría más, al final.
+    names = [str(v) for v in categorical.categories] + ['']
+    codes = np.where(categorical.codes < 0, len(names) - 1, categorical.codes)
+    matches = resolve_provinces(names, cache_path)
+    canonical = [match or name for name, match in zip(names, matches)]
+    communities = [PROVINCE_COMMUNITY[match] if match else UNRESOLVED_COMMUNITY for match in matches]
+
+    province_categories, province_codes = np.unique(np.asarray(canonical, dtype=object), return_inverse=True)
+    community_categories, community_codes = np.unique(np.asarray(communities, dtype=object), return_inverse=True)
+    province = pd.Categorical.from_codes(province_codes[codes], categories=province_categories).remove_unused_categories()
+    community = pd.Categorical.from_codes(community_codes[codes], categories=community_categories).remove_unused_categories()
+    return (pd.Series(province, index=provinces.index, name=provinces.name),
+            pd.Series(community, index=provinces.index, name='Comunidad Autónoma'))
+
+
+def unresolved_provinces(df):
+    """Provincias sin comunidad asignada y número de facturas de cada una."""
+
+    if df.empty or 'Comunidad Autónoma' not in df:
+        return pd.Series(dtype='int64', name='Facturas')
+    unresolved = df.loc[df['Comunidad Autónoma'] == UNRESOLVED_COMMUNITY, 'Provincia'].astype(str)
+    return unresolved.value_counts().rename('Facturas')
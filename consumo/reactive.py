@@ -0,0 +1,180 @@
+"""Penalizaciones por energía reactiva y retorno de las baterías de condensadores.
+
+Las facturas se cargan como dos matrices factura × periodo (kWh activos y kVArh
+de reactiva inductiva) junto a las dimensiones de cada factura, igual que en
+`consumo.periods`. El cos φ, la reactiva penalizada y su importe se calculan a
+la vez para todas las facturas y periodos del histórico.
+
+La reactiva se factura en todos los periodos salvo el valle (P6) cuando supera
+el 33 % de la activa (cos φ menor que 0,95): los kVArh por encima de ese 33 %
+se pagan a un precio que sube si el cos φ baja de 0,80. En 2.0TD no se factura.
+Una batería de condensadores que lleve el cos φ a `TARGET_COS_PHI` elimina la
+penalización; su tamaño se estima con el maxímetro del suministro y el peor
+tan φ de sus facturas, y el retorno con la penalización media anual.
+"""
+
+import numpy as np
+import pandas as pd
+
+from consumo.loaders import active_invoices, province_cache, read_electricity_csv, transform_electricity_data
+from consumo.periods import DEFAULT_OFFPEAK_PERIOD, KWH_COLUMNS, OFFPEAK_PERIOD, PERIODS
+from consumo.matrices import InvoiceMatrices, billed_days, ratio
+from consumo.schema import compact_frame
+
+
+KVARH_COLUMNS = [f'kVArh {p}' for p in PERIODS]
+
+SOURCE_COLUMNS = {
+    **{f'Consumo activa {p} (kWh)': col for p, col in zip(PERIODS, KWH_COLUMNS)},
+    **{f'Consumo reactiva inductiva {p} (kVarh)': col for p, col in zip(PERIODS, KVARH_COLUMNS)},
+    'Importe TR (€)': 'Coste Reactiva', 'Maxímetro total (kW)': 'Maxímetro',
+}
+
+META_COLUMNS = ['Número de factura', 'CUPS', 'Fecha desde', 'Fecha hasta', 'Año', 'Mes', 'Centro',
+                'Comunidad Autónoma', 'Tarifa de acceso', 'Tipo de Tensión', 'Tipo de Energía',
+                'Coste Reactiva', 'Maxímetro']
+
+# Tarifas sin término de reactiva.
+EXEMPT_TARIFFS = ('2.0TD',)
+
+# Reactiva libre de penalización: hasta el 33 % de la activa (cos φ de 0,95).
+FREE_RATIO = 0.33
+
+# Precio de los kVArh penalizados (€/kVArh) según el cos φ del periodo.
+PRICE_LOW_COS_PHI = 0.041554
+
+PRICE_VERY_LOW_COS_PHI = 0.062332
+
+VERY_LOW_COS_PHI = 0.80
+
+# Dimensionado y coste aproximado de las baterías de condensadores.
+TARGET_COS_PHI = 0.98
+
+CAPACITOR_STEP_KVAR = 5.0
+
+CAPACITOR_COST_PER_KVAR = 25.0
+
+CAPACITOR_FIXED_COST = 500.0
+
+SUMMARY_COLUMNS = ['CUPS', 'Centro', 'Comunidad Autónoma', 'Tarifa de acceso', 'Facturas', 'Años', 'Consumo_kWh',
+                   'kVArh', 'cos φ', 'Facturas penalizadas', 'kVArh penalizados', 'Penalización estimada (€)',
+                   'Importe TR facturado (€)', 'Penalización anual (€)', 'Batería (kVAr)', 'Inversión (€)',
+                   'Retorno (años)']
+
+
+def normalize_reactive_data(file_path):
+    """Lee un export de electricidad con la activa y la reactiva de cada periodo y el importe de reactiva."""
+
+    df = transform_electricity_data(read_electricity_csv(file_path, extra_columns=list(SOURCE_COLUMNS)),
+                                    province_cache(file_path))
+    df = df.rename(columns=SOURCE_COLUMNS).reindex(columns=META_COLUMNS + ['Estado de factura'] + KWH_COLUMNS + KVARH_COLUMNS)
+    for col in KWH_COLUMNS + KVARH_COLUMNS + ['Coste Reactiva', 'Maxímetro']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df[KWH_COLUMNS + KVARH_COLUMNS] = df[KWH_COLUMNS + KVARH_COLUMNS].astype('float32')
+    return compact_frame(df)
+
+
+def cos_phi(kwh, kvarh):
+    """Factor de potencia a partir de la energía activa y reactiva (NaN sin consumo)."""
+
+    apparent = np.hypot(kwh, kvarh)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(apparent > 0, kwh / np.where(apparent > 0, apparent, 1), np.nan)
+
+
+class ReactiveData(InvoiceMatrices):
+    """Facturas activas de electricidad con el cos φ y la penalización de cada periodo.
+
+    `cos_phi`, `penalized` (kVArh penalizados) y `penalty` (€) son matrices
+    factura × periodo calculadas al construir el objeto.
+    """
+
+    def __init__(self, df):
+        df = active_invoices(df) if not df.empty else df
+        self.meta = df.reindex(columns=META_COLUMNS)
+        self.kwh = df.reindex(columns=KWH_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.kvarh = df.reindex(columns=KVARH_COLUMNS).to_numpy(dtype='float64', na_value=0)
+        self.days = billed_days(self.meta)
+
+        # Periodos con término de reactiva: todos salvo el valle de la tarifa, y ninguno en las exentas.
+        tariffs = self.meta['Tarifa de acceso'].astype(object).to_numpy()
+        offpeak = np.array([OFFPEAK_PERIOD.get(t, DEFAULT_OFFPEAK_PERIOD) for t in tariffs], dtype=np.intp)
+        self.billable = np.arange(len(PERIODS))[None, :] != offpeak[:, None]
+        self.billable &= ~np.isin(tariffs, EXEMPT_TARIFFS)[:, None]
+
+        self.cos_phi = cos_phi(self.kwh, self.kvarh)
+        self.penalized = np.where(self.billable, np.clip(self.kvarh - FREE_RATIO * self.kwh, 0, None), 0.0)
+        price = np.where(self.cos_phi < VERY_LOW_COS_PHI, PRICE_VERY_LOW_COS_PHI, PRICE_LOW_COS_PHI)
+        self.penalty = self.penalized * price
+
+
+def reactive_summary(data, rows=None, target_cos_phi=TARGET_COS_PHI, cost_per_kvar=CAPACITOR_COST_PER_KVAR,
+                     fixed_cost=CAPACITOR_FIXED_COST):
+    """Penalización por reactiva de cada CUPS y retorno de la batería que la eliminaría.
+
+    La penalización anual es la facturada (`Importe TR`) si el export la trae y,
+    si no, la estimada, repartida entre los años cubiertos por las facturas de
+    `rows`. La batería se dimensiona para llevar el peor tan φ de las facturas
+    (en los periodos con término de reactiva) hasta `target_cos_phi` con el
+    maxímetro del suministro, o con su potencia media si no hay maxímetro.
+    Devuelve una fila por CUPS ordenada por penalización anual.
+    """
+
+    meta, kwh, kvarh, days = data.meta, data.kwh, data.kvarh, data.days
+    billable, penalized, penalty = data.billable, data.penalized, data.penalty
+    if rows is not None:
+        meta, kwh, kvarh, days = meta.take(rows), kwh[rows], kvarh[rows], days[rows]
+        billable, penalized, penalty = billable[rows], penalized[rows], penalty[rows]
+
+    codes, cups = pd.factorize(meta['CUPS'])
+    valid = codes >= 0
+    meta, kwh, kvarh, days, codes = meta[valid], kwh[valid], kvarh[valid], days[valid], codes[valid]
+    billable, penalized, penalty = billable[valid], penalized[valid], penalty[valid]
+    n_cups = len(cups)
+    if not n_cups:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    def group_sum(values):
+        return np.bincount(codes, weights=values, minlength=n_cups)
+
+    def group_max(values):
+        out = np.zeros(n_cups)
+        np.maximum.at(out, codes, values)
+        return out
+
+    first_row = np.unique(codes, return_index=True)[1]
+    kwh_total, kvarh_total = kwh.sum(axis=1), kvarh.sum(axis=1)
+    invoice_penalty = penalty.sum(axis=1)
+    estimated = group_sum(invoice_penalty)
+    billed = group_sum(meta['Coste Reactiva'].to_numpy(dtype='float64', na_value=0))
+    years = group_sum(days) / 365
+    annual = ratio(np.where(billed > 0, billed, estimated), years)
+
+    # Batería: peor tan φ de las facturas penalizadas, corregido hasta el objetivo con la potencia del suministro.
+    tan_phi = ratio((kvarh * billable).sum(axis=1), (kwh * billable).sum(axis=1))
+    worst_tan = group_max(np.where(invoice_penalty > 0, np.nan_to_num(tan_phi), 0.0))
+    target_tan = np.tan(np.arccos(target_cos_phi))
+    average_kw = group_max(ratio(kwh_total, days * 24))
+    peak_kw = group_max(meta['Maxímetro'].to_numpy(dtype='float64', na_value=0))
+    power_kw = np.where(peak_kw > 0, peak_kw, average_kw)
+    kvar = np.ceil(power_kw * np.clip(worst_tan - target_tan, 0, None) / CAPACITOR_STEP_KVAR) * CAPACITOR_STEP_KVAR
+    investment = np.where(kvar > 0, fixed_cost + cost_per_kvar * kvar, 0.0)
+
+    summary = pd.DataFrame({'CUPS': np.asarray(cups, dtype=object)})
+    for col in ['Centro', 'Comunidad Autónoma', 'Tarifa de acceso']:
+        summary[col] = meta[col].astype(object).to_numpy()[first_row]
+    summary['Facturas'] = np.bincount(codes, minlength=n_cups)
+    summary['Años'] = years
+    summary['Consumo_kWh'] = group_sum(kwh_total)
+    summary['kVArh'] = group_sum(kvarh_total)
+    summary['cos φ'] = cos_phi(summary['Consumo_kWh'].to_numpy(), summary['kVArh'].to_numpy())
+    summary['Facturas penalizadas'] = group_sum((invoice_penalty > 0).astype(np.float64)).astype(np.int64)
+    summary['kVArh penalizados'] = group_sum(penalized.sum(axis=1))
+    summary['Penalización estimada (€)'] = estimated
+    summary['Importe TR facturado (€)'] = billed
+    summary['Penalización anual (€)'] = annual
+    summary['Batería (kVAr)'] = kvar
+    summary['Inversión (€)'] = investment
+    summary['Retorno (años)'] = ratio(investment, np.where(kvar > 0, annual, 0))
+    summary = summary[summary['Consumo_kWh'] > 0]
+    return summary.sort_values('Penalización anual (€)', ascending=False).reset_index(drop=True)[SUMMARY_COLUMNS]
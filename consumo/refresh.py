@@ -0,0 +1,145 @@
+"""Recarga del histórico en segundo plano.
+
+Ingerir un export nuevo (normalizar, incorporar al almacén y agregar el cubo)
+puede llevar minutos con archivos grandes, y hacerlo dentro de la ejecución del
+script bloquea todos los controles del dashboard. `BackgroundRefresher` hace ese
+trabajo en un hilo propio: vigila la carpeta de datos, carga el histórico cuando
+aparece o cambia un export y, al terminar, sustituye de una vez la instantánea
+anterior. Mientras tanto las sesiones siguen viendo la última instantánea
+completa.
+
+La vigilancia de la carpeta es por sondeo (nombre, tamaño y fecha de cada
+archivo cada pocos segundos): no depende de notificaciones del sistema de
+archivos, que no siempre llegan en carpetas de red o montadas en contenedores.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from consumo.cube import build_cube
+from consumo.loaders import active_invoices
+from consumo.pipeline import DATA_EXTENSIONS, sync_store
+from consumo.schema import concat_frames
+
+
+POLL_SECONDS = 30
+
+
+def folder_signature(data_dir):
+    """Nombre, tamaño y fecha de modificación de cada export de la carpeta, en orden."""
+
+    signature = []
+    for entry in os.scandir(data_dir):
+        if entry.name.endswith(DATA_EXTENSIONS) and entry.is_file():
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_size, stat.st_mtime))
+    return tuple(sorted(signature))
+
+
+@dataclass(frozen=True)
+class HistorySnapshot:
+    """Histórico completo de la carpeta tal como estaba en `signature`."""
+
+    signature: tuple
+    electricity: pd.DataFrame
+    gas: pd.DataFrame
+    cube: pd.DataFrame
+    errors: dict = field(default_factory=dict)
+    loaded_at: float = 0.0
+    seconds: float = 0.0
+
+
+def load_history(data_dir, signature=None, streaming_threshold=None, max_workers=None):
+    """Sincroniza el almacén con la carpeta y devuelve el histórico activo y su cubo.
+
+    `errors` relaciona el nombre de cada archivo que no se pudo incorporar con
+    el mensaje de error.
+    """
+
+    start = time.perf_counter()
+    if signature is None:
+        signature = folder_signature(data_dir)
+    stores, errors = sync_store(data_dir, max_workers=max_workers, streaming_threshold=streaming_threshold)
+    electricity = active_invoices(stores['electricidad'].read())
+    gas = active_invoices(stores['gas'].read())
+    return HistorySnapshot(
+        signature=signature, electricity=electricity, gas=gas,
+        cube=build_cube(concat_frames([electricity, gas])),
+        errors={os.path.basename(path): str(e) for path, e in errors.items()},
+        loaded_at=time.time(), seconds=time.perf_counter() - start,
+    )
+
+
+class BackgroundRefresher:
+    """Hilo que mantiene al día una instantánea del histórico de `data_dir`.
+
+    `load(data_dir, signature)` construye la instantánea; se llama al arrancar y
+    cada vez que cambia la firma de la carpeta. Si falla, se conserva la
+    instantánea anterior y el error queda en `error`.
+    """
+
+    def __init__(self, data_dir, load=load_history, poll_seconds=POLL_SECONDS):
+        self.data_dir = data_dir
+        self._load = load
+        self.poll_seconds = poll_seconds
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.loading = False
+        self.error = None
+
+    @property
+    def snapshot(self):
+        """Última instantánea completa (None hasta que termina la primera carga)."""
+
+        with self._lock:
+            return self._snapshot
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='consumo-refresh', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def refresh_now(self):
+        """Comprueba la carpeta sin esperar al siguiente sondeo."""
+
+        self._wake.set()
+
+    def wait(self, timeout=None):
+        """Espera a que exista una primera instantánea y la devuelve."""
+
+        self._ready.wait(timeout)
+        return self.snapshot
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                signature = folder_signature(self.data_dir)
+                current = self.snapshot
+                if current is None or current.signature != signature:
+                    self.loading = True
+                    snapshot = self._load(self.data_dir, signature)
+                    # Sustitución atómica: las sesiones ven la instantánea anterior o la nueva, nunca una a medias.
+                    with self._lock:
+                        self._snapshot = snapshot
+                    self.error = None
+            except Exception as e:
+                self.error = e
+            finally:
+                self.loading = False
+                if self._snapshot is not None or self.error is not None:
+                    self._ready.set()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
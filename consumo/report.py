@@ -0,0 +1,142 @@
+"""KPIs y agregados del informe anual, sin dependencia de Streamlit.
+
+Todas las funciones reciben facturas normalizadas o un cubo mensual (ver
+`consumo.cube`), que tienen las mismas columnas, y devuelven números o
+DataFrames listos para pintar o exportar.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+CO2_FACTOR = 0.19 # Factor de emisión en tCO2e por MWh (toneladas de CO2 por megavatio-hora)
+
+ELECTRICITY_COST_COMPONENTS = ['Coste Energía', 'Coste Potencia', 'Coste Impuestos', 'Coste Alquiler', 'Coste Otros']
+
+ENERGY_TYPES = ['Electricidad', 'Gas']
+
+MONTH_NAMES = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
+
+
+def latest_billed_year(invoices, cube):
+    """Año del último periodo facturado, que es el que el informe muestra por defecto.
+
+    El reparto por meses naturales puede dejar en el cubo unos pocos días del año
+    siguiente; el año por defecto es el del día siguiente a la última lectura
+    (`Fecha desde`), o el más reciente del cubo si no hay facturas cargadas.
+    """
+
+    if 'Fecha desde' in invoices and invoices['Fecha desde'].notna().any():
+        return int((invoices['Fecha desde'].max() + pd.Timedelta(days=1)).year)
+    return int(cube['Año'].max())
+
+
+def compute_kpis(df, co2_factor=CO2_FACTOR):
+    """Indicadores globales del informe: consumo y coste por energía, suministros, emisiones y coste medio.
+
+    Las emisiones de Alcance 1 (gas) y 2 (electricidad) salen de la columna
+    `Emisiones_tCO2e` (ver `consumo.emissions`); si `df` no la tiene, solo se
+    estiman las de la electricidad con `co2_factor`.
+    """
+
+    is_elec = (df['Tipo de Energía'] == 'Electricidad').to_numpy()
+    is_gas = (df['Tipo de Energía'] == 'Gas').to_numpy()
+    kwh = df['Consumo_kWh'].to_numpy(dtype='float64')
+    cost = df['Coste Total'].to_numpy(dtype='float64')
+
+    kpis = {
+        'kwh_elec': kwh[is_elec].sum(),
+        'cost_elec': cost[is_elec].sum(),
+        'kwh_gas': kwh[is_gas].sum(),
+        'cost_gas': cost[is_gas].sum(),
+        'num_suministros': df['CUPS'].nunique(),
+    }
+    kpis['total_kwh'] = kpis['kwh_elec'] + kpis['kwh_gas']
+    kpis['total_cost'] = kpis['cost_elec'] + kpis['cost_gas']
+    if 'Emisiones_tCO2e' in df.columns:
+        emissions = df['Emisiones_tCO2e'].to_numpy(dtype='float64')
+        kpis['emisiones_alcance1'] = emissions[is_gas].sum()
+        kpis['emisiones_alcance2'] = emissions[is_elec].sum()
+    else:
+        kpis['emisiones_alcance1'] = 0.0
+        kpis['emisiones_alcance2'] = (kpis['kwh_elec'] * co2_factor) / 1000
+    kpis['emisiones_co2'] = kpis['emisiones_alcance1'] + kpis['emisiones_alcance2']
+    kpis['coste_medio'] = kpis['total_cost'] / kpis['total_kwh'] if kpis['total_kwh'] > 0 else 0
+    return kpis
+
+
+def cost_breakdown(df):
+    """Desglose del coste eléctrico por componente (`Componente`, `Coste`)."""
+
+    df_elec = df[df['Tipo de Energía'] == 'Electricidad']
+    components = [col for col in ELECTRICITY_COST_COMPONENTS if col in df_elec.columns]
+    if df_elec.empty or not components:
+        return pd.DataFrame(columns=['Componente', 'Coste'])
+    breakdown = df_elec[components].sum().reset_index()
+    breakdown.columns = ['Componente', 'Coste']
+    return breakdown
+
+
+def consumption_by(df, column):
+    """Consumo por `column` y tipo de energía, de mayor a menor."""
+
+    grouped = df.groupby([column, 'Tipo de Energía'], observed=True)['Consumo_kWh'].sum().reset_index()
+    return grouped.sort_values(by='Consumo_kWh', ascending=False)
+
+
+def monthly_consumption(df, year):
+    """Consumo de cada mes del año por tipo de energía, con los meses sin datos a cero."""
+
+    template = pd.MultiIndex.from_product(
+        [pd.to_datetime([f'{year}-{m}-01' for m in range(1, 13)]), ENERGY_TYPES],
+        names=['Fecha', 'Tipo de Energía']
+    ).to_frame(index=False)
+
+    df = df[df['Año'] == year]
+    if df.empty:
+        return template.assign(Consumo_kWh=0.0)
+    fechas = pd.to_datetime(pd.DataFrame({'year': df['Año'], 'month': df['Mes'], 'day': 1})).rename('Fecha')
+    monthly = df.groupby([fechas, 'Tipo de Energía'], observed=True)['Consumo_kWh'].sum().reset_index()
+    monthly['Tipo de Energía'] = monthly['Tipo de Energía'].astype(str)
+    return pd.merge(template, monthly, on=['Fecha', 'Tipo de Energía'], how='left').fillna(0)
+
+
+def community_report(df, year=None, by='Comunidad Autónoma', co2_factor=CO2_FACTOR):
+    """KPIs del informe para todas las comunidades (o centros) a la vez.
+
+    Equivale a aplicar `compute_kpis` a cada comunidad por separado, pero con un
+    único `groupby`: devuelve una fila por grupo y año. Las emisiones siguen las
+    mismas reglas que en `compute_kpis`.
+    """
+
+    if year is not None:
+        df = df[df['Año'] == year]
+    keys = [by, 'Año']
+    if df.empty:
+        return pd.DataFrame(columns=keys)
+
+    energy = df['Tipo de Energía'].astype(str)
+    measures = pd.DataFrame({col: df[col] for col in keys})
+    for label, kind in (('elec', 'Electricidad'), ('gas', 'Gas')):
+        mask = (energy == kind).to_numpy()
+        measures[f'kwh_{label}'] = np.where(mask, df['Consumo_kWh'].to_numpy(dtype='float64'), 0)
+        measures[f'cost_{label}'] = np.where(mask, df['Coste Total'].to_numpy(dtype='float64'), 0)
+    for col in ELECTRICITY_COST_COMPONENTS:
+        if col in df.columns:
+            measures[col] = np.where((energy == 'Electricidad').to_numpy(), df[col].to_numpy(dtype='float64'), 0)
+    if 'Emisiones_tCO2e' in df.columns:
+        emissions = df['Emisiones_tCO2e'].to_numpy(dtype='float64')
+        measures['emisiones_alcance1'] = np.where((energy == 'Gas').to_numpy(), emissions, 0)
+        measures['emisiones_alcance2'] = np.where((energy == 'Electricidad').to_numpy(), emissions, 0)
+
+    grouped = measures.groupby(keys, observed=True, sort=True)
+    report = grouped.sum()
+    report['num_suministros'] = df.groupby(keys, observed=True, sort=True)['CUPS'].nunique()
+    report['total_kwh'] = report['kwh_elec'] + report['kwh_gas']
+    report['total_cost'] = report['cost_elec'] + report['cost_gas']
+    if 'emisiones_alcance2' not in report.columns:
+        report['emisiones_alcance1'] = 0.0
+        report['emisiones_alcance2'] = report['kwh_elec'] * co2_factor / 1000
+    report['emisiones_co2'] = report['emisiones_alcance1'] + report['emisiones_alcance2']
+    report['coste_medio'] = (report['total_cost'] / report['total_kwh'].where(report['total_kwh'] > 0)).fillna(0)
+    return report.reset_index()
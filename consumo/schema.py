@@ -0,0 +1,51 @@
+"""Esquema compacto en memoria de las facturas normalizadas.
+
+Las dimensiones se guardan como categorías, el año y el mes como enteros
+pequeños (anulables: una factura con `Fecha desde` ilegible no tiene año ni
+mes, pero no impide cargar el resto del archivo) y el consumo como float32. Los importes se mantienen en float64 para
+que los totales en euros conserven los céntimos.
+"""
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+CATEGORY_COLUMNS = ['Estado de factura', 'Centro', 'Provincia', 'Comunidad Autónoma', 'Tarifa de acceso',
+                    'Tipo de Tensión', 'Tipo de Energía', 'CUPS', 'Comercializadora']
+
+COMPACT_DTYPES = {'Año': 'Int16', 'Mes': 'Int8', 'Consumo_kWh': 'float32'}
+
+
+def compact_frame(df):
+    """Convierte las columnas presentes del DataFrame a su tipo compacto."""
+
+    dtypes = {col: 'category' for col in CATEGORY_COLUMNS if col in df.columns}
+    dtypes.update({col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns})
+    return df.astype(dtypes)
+
+
+def concat_frames(frames):
+    """Concatena DataFrames compactos sin perder el tipo categórico.
+
+    `pd.concat` convierte a texto las categorías cuyos valores difieren entre
+    DataFrames; aquí se unifican antes para que el resultado siga siendo compacto.
+    """
+
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+
+    frames = [df.copy(deep=False) for df in frames]
+    for col in CATEGORY_COLUMNS:
+        present = [df[col] for df in frames if col in df.columns]
+        if not present or not all(isinstance(s.dtype, pd.CategoricalDtype) for s in present):
+            continue
+        categories = union_categoricals([s.array for s in present], ignore_order=True).categories
+        for df in frames:
+            if col in df.columns:
+                df[col] = df[col].cat.set_categories(categories)
+            else:
+                df[col] = pd.Categorical.from_codes([-1] * len(df), categories=categories)
+    return pd.concat(frames, ignore_index=True)
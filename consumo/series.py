@@ -0,0 +1,101 @@
+"""Series mensuales de todos los años y energías, precalculadas por suministro.
+
+La comparativa anual cargaba un segundo export y repetía el `groupby` mensual
+en cada interacción, y solo para electricidad. `MonthlySeries` reorganiza el
+cubo de todo el histórico en un array denso (medida × suministro × mes) sobre
+un eje temporal continuo: comparar cualquier conjunto de años, de electricidad
+o de gas, o calcular el acumulado de 12 meses es sumar las filas seleccionadas
+de ese array y recortar el tramo de meses correspondiente.
+"""
+
+import dataclasses
+
+import numpy as np
+import pandas as pd
+
+from consumo.filters import FilterIndex
+from consumo.report import MONTH_NAMES
+
+
+# Cada serie es una combinación de estas dimensiones (en la práctica, un CUPS).
+SERIES_DIMENSIONS = ['Comunidad Autónoma', 'Centro', 'CUPS', 'Tipo de Energía', 'Tipo de Tensión']
+
+SERIES_MEASURES = ['Consumo_kWh', 'Coste Total']
+
+
+class MonthlySeries:
+    """Consumo y coste mensual de cada suministro en arrays densos, con un índice de filtros."""
+
+    def __init__(self, cube):
+        # Las celdas sin año ni mes (facturas con `Fecha desde` ilegible) no tienen sitio en el eje temporal.
+        cube = cube[cube['Año'].notna() & cube['Mes'].notna()]
+        months =(cube['Año'].to_numpy(dtype=np.int64) * 12 + cube['Mes'].to_numpy(dtype=np.int64) - 1)
+        self.first_month = int(months.min()) if len(months) else 0
+        self.n_months = int(months.max()) - self.first_month + 1 if len(months) else 0
+
+        series_codes = cube.groupby(SERIES_DIMENSIONS, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+        first_row = np.unique(series_codes, return_index=True)[1]
+        self.meta = cube[SERIES_DIMENSIONS].take(first_row).reset_index(drop=True)
+        self.index = FilterIndex(self.meta)
+
+        n_series = len(self.meta)
+        flat = series_codes * self.n_months + (months - self.first_month)
+        self.values = np.zeros((len(SERIES_MEASURES), n_series, self.n_months))
+        for i, measure in enumerate(SERIES_MEASURES):
+            self.values[i] = np.bincount(flat, weights=cube[measure].to_numpy(dtype=np.float64),
+                                         minlength=n_series * self.n_months).reshape(n_series, self.n_months)
+        self.values.flags.writeable = False
+        self.years = list(range(self.first_month // 12, (self.first_month + self.n_months - 1) // 12 + 1)) \
+            if self.n_months else []
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + int(self.meta.memory_usage(deep=True).sum())
+
+    def select(self, spec):
+        """Series que cumplen el filtro; el año del filtro no se aplica (las series cubren todos)."""
+
+        return self.index.select(dataclasses.replace(spec, year=None))
+
+    def total(self, rows=None, measure='Consumo_kWh'):
+        """Suma mensual de las series seleccionadas sobre todo el eje temporal."""
+
+        values = self.values[SERIES_MEASURES.index(measure)]
+        return values.sum(axis=0) if rows is None else values[rows].sum(axis=0)
+
+    def dates(self):
+        """Primer día de cada mes del eje temporal."""
+
+        if not self.n_months:
+            return pd.DatetimeIndex([])
+        first = pd.Timestamp(year=self.first_month // 12, month=self.first_month % 12 + 1, day=1)
+        return pd.date_range(first, periods=self.n_months, freq='MS')
+
+    def _year_slice(self, totals, year):
+        """Los 12 meses de un año del eje temporal (NaN fuera del rango con datos)."""
+
+        out = np.full(12, np.nan)
+        start = year * 12 - self.first_month
+        lo, hi = max(start, 0), min(start + 12, self.n_months)
+        if lo < hi:
+            out[lo - start:hi - start] = totals[lo:hi]
+        return out
+
+    def yearly(self, years, rows=None, measure='Consumo_kWh'):
+        """Una columna por año con sus 12 meses (`Mes`, `Mes_str`, `<año>`...)."""
+
+        totals = self.total(rows, measure)
+        comparison = pd.DataFrame({'Mes': range(1, 13), 'Mes_str': MONTH_NAMES})
+        for year in years:
+            comparison[str(year)] = self._year_slice(totals, year)
+        return comparison
+
+    def rolling(self, rows=None, measure='Consumo_kWh', window=12):
+        """Suma móvil de `window` meses, indexada por mes (NaN hasta completar la primera ventana)."""
+
+        totals = self.total(rows, measure)
+        cumulative = np.concatenate([[0.0], np.cumsum(totals)])
+        rolled = np.full(self.n_months, np.nan)
+        if self.n_months >= window:
+            rolled[window - 1:] = cumulative[window:] - cumulative[:-window]
+        return pd.Series(rolled, index=self.dates(), name=measure)
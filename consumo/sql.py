@@ -0,0 +1,310 @@
+"""Motor SQL embebido (DuckDB) sobre el almacén de facturas.
+
+Alternativa opcional a los filtros y agregados en pandas: las consultas se
+ejecutan directamente sobre los segmentos Arrow del almacén incremental
+(`consumo.store`) sin cargarlos en pandas. DuckDB solo lee las columnas que usa
+cada consulta, aplica los filtros al leer los segmentos, reparte el trabajo
+entre todos los núcleos y, si una consulta no cabe en `memory_limit`, usa
+ficheros temporales en `Data/.duckdb`.
+
+Vistas disponibles:
+
+- `facturas_electricidad`, `facturas_gas`: última versión de cada factura.
+- `facturas`: facturas activas de ambas energías, con las columnas comunes.
+- `facturas_mensuales`: cada factura repartida entre los meses naturales que
+  cubre, como en `consumo.prorate` (`Año` y `Mes` son los del mes natural), con
+  sus emisiones (`Emisiones_tCO2e`).
+- `factores_emision`: la tabla de factores de emisión (ver `consumo.emissions`).
+
+`cube` y `kpis` expresan en SQL los mismos cálculos que `consumo.cube` y
+`consumo.report.compute_kpis`, con un `FilterSpec`. `query` ejecuta consultas
+libres: solo admite una única sentencia SELECT (`check_select`), con el acceso
+a ficheros y la configuración bloqueados, así que no puede crear ni borrar
+vistas de la conexión que comparten todas las sesiones.
+
+DuckDB no forma parte de las dependencias: sin él `available()` devuelve False
+y el dashboard sigue con pandas.
+
+    python -m consumo.sql --data-dir Data "SELECT Centro, sum(Consumo_kWh) FROM facturas GROUP BY ALL"
+"""
+
+import argparse
+import importlib.util
+import os
+import threading
+
+import pandas as pd
+
+from consumo.cube import CUBE_DIMENSIONS, CUBE_MEASURES
+from consumo.emissions import EMISSIONS_COLUMN, FACTOR_KEYS, load_factors
+from consumo.prorate import DEFAULT_START_OFFSET, START_OFFSET_DAYS
+from consumo.store import KEY_COLUMNS, STORE_DIR_NAME, InvoiceStore
+
+
+KINDS = ('electricidad', 'gas')
+
+TEMP_DIR_NAME = '.duckdb'
+
+
+def available():
+    """Indica si DuckDB está instalado."""
+
+    return importlib.util.find_spec('duckdb') is not None
+
+
+def quote(name):
+    """Identificador SQL entrecomillado (las columnas llevan espacios y tildes)."""
+
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _in(column, values, params):
+    if not values:
+        return 'FALSE'
+    params.extend(values)
+    return f"{quote(column)} IN ({', '.join('?' * len(values))})"
+
+
+def check_select(sql):
+    """Comprueba que `sql` es exactamente una sentencia SELECT; si no, lanza `ValueError`."""
+
+    import duckdb
+
+    statements = duckdb.extract_statements(sql)
+    if len(statements) != 1:
+        raise ValueError(f"Se admite exactamente una consulta SELECT (hay {len(statements)} sentencias)")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError(f"Solo se admiten consultas SELECT (la sentencia es {statements[0].type.name})")
+
+
+def where_clause(spec):
+    """Condición SQL y parámetros equivalentes a `FilterIndex.select(spec)`."""
+
+    conditions, params = [], []
+    if spec.year is not None:
+        conditions.append(f"{quote('Año')} = ?")
+        params.append(int(spec.year))
+    if spec.energy is not None:
+        conditions.append(f"{quote('Tipo de Energía')} = ?")
+        params.append(spec.energy)
+    if spec.communities is not None:
+        conditions.append(_in('Comunidad Autónoma', spec.communities, params))
+    if spec.centros is not None:
+        conditions.append(_in('Centro', spec.centros, params))
+    if spec.tensions is not None:
+        # El filtro de tensión solo afecta a la electricidad.
+        tension = _in('Tipo de Tensión', spec.tensions, params)
+        conditions.append(f"({quote('Tipo de Energía')} IS DISTINCT FROM 'Electricidad' OR {tension})")
+    return ' AND '.join(conditions) or 'TRUE', params
+
+
+class SqlBackend:
+    """Conexión DuckDB con las vistas de facturas del almacén de `data_dir`.
+
+    `factors` es la tabla de factores de emisión (por defecto, `load_factors()`).
+    """
+
+    def __init__(self, data_dir, threads=None, memory_limit=None, temp_dir=None, factors=None):
+        import duckdb
+        import pyarrow.dataset as ds
+
+        config = {'temp_directory': temp_dir or os.path.join(data_dir, TEMP_DIR_NAME)}
+        if threads:
+            config['threads'] = threads
+        if memory_limit:
+            config['memory_limit'] = memory_limit
+        self._con = duckdb.connect(config=config)
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self.segments = {}
+
+        views = []
+        for kind in KINDS:
+            paths = InvoiceStore(data_dir, kind).segment_paths()
+            self.segments[kind] = len(paths)
+            if not paths:
+                continue
+            # Un dataset de pyarrow por segmento: DuckDB lo recorre por lotes con proyección y filtros.
+            for i, path in enumerate(paths):
+                self._datasets[f'_segmento_{kind}_{i}'] = ds.dataset(path, format='ipc')
+                self._con.register(f'_segmento_{kind}_{i}', self._datasets[f'_segmento_{kind}_{i}'])
+            self._create_latest_view(kind, len(paths))
+            views.append(f"SELECT * FROM facturas_{kind} WHERE upper({quote('Estado de factura')}) = 'ACTIVA'")
+
+        if not views:
+            raise FileNotFoundError(f"No hay facturas en el almacén de '{data_dir}' ({STORE_DIR_NAME})")
+        self._con.execute(f"CREATE VIEW facturas AS {' UNION ALL BY NAME '.join(views)}")
+        self._create_factors_view(load_factors() if factors is None else factors)
+        self._create_monthly_view()
+        self.tables = self._con.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'main' ORDER BY table_name, ordinal_position"
+        ).df()
+        # Las consultas libres no pueden leer ni escribir ficheros ni cambiar la configuración.
+        self._con.execute("SET enable_external_access = false")
+        self._con.execute("SET lock_configuration = true")
+
+    def _create_latest_view(self, kind, n_segments):
+        """Última versión de cada factura: la del segmento más reciente que contiene su clave."""
+
+        versions = ' UNION ALL '.join(f"SELECT *, {i} AS _segmento FROM _segmento_{kind}_{i}" for i in range(n_segments))
+        self._con.execute(f"CREATE VIEW _versiones_{kind} AS {versions}")
+        if n_segments == 1:
+            self._con.execute(f"CREATE VIEW facturas_{kind} AS SELECT * EXCLUDE (_segmento) FROM _versiones_{kind}")
+            return
+        keys = ', '.join(quote(col) for col in KEY_COLUMNS)
+        # Un join con el último segmento de cada clave (en lugar de una ventana) deja que los filtros
+        # de las consultas lleguen hasta la lectura de los segmentos.
+        join = ' AND '.join(f"v.{quote(col)} IS NOT DISTINCT FROM u.{quote(col)}" for col in KEY_COLUMNS)
+        self._con.execute(f"""
+            CREATE VIEW facturas_{kind} AS
+            SELECT v.* EXCLUDE (_segmento)
+            FROM _versiones_{kind} v
+            JOIN (SELECT {keys}, max(_segmento) AS _ultimo FROM _versiones_{kind} GROUP BY ALL) u
+              ON {join} AND v._segmento = u._ultimo
+        """)
+
+    def _create_factors_view(self, factors):
+        self._datasets['_factores'] = factors
+        self._con.register('_factores', factors)
+        columns = ', '.join(f"CAST({quote(col)} AS {'INTEGER' if col in ('Año', 'Mes') else 'VARCHAR'}) AS {quote(col)}"
+                            for col in FACTOR_KEYS)
+        self._con.execute(f"""
+            CREATE VIEW factores_emision AS
+            SELECT {columns}, CAST("Factor" AS DOUBLE) AS "Factor", "Orden" FROM _factores
+        """)
+
+    def _create_monthly_view(self):
+        """Reparto de cada factura entre meses naturales en proporción a los días (ver `consumo.prorate`).
+
+        Las emisiones de cada mes usan el factor más específico que coincide, con
+        las mismas reglas que `consumo.emissions.emission_factors`.
+        """
+
+        desde, hasta = quote('Fecha desde'), quote('Fecha hasta')
+        measures = ', '.join(f"coalesce({quote(m)}, 0) * _parte AS {quote(m)}" for m in CUBE_MEASURES)
+        # Primer día cubierto según la energía, como `consumo.prorate.START_OFFSET_DAYS`.
+        offset = ' '.join(f"WHEN '{energy}' THEN {days}" for energy, days in START_OFFSET_DAYS.items())
+        offset = f"CASE CAST({quote('Tipo de Energía')} AS VARCHAR) {offset} ELSE {DEFAULT_START_OFFSET} END"
+        matches = ' AND '.join(f"(f.{quote(col)} IS NULL OR f.{quote(col)} = CAST(m.{quote(col)} AS VARCHAR))"
+                               for col in FACTOR_KEYS if col not in ('Año', 'Mes'))
+        self._con.execute(f"""
+            CREATE VIEW facturas_mensuales AS
+            WITH desplazadas AS (
+                SELECT *, CAST({desde} AS DATE) + {offset} AS _primero FROM facturas
+            ),
+            periodos AS (
+                SELECT * EXCLUDE (_primero),
+                    CASE WHEN {hasta} >= _primero THEN _primero ELSE CAST({desde} AS DATE) END AS _inicio,
+                    CASE WHEN {hasta} >= _primero THEN CAST({hasta} AS DATE) ELSE CAST({desde} AS DATE) END AS _fin
+                FROM desplazadas
+            ),
+            meses AS (
+                SELECT *, CAST(unnest(CASE WHEN _inicio IS NULL THEN [NULL]
+                          ELSE generate_series(date_trunc('month', _inicio), date_trunc('month', _fin), INTERVAL 1 MONTH)
+                          END) AS DATE) AS _mes
+                FROM periodos
+            ),
+            repartidas AS (
+                SELECT * EXCLUDE ({', '.join(quote(m) for m in CUBE_MEASURES)}, _inicio, _fin, _mes, _parte)
+                    REPLACE (coalesce(year(_mes), {quote('Año')}) AS {quote('Año')},
+                             coalesce(month(_mes), {quote('Mes')}) AS {quote('Mes')}),
+                    {measures}
+                FROM (
+                    SELECT *, coalesce(
+                        (least(_fin + 1, CAST(_mes + INTERVAL 1 MONTH AS DATE)) - greatest(_inicio, _mes))
+                        / (_fin - _inicio + 1), 1.0) AS _parte
+                    FROM meses
+                )
+            )
+            SELECT m.*, m.{quote('Consumo_kWh')} / 1000 * coalesce((
+                SELECT arg_max(f."Factor", f."Orden") FROM factores_emision f
+                WHERE f.{quote('Tipo de Energía')} = CAST(m.{quote('Tipo de Energía')} AS VARCHAR)
+                  AND (f.{quote('Año')} IS NULL OR f.{quote('Año')} = m.{quote('Año')})
+                  AND (f.{quote('Mes')} IS NULL OR f.{quote('Mes')} = m.{quote('Mes')})
+                  AND {matches}
+            ), 0) AS {quote(EMISSIONS_COLUMN)}
+            FROM repartidas m
+        """)
+
+    def _register(self, con):
+        for name, dataset in self._datasets.items():
+            con.register(name, dataset)
+
+    def _cursor(self):
+        # Un cursor por consulta: cada sesión de Streamlit consulta desde su propio hilo. Los datasets
+        # registrados son de cada conexión, así que el cursor los registra de nuevo.
+        with self._lock:
+            cursor = self._con.cursor()
+        self._register(cursor)
+        return cursor
+
+    def _execute(self, sql, params=None):
+        return self._cursor().execute(sql, params or []).df()
+
+    def query(self, sql, params=None):
+        """Ejecuta una consulta libre de solo lectura y devuelve el resultado como DataFrame.
+
+        Lanza `ValueError` si `sql` no es exactamente una sentencia SELECT.
+        """
+
+        check_select(sql)
+        return self._execute(sql, params)
+
+    def cube(self, spec=None):
+        """Cubo mensual (dimensiones y medidas de `consumo.cube`) de las facturas que cumplen `spec`."""
+
+        where, params = where_clause(spec) if spec is not None else ('TRUE', [])
+        dimensions = ', '.join(quote(d) for d in CUBE_DIMENSIONS)
+        measures = ', '.join(f"sum({quote(m)}) AS {quote(m)}" for m in CUBE_MEASURES + [EMISSIONS_COLUMN])
+        cube = self._execute(f"SELECT {dimensions}, {measures} FROM facturas_mensuales WHERE {where} GROUP BY ALL", params)
+        return cube.astype({'Año': 'Int16', 'Mes': 'Int8'})
+
+    def kpis(self, spec=None):
+        """Los mismos indicadores que `compute_kpis`, calculados en DuckDB."""
+
+        where, params = where_clause(spec) if spec is not None else ('TRUE', [])
+        energy, kwh, cost = quote('Tipo de Energía'), quote('Consumo_kWh'), quote('Coste Total')
+        emissions = quote(EMISSIONS_COLUMN)
+        row = self._execute(f"""
+            SELECT
+                coalesce(sum({kwh}) FILTER (WHERE {energy} = 'Electricidad'), 0) AS kwh_elec,
+                coalesce(sum({cost}) FILTER (WHERE {energy} = 'Electricidad'), 0) AS cost_elec,
+                coalesce(sum({kwh}) FILTER (WHERE {energy} = 'Gas'), 0) AS kwh_gas,
+                coalesce(sum({cost}) FILTER (WHERE {energy} = 'Gas'), 0) AS cost_gas,
+                coalesce(sum({emissions}) FILTER (WHERE {energy} = 'Gas'), 0) AS emisiones_alcance1,
+                coalesce(sum({emissions}) FILTER (WHERE {energy} = 'Electricidad'), 0) AS emisiones_alcance2,
+                count(DISTINCT {quote('CUPS')}) AS num_suministros
+            FROM facturas_mensuales WHERE {where}
+        """, params).iloc[0]
+        kpis = {key: float(row[key]) for key in ['kwh_elec', 'cost_elec', 'kwh_gas', 'cost_gas',
+                                                 'emisiones_alcance1', 'emisiones_alcance2']}
+        kpis['num_suministros'] = int(row['num_suministros'])
+        kpis['total_kwh'] = kpis['kwh_elec'] + kpis['kwh_gas']
+        kpis['total_cost'] = kpis['cost_elec'] + kpis['cost_gas']
+        kpis['emisiones_co2'] = kpis['emisiones_alcance1'] + kpis['emisiones_alcance2']
+        kpis['coste_medio'] = kpis['total_cost'] / kpis['total_kwh'] if kpis['total_kwh'] > 0 else 0
+        return kpis
+
+    def close(self):
+        self._con.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m consumo.sql', description="Consulta SQL sobre el almacén de facturas.")
+    parser.add_argument('sql', help="Consulta (vistas: facturas, facturas_mensuales, facturas_electricidad, facturas_gas)")
+    parser.add_argument('--data-dir', default='Data', help="Carpeta con los exports (por defecto: Data)")
+    parser.add_argument('--threads', type=int, help="Hilos de DuckDB (por defecto: todos los núcleos)")
+    parser.add_argument('--memory-limit', help="Memoria máxima antes de usar ficheros temporales, p. ej. '4GB'")
+    args = parser.parse_args(argv)
+
+    from consumo.pipeline import sync_store
+
+    sync_store(args.data_dir)
+    backend = SqlBackend(args.data_dir, threads=args.threads, memory_limit=args.memory_limit)
+    with pd.option_context('display.max_rows', 100, 'display.width', 200):
+        print(backend.query(args.sql))
+
+
+if __name__ == "__main__":
+    main()
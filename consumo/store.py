@@ -0,0 +1,148 @@
+"""Almacén local de facturas, incremental y de solo anexado.
+
+Cada exportación mensual del proveedor repite la mayoría de las facturas ya
+conocidas. El almacén guarda por tipo de energía una serie de segmentos Arrow y
+un índice con el hash de la clave y el hash del contenido de cada fila, de modo
+que al ingerir un archivo solo se escriben las filas nuevas o modificadas (por
+ejemplo, una factura que pasa de ACTIVA a ANULADA). La lectura devuelve la
+última versión de cada factura.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from consumo.ingest import SCHEMA_VERSION, file_digest, read_normalized
+from consumo.schema import concat_frames
+
+
+# Una misma factura puede incluir varias líneas (periodos) para el mismo CUPS,
+# por eso la fecha de inicio forma parte de la clave.
+KEY_COLUMNS = ['Número de factura', 'CUPS', 'Fecha desde']
+
+STORE_DIR_NAME = ".store"
+
+
+def _hash_rows(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy(dtype=np.uint64)
+
+
+class InvoiceStore:
+    """Almacén deduplicado de facturas de un tipo de energía."""
+
+    def __init__(self, data_dir, kind):
+        self.kind = kind
+        # Cada versión de la normalización tiene su propio almacén: las filas de versiones anteriores no se mezclan.
+        self.root = os.path.join(data_dir, STORE_DIR_NAME, f"{kind}-v{SCHEMA_VERSION}")
+        self._manifest_path = os.path.join(self.root, "manifest.json")
+        self._index_path = os.path.join(self.root, "index.arrow")
+        self._manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"files": {}, "segments": []}
+
+    def _write_manifest(self):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _read_index(self):
+        import pyarrow.feather as feather
+
+        if not os.path.exists(self._index_path):
+            return np.empty(0, np.uint64), np.empty(0, np.uint64)
+        table = feather.read_table(self._index_path, memory_map=True)
+        return table['key'].to_numpy(), table['row'].to_numpy()
+
+    def has_file(self, file_path):
+        return file_digest(file_path) in self._manifest["files"]
+
+    def ingest(self, file_path, normalize):
+        """Incorpora un archivo al almacén y devuelve cuántas filas nuevas o modificadas aporta.
+
+        Un archivo cuyo contenido ya se ingirió se ignora sin leerlo. En otro caso
+        solo se escriben las filas cuya clave no existía o cuyo contenido cambió.
+        """
+        digest = file_digest(file_path)
+        if digest in self._manifest["files"]:
+            return 0
+        df = read_normalized(file_path, self.kind, normalize)
+        return self._commit_file(file_path, digest, self._append(df, digest))
+
+    def ingest_chunks(self, file_path, chunks):
+        """Como `ingest`, pero recibe el archivo ya normalizado por trozos.
+
+        Cada trozo se compara con el índice y se escribe en cuanto llega, de modo
+        que la memoria no depende del tamaño del archivo. El archivo solo se marca
+        como ingerido cuando se han procesado todos sus trozos.
+        """
+        digest = file_digest(file_path)
+        if digest in self._manifest["files"]:
+            return 0
+        rows = sum(self._append(chunk, digest) for chunk in chunks)
+        return self._commit_file(file_path, digest, rows)
+
+    def _commit_file(self, file_path, digest, rows):
+        os.makedirs(self.root, exist_ok=True)
+        self._manifest["files"][digest] = {"name": os.path.basename(file_path), "rows": int(rows)}
+        self._write_manifest()
+        return int(rows)
+
+    def _append(self, df, digest):
+        """Escribe como nuevo segmento las filas de `df` nuevas o modificadas."""
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        df = df.drop_duplicates(subset=KEY_COLUMNS, keep='last')
+        key_hash = _hash_rows(df[KEY_COLUMNS])
+        row_hash = _hash_rows(df)
+
+        # Una fila entra en el almacén si su clave no existía o si su contenido no
+        # coincide con la última versión conocida de esa clave.
+        index_keys, index_rows = self._read_index()
+        last = ~pd.Index(index_keys[::-1]).duplicated()
+        latest_keys = index_keys[::-1][last]
+        latest_rows = index_rows[::-1][last]
+        pos = pd.Index(latest_keys).get_indexer(key_hash)
+        changed = pos < 0
+        changed[~changed] = latest_rows[pos[~changed]] != row_hash[~changed]
+        delta = df[changed]
+        if delta.empty:
+            return 0
+
+        os.makedirs(self.root, exist_ok=True)
+        segment = f"seg-{len(self._manifest['segments']):06d}-{digest[:8]}.arrow"
+        table = pa.Table.from_pandas(delta, preserve_index=False)
+        feather.write_feather(table, os.path.join(self.root, segment), compression="uncompressed")
+        # El segmento se registra antes de actualizar el índice: si el proceso se
+        # interrumpe entre ambos pasos, las filas se vuelven a escribir y la
+        # lectura se queda con la última versión de cada clave.
+        self._manifest["segments"].append(segment)
+        self._write_manifest()
+        index = pa.table({
+            'key': np.concatenate([index_keys, key_hash[changed]]),
+            'row': np.concatenate([index_rows, row_hash[changed]]),
+        })
+        feather.write_feather(index, f"{self._index_path}.tmp", compression="uncompressed")
+        os.replace(f"{self._index_path}.tmp", self._index_path)
+        return int(len(delta))
+
+    def segment_paths(self):
+        """Rutas de los segmentos Arrow en orden de escritura (los posteriores prevalecen)."""
+        return [os.path.join(self.root, name) for name in self._manifest["segments"]]
+
+    def read(self):
+        """Devuelve todas las facturas conocidas, con la última versión de cada clave."""
+        import pyarrow.feather as feather
+
+        segments = [feather.read_table(path, memory_map=True).to_pandas() for path in self.segment_paths()]
+        df = concat_frames(segments)
+        if df.empty:
+            return df
+        return df.drop_duplicates(subset=KEY_COLUMNS, keep='last').reset_index(drop=True)
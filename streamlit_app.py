@@ -2,13 +2,36 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import os
 import json
-import requests
 import io
-from thefuzz import process
+import functools
+
+from consumo.ingest import read_normalized
+from consumo.loaders import (
+    active_invoices, normalize_electricity_data, normalize_gas_data, stream_invoices
+)
+from consumo.provinces import COMMUNITIES, unresolved_provinces
+from consumo.pipeline import discover_files
+from consumo.refresh import BackgroundRefresher, folder_signature, load_history
+from consumo.datasets import DatasetCache
+from consumo.charts import OTHERS_LABEL, TOP_N, energy_by_group_figure, period_mix_figure, price_box_figure, stacked_bar
+from consumo.anomalies import DEFAULT_THRESHOLD, detect_anomalies
+from consumo.cube import build_cube, build_cube_streaming, merge_cubes
+from consumo.emissions import SCOPE_COLUMNS, add_emissions, factors_signature, load_factors, scope_report
+from consumo.schema import concat_frames
+from consumo.series import MonthlySeries
+from consumo.filters import FilterIndex, FilterSpec
+from consumo.geo import build_name_index, load_geojson
+from consumo.periods import PERIODS, PeriodData, normalize_period_data, period_summary
+from consumo.power import PowerData, normalize_power_data, optimize_power
+from consumo.reactive import ReactiveData, normalize_reactive_data, reactive_summary
+from consumo.profiling import MEMORY_TRACING_ENV, Profiler, memory_tracing_enabled
+from consumo import sql
+from consumo.report import (
+    CO2_FACTOR, ENERGY_TYPES, MONTH_NAMES, compute_kpis, consumption_by, cost_breakdown, latest_billed_year,
+    monthly_consumption
+)
 
 
 
@@ -27,322 +50,353 @@ st.set_page_config(
 
 
 
-# --- Constantes y Mapeos ---
+# --- Instrumentación (panel de diagnóstico al final de la barra lateral) ---
 
-CO2_FACTOR = 0.19 # Factor de emisión en tCO2e por MWh (toneladas de CO2 por megavatio-hora)
+# La medición de memoria (tracemalloc) afecta a todo el proceso: se activa al arrancarlo con CONSUMO_TRACE_MEMORY=1, no por sesión.
 
+profiler = Profiler(
 
+    enabled=st.session_state.get('debug_profiling', False),
 
-province_to_community = {
+    trace_memory=memory_tracing_enabled()
 
-    'Almería': 'Andalucía', 'Cádiz': 'Andalucía', 'Córdoba': 'Andalucía', 'Granada': 'Andalucía',
+)
 
-    'Huelva': 'Andalucía', 'Jaén': 'Andalucía', 'Málaga': 'Andalucía', 'Sevilla': 'Andalucía',
 
-    'Huesca': 'Aragón', 'Teruel': 'Aragón', 'Zaragoza': 'Aragón',
 
-    'Asturias': 'Principado de Asturias',
+# --- Esqueleto de la página: se muestra antes de leer la carpeta o cargar ningún dato ---
 
-    'Balears, Illes': 'Islas Baleares',
+page_title = st.empty()
 
-    'Araba/Álava': 'País Vasco', 'Bizkaia': 'País Vasco', 'Gipkoa': 'País Vasco',
+page_title.title("Informe Energético Anual")
 
-    'Las Palmas': 'Canarias', 'Santa Cruz de Tenerife': 'Canarias',
 
-    'Cantabria': 'Cantabria',
-    'Ávila': 'Castilla y León', 'Burgos': 'Castilla y León', 'León': 'Castilla y León',
-    'Palencia': 'Castilla y León', 'Salamanca': 'Castilla y León', 'Segovia': 'Castilla y León',
-    'Soria': 'Castilla y León', 'Valladolid': 'Castilla y León', 'Zamora': 'Castilla y León',
-    'Albacete': 'Castilla-La Mancha', 'Ciudad Real': 'Castilla-La Mancha', 'Cuenca': 'Castilla-La Mancha',
-    'Guadalajara': 'Castilla-La Mancha', 'Toledo': 'Castilla-La Mancha',
-    'Barcelona': 'Cataluña', 'Girona': 'Cataluña', 'Lleida': 'Cataluña', 'Tarragona': 'Cataluña',
-    'Ceuta': 'Ceuta',
-    'Badajoz': 'Extremadura', 'Cáceres': 'Extremadura',
 
-    'Coruña, A': 'Galicia', 'Lugo': 'Galicia', 'Ourense': 'Galicia', 'Pontevedra': 'Galicia',
+# --- Constantes y Mapeos ---
 
-    'Rioja, La': 'La Rioja',
+STREAMING_THRESHOLD_BYTES = 200 * 1024 * 1024 # A partir de este tamaño los archivos se procesan por trozos
 
-    'Madrid': 'Comunidad de Madrid',
+DATASET_CACHE_BYTES = 2 * 1024 * 1024 * 1024 # Memoria máxima de los datasets compartidos entre sesiones
 
-    'Melilla': 'Melilla',
+REFRESH_POLL_SECONDS = 30 # Cada cuánto se comprueba si hay exports nuevos en la carpeta de datos
 
-    'Murcia': 'Región de Murcia',
+REFRESH_CHECK_SECONDS = 5 # Cada cuánto comprueba cada sesión si ya hay una instantánea nueva del histórico
 
-    'Navarra': 'Comunidad Foral de Navarra',
+FIGURE_CACHE_ENTRIES = 256 # Figuras ya construidas que se conservan (una por gráfico y selección de filtros)
 
-    'Valencia/València': 'Comunidad Valenciana', 'Alicante/Alacant': 'Comunidad Valenciana', 'Castellón': 'Comunidad Valenciana', 'Castellón/Castelló': 'Comunidad Valenciana'
+FILTER_INDEX_CACHE_ENTRIES = 16 # Índices de filtros que se conservan (uno por conjunto de datos cargado)
 
-}
+PERIOD_CACHE_ENTRIES = 8 # Matrices por periodo que se conservan (una por análisis y conjunto de exports)
 
 
 
-def get_voltage_type(rate):
+@st.cache_resource
 
-    if rate in ["6.1TD", "6.2TD", "6.3TD", "6.4TD"]: return "Alta Tensión"
+def get_dataset_cache():
 
-    elif rate in ["2.0TD", "3.0TD"]: return "Baja Tensión"
+    """Caché de datasets única para todo el proceso: todas las sesiones comparten la misma copia de cada archivo."""
 
-    return "No definido"
+    return DatasetCache(max_bytes=DATASET_CACHE_BYTES)
 
 
 
-@st.cache_data
-
 def load_electricity_data(file_path):
 
-    """Carga y procesa los datos de electricidad desde un archivo CSV o TSV."""
+    """Carga los datos de electricidad normalizados, reutilizando la caché Arrow del archivo."""
 
     try:
 
-        separator = '\t' if file_path.endswith('.tsv') else ','
+        return get_dataset_cache().get_file(file_path, 'electricidad',
 
-        # Para el archivo de gas, el separador podría ser ';'
+                                            lambda path: active_invoices(read_normalized(path, 'electricidad', normalize_electricity_data)))
 
-        if 'gas' in os.path.basename(file_path).lower():
+    except Exception as e:
 
-            separator = ';'
+        st.error(f"Error procesando el archivo de electricidad '{os.path.basename(file_path)}': {e}")
 
-        
+        return pd.DataFrame()
 
-        cols_to_use = [
 
-            'CUPS', 'Estado de factura', 'Fecha desde', 'Provincia', 'Nombre suministro',
 
-            'Tarifa de acceso', 'Consumo activa total (kWh)', 'Base imponible (€)',
+def load_gas_data(file_path):
 
-            'Importe TE (€)', 'Importe TP (€)', 'Importe impuestos (€)', 'Importe alquiler (€)',
+    """Carga los datos de gas normalizados, reutilizando la caché Arrow del archivo."""
 
-            'Importe otros conceptos (€)'
+    try:
 
-        ]
+        return get_dataset_cache().get_file(file_path, 'gas',
 
-        df = pd.read_csv(
+                                            lambda path: active_invoices(read_normalized(path, 'gas', normalize_gas_data)))
 
-            file_path,
+    except Exception as e:
 
-            usecols=lambda c: c.strip() in cols_to_use,
+        st.error(f"Error procesando el archivo de gas '{os.path.basename(file_path)}': {e}")
 
-            parse_dates=['Fecha desde'],
+        return pd.DataFrame()
 
-            decimal='.', thousands=',', sep=separator,
 
-            dayfirst=True # Añadido para interpretar correctamente fechas como dd/mm/yyyy
 
-        )
+def load_streamed_cube(file_path, kind):
 
+    """Construye el cubo de un archivo muy grande sin cargar todas sus facturas en memoria."""
 
+    try:
 
-        df.columns = df.columns.str.strip()
+        return get_dataset_cache().get_file(file_path, f'cubo_{kind}',
 
-        df = df[df['Estado de factura'].str.upper() == 'ACTIVA']
+                                            lambda path: build_cube_streaming(stream_invoices(path, kind)))
 
-        df.rename(columns={
+    except Exception as e:
 
-            'Nombre suministro': 'Centro', 'Base imponible (€)': 'Coste Total',
+        st.error(f"Error procesando el archivo de {kind} '{os.path.basename(file_path)}': {e}")
 
-            'Consumo activa total (kWh)': 'Consumo_kWh', 'Importe TE (€)': 'Coste Energía',
+        return pd.DataFrame()
 
-            'Importe TP (€)': 'Coste Potencia', 'Importe impuestos (€)': 'Coste Impuestos',
 
-            'Importe alquiler (€)': 'Coste Alquiler', 'Importe otros conceptos (€)': 'Coste Otros'
 
-        }, inplace=True)
+@st.cache_resource
 
+def get_refresher(data_dir):
 
+    """Hilo único por proceso que vigila la carpeta y recarga el histórico en segundo plano cuando aparece o cambia un export.
 
-        numeric_cols = ['Coste Total', 'Consumo_kWh', 'Coste Energía', 'Coste Potencia',
+    Se arranca la primera vez que una sesión pide el histórico, no al abrir la app.
 
-                        'Coste Impuestos', 'Coste Alquiler', 'Coste Otros']
+    """
 
-        for col in numeric_cols:
+    # La normalización se hace en el propio hilo: un pool de procesos lanzado desde un hilo del servidor re-importa
 
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # el script de la app como __main__ en cada proceso hijo, y la carga ya no bloquea a las sesiones.
 
-        df.fillna(0, inplace=True)
+    load = functools.partial(load_history, streaming_threshold=STREAMING_THRESHOLD_BYTES, max_workers=1)
 
+    return BackgroundRefresher(data_dir, load=load, poll_seconds=REFRESH_POLL_SECONDS).start()
 
 
-        df['Año'] = df['Fecha desde'].dt.year
 
-        df['Mes'] = df['Fecha desde'].dt.month
+def load_invoice_history(data_dir):
 
-        df['Comunidad Autónoma'] = df['Provincia'].map(province_to_community)
+    """Última instantánea completa del histórico consolidado (facturas activas y cubo), o None si no se pudo cargar.
 
-        df['Tipo de Tensión'] = df['Tarifa de acceso'].apply(get_voltage_type)
+    Solo la primera carga del proceso espera; después, mientras se incorpora un export nuevo, se sigue devolviendo la instantánea anterior.
 
-        df['Tipo de Energía'] = 'Electricidad'
+    """
 
-        df.dropna(subset=['Comunidad Autónoma'], inplace=True)
+    refresher = get_refresher(data_dir)
 
-        return df
+    snapshot = refresher.snapshot
 
-    except Exception as e:
+    if snapshot is None:
 
-        st.error(f"Error procesando el archivo de electricidad '{os.path.basename(file_path)}': {e}")
+        with st.spinner('Cargando el histórico por primera vez...'):
 
-        return pd.DataFrame()
+            snapshot = refresher.wait()
 
+    if snapshot is None:
 
+        st.error(f"No se pudo cargar el histórico: {refresher.error}")
 
+        return None
 
+    for name, e in snapshot.errors.items():
 
-# --- ¡FUNCIÓN ACTUALIZADA! ---
+        st.error(f"Error incorporando '{name}' al histórico: {e}")
 
-@st.cache_data
+    return snapshot
 
-def load_gas_data(file_path):
 
-    """Carga y procesa los datos de gas desde un único archivo CSV, de forma similar a la electricidad."""
 
-    try:
+def get_emission_factors(factors_key):
 
-        # Detecta el separador, asumiendo que puede ser coma, punto y coma o tabulador.
+    """Tabla de factores de emisión, leída de nuevo solo cuando cambia su CSV."""
 
-        with open(file_path, 'r', encoding='utf-8') as f:
+    return get_dataset_cache().get(('factores_emision', factors_key), load_factors)
 
-            first_line = f.readline()
 
-            if ';' in first_line:
 
-                separator = ';'
+def get_emissions_cube(dataset_key, factors_key, cube):
 
-            elif ',' in first_line:
+    """Cubo con las emisiones de cada celda, calculadas una vez por conjunto de datos y tabla de factores."""
 
-                separator = ','
+    return get_dataset_cache().get(('emisiones', dataset_key, factors_key), lambda: add_emissions(cube, get_emission_factors(factors_key)))
 
-            else:
 
-                separator = '\t'
 
+@st.cache_resource(max_entries=2)
 
+def get_sql_backend(history_signature, factors_key):
 
-        # Columnas relevantes para el gas. 'Consumo' es el nombre genérico.
+    """Conexión DuckDB sobre el almacén de facturas, una por instantánea del histórico y tabla de factores."""
 
-        cols_to_use = [
+    # El hilo de recarga ya ha sincronizado el almacén con la carpeta para esta instantánea.
 
-            'CUPS', 'Estado de factura', 'Fecha desde', 'Provincia', 'Nombre suministro',
+    return sql.SqlBackend(DATA_DIR, factors=get_emission_factors(factors_key))
 
-            'Consumo', 'Base imponible (€)'
 
-        ]
 
-        df = pd.read_csv(
+@st.fragment(run_every=REFRESH_CHECK_SECONDS)
 
-            file_path,
+def history_status(shown_signature):
 
-            usecols=lambda c: c.strip() in cols_to_use,
+    """Avisa de las recargas en segundo plano y vuelve a ejecutar la app en cuanto hay una instantánea nueva."""
 
-            parse_dates=['Fecha desde'],
+    refresher = get_refresher(DATA_DIR)
 
-            decimal=',', # A menudo los CSV españoles usan coma decimal
+    snapshot = refresher.snapshot
 
-            thousands='.', # Y punto para los miles
+    if snapshot is not None and snapshot.signature != shown_signature:
 
-            sep=separator,
+        st.rerun()
 
-            dayfirst=True # Importante para formato de fecha dd/mm/yyyy
+    if refresher.loading:
 
-        )
+        st.caption("🔄 Incorporando exports nuevos en segundo plano; se mostrarán al terminar.")
 
+    elif refresher.error is not None:
 
+        st.caption(f"⚠️ La última actualización del histórico falló: {refresher.error}")
 
-        df.columns = df.columns.str.strip()
+    # Sin esperar al siguiente sondeo, por ejemplo justo después de copiar un export a la carpeta.
 
-        
+    if st.button("Recargar", help="Busca ya exports nuevos o cambiados en la carpeta de datos.", disabled=refresher.loading):
 
-        # Filtra por facturas activas
+        refresher.refresh_now()
 
-        if 'Estado de factura' in df.columns:
 
-            df = df[df['Estado de factura'].str.upper() == 'ACTIVA']
 
-            
+def get_cube(dataset_key, df, streamed_cubes=()):
 
-        # Renombra columnas para estandarizar
+    """Construye el cubo mensual una sola vez por conjunto de datos cargado.
 
-        df.rename(columns={
+    `dataset_key` identifica los archivos de origen; el DataFrame no se usa como clave para no tener que hashearlo en cada interacción.
 
-            'Nombre suministro': 'Centro',
+    `streamed_cubes` son los cubos ya agregados de los archivos procesados por trozos.
 
-            'Base imponible (€)': 'Coste Total',
+    """
 
-            'Consumo': 'Consumo_kWh' # Asume que la columna 'Consumo' está en kWh
+    return get_dataset_cache().get(('cubo', dataset_key), lambda: merge_cubes([build_cube(df), *streamed_cubes]))
 
-        }, inplace=True)
 
 
+def get_anomalies(history):
 
-        # Convierte a numérico y rellena NAs
+    """Facturas anómalas de todo el histórico de la carpeta, con su índice de filtros."""
 
-        numeric_cols = ['Coste Total', 'Consumo_kWh']
+    def detect():
 
-        for col in numeric_cols:
+        anomalies = detect_anomalies(concat_frames([history.electricity, history.gas]))
 
-            if col in df.columns:
+        return anomalies, FilterIndex(anomalies)
 
-                df[col] = pd.to_numeric(df[col].astype(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False), errors='coerce')
+    return get_dataset_cache().get(('anomalias', history.signature), detect)
 
-        df.fillna(0, inplace=True)
 
 
+def get_monthly_series(history):
 
-        # Crea columnas adicionales
+    """Series mensuales de todo el histórico de la carpeta (todos los años, electricidad y gas) para las comparativas."""
 
-        df['Año'] = df['Fecha desde'].dt.year
+    return get_dataset_cache().get(('series', history.signature), lambda: MonthlySeries(history.cube))
 
-        df['Mes'] = df['Fecha desde'].dt.month
 
-        df['Comunidad Autónoma'] = df['Provincia'].map(province_to_community)
 
-        df['Tipo de Energía'] = 'Gas'
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES)
 
-        
+def get_figure(figure_key, _build):
 
-        # Elimina filas sin comunidad autónoma asignada
+    """Figura construida una vez por conjunto de datos y selección de filtros; `figure_key` debe identificar ambos.
 
-        df.dropna(subset=['Comunidad Autónoma'], inplace=True)
+    Las figuras se comparten entre sesiones: `st.plotly_chart` las serializa sin modificarlas.
 
-        
+    """
 
-        # Selecciona las columnas finales para mantener la consistencia
+    return _build()
 
-        final_cols = ['Fecha desde', 'Centro', 'Provincia', 'Comunidad Autónoma', 
 
-                      'Consumo_kWh', 'Coste Total', 'Tipo de Energía', 'Año', 'Mes', 'CUPS']
 
-        return df[final_cols]
+@st.cache_resource(max_entries=FILTER_INDEX_CACHE_ENTRIES)
 
+def get_filter_index(dataset_key, _cube):
 
+    """Índice de filtros de un cubo, compartido entre sesiones y calculado una vez por conjunto de datos."""
 
-    except Exception as e:
+    return FilterIndex(_cube)
 
-        st.error(f"Error procesando el archivo de gas '{os.path.basename(file_path)}': {e}")
 
-        return pd.DataFrame()
 
+# Datos factura × periodo de los exports de electricidad: normalización, clase que construye las matrices y qué se lee.
+PERIOD_MATRICES = {
+
+    'periodos': (normalize_period_data, PeriodData, "los periodos tarifarios"),
+
+    'potencia': (normalize_power_data, PowerData, "las potencias"),
+
+    'reactiva': (normalize_reactive_data, ReactiveData, "la energía reactiva"),
+
+}
+
+
+
+@st.cache_resource(max_entries=PERIOD_CACHE_ENTRIES)
+
+def get_period_matrices(kind, file_paths, files_signature):
+
+    """Matrices factura × periodo de `kind` (ver `PERIOD_MATRICES`) de los exports de electricidad, con su índice de filtros."""
+
+    normalize, matrices, description = PERIOD_MATRICES[kind]
+
+    frames = []
+
+    for path in file_paths:
+
+        try:
+
+            frames.append(read_normalized(path, kind, normalize))
+
+        except Exception as e:
 
+            st.error(f"Error leyendo {description} de '{os.path.basename(path)}': {e}")
 
-@st.cache_data
+    data = matrices.from_frames(frames)
+
+    return data, FilterIndex(data.meta)
+
+
+
+@st.cache_resource
 
 def get_geojson():
 
-    url = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/spain-communities.geojson"
+    """GeoJSON simplificado de las comunidades, leído de la copia incluida en el paquete (nunca se descarga)."""
 
     try:
 
-        response = requests.get(url)
-
-        return response.json()
+        return load_geojson()
 
     except Exception as e:
 
-        st.error(f"No se pudo descargar el mapa. Error: {e}")
+        st.error(f"No se pudo cargar el mapa. Error: {e}")
 
         return None
 
 
 
+@st.cache_resource
+
+def get_community_index():
+
+    """Relación Comunidad Autónoma -> nombre del polígono, calculada una vez por proceso."""
+
+    geojson = get_geojson()
+
+    if not geojson:
+
+        return {}
+
+    return build_name_index(geojson, COMMUNITIES)
+
+
+
 # --- BARRA LATERAL (FILTROS) ---
 
 st.sidebar.image("Logo_ASEPEYO.png", width=200)
@@ -357,7 +411,11 @@ df_electricidad = pd.DataFrame()
 
 df_gas = pd.DataFrame()
 
-df_comparativa = pd.DataFrame()
+streamed_cubes = []
+
+period_files = []
+
+history = None
 
 
 
@@ -389,23 +447,39 @@ try:
 
     st.sidebar.markdown("### 📂 Selección de Datos")
 
-    col1, col2 = st.sidebar.columns(2)
+    usar_historico = st.sidebar.toggle("Usar histórico consolidado", help="Combina todas las facturas de la carpeta sin duplicados.")
 
-    selected_file_electricidad = col1.selectbox("Electricidad (Actual)", files, index=0 if files else None)
+    selected_file_electricidad = selected_file_gas = None
 
-    
+    # Con el histórico, los filtros y KPIs pueden calcularse en DuckDB directamente sobre el almacén
+
+    usar_sql = usar_historico and sql.available() and st.sidebar.radio(
+
+        "Motor de consulta", ["pandas", "SQL (DuckDB)"], horizontal=True,
 
-    # Selector único para el archivo de gas
+        help="SQL consulta el almacén de facturas sin cargarlo en memoria y permite consultas libres."
 
-    selected_file_gas = col1.selectbox("Gas (Actual)", [None] + files)
+    ) == "SQL (DuckDB)"
+
+    if not usar_historico:
+
+        selected_file_electricidad = st.sidebar.selectbox("Electricidad (Actual)", files, index=0 if files else None)
+
+        # Selector único para el archivo de gas
+
+        selected_file_gas = st.sidebar.selectbox("Gas (Actual)", [None] + files)
 
     
 
-    comparar_anos = st.sidebar.toggle("Comparar con año anterior")
+    comparar_anos = st.sidebar.toggle("Comparar años", help="Compara el consumo mensual de varios años con todo el histórico de la carpeta.")
+
+    detectar_anomalias = st.sidebar.toggle("Detectar facturas anómalas", help="Compara cada factura con el histórico de su suministro.")
+
+    analizar_reactiva = st.sidebar.toggle("Analizar energía reactiva", help="Penalizaciones por reactiva y retorno de las baterías de condensadores.")
 
-    if comparar_anos:
+    optimizar_potencia = st.sidebar.toggle("Optimizar potencia contratada", help="Busca la potencia por periodo de menor coste con los maxímetros de cada suministro.")
 
-        selected_file_comparativa = col2.selectbox("Electricidad (Anterior)", files, index=0 if files else None)
+    informe_emisiones = st.sidebar.toggle("Informe de emisiones", help="Emisiones de Alcance 1 (gas) y 2 (electricidad) de todos los años y centros.")
 
     
 
@@ -413,13 +487,51 @@ try:
 
     # --- Carga de datos ---
 
-    with st.spinner('Cargando datos...'):
+    files_signature = folder_signature(DATA_DIR)
+
+    with st.spinner('Cargando datos...'), profiler.span('carga_datos'):
+
+        if usar_historico:
+
+            with profiler.span('carga_historico') as span:
+
+                history = load_invoice_history(DATA_DIR)
+
+                if history is None:
+
+                    st.stop()
+
+                df_electricidad, df_gas = history.electricity, history.gas
+
+                span.rows_out = len(df_electricidad) + len(df_gas)
+
+            period_files = [path for path, kind in discover_files(DATA_DIR)
+
+                            if kind == 'electricidad' and os.path.getsize(path) <= STREAMING_THRESHOLD_BYTES]
+
+        
+
+        # Los archivos muy grandes no se cargan enteros: se agregan directamente al cubo por trozos
 
         if selected_file_electricidad:
 
             path_elec = os.path.join(DATA_DIR, selected_file_electricidad)
 
-            df_electricidad = load_electricity_data(path_elec)
+            if os.path.getsize(path_elec) > STREAMING_THRESHOLD_BYTES:
+
+                with profiler.span('carga_electricidad_por_trozos'):
+
+                    streamed_cubes.append(load_streamed_cube(path_elec, 'electricidad'))
+
+            else:
+
+                with profiler.span('carga_electricidad') as span:
+
+                    df_electricidad = load_electricity_data(path_elec)
+
+                    span.rows_out = len(df_electricidad)
+
+                period_files = [path_elec]
 
         
 
@@ -429,15 +541,19 @@ try:
 
             path_gas = os.path.join(DATA_DIR, selected_file_gas)
 
-            df_gas = load_gas_data(path_gas)
+            if os.path.getsize(path_gas) > STREAMING_THRESHOLD_BYTES:
 
-        
+                with profiler.span('carga_gas_por_trozos'):
+
+                    streamed_cubes.append(load_streamed_cube(path_gas, 'gas'))
+
+            else:
 
-        if comparar_anos and 'selected_file_comparativa' in locals() and selected_file_comparativa:
+                with profiler.span('carga_gas') as span:
 
-            path_comp = os.path.join(DATA_DIR, selected_file_comparativa)
+                    df_gas = load_gas_data(path_gas)
 
-            df_comparativa = load_electricity_data(path_comp)
+                    span.rows_out = len(df_gas)
 
 
 
@@ -453,15 +569,59 @@ except Exception as e:
 
 # --- Combinar datos de Electricidad y Gas ---
 
-df_combined = pd.concat([df_electricidad, df_gas], ignore_index=True)
+with profiler.span('combinar', rows_in=len(df_electricidad) + len(df_gas)) as span:
 
+    df_combined = concat_frames([df_electricidad, df_gas])
 
+    span.rows_out = len(df_combined)
 
-if not df_combined.empty:
+
+
+# --- Provincias que no se han podido asignar a una comunidad (se muestran como 'Sin asignar') ---
+
+provincias_sin_asignar = unresolved_provinces(df_combined)
+
+if not provincias_sin_asignar.empty:
+
+    st.sidebar.warning("Provincias sin comunidad autónoma reconocida: " + ", ".join(f"'{name}' ({count} facturas)" for name, count in provincias_sin_asignar.items()))
+
+
+
+# --- Cubos preagregados: todos los KPIs y gráficos se calculan sobre ellos ---
+
+cube_key = ('historico', history.signature) if usar_historico else ('actual', selected_file_electricidad, selected_file_gas, files_signature)
+
+with profiler.span('cubo', rows_in=len(df_combined)) as span:
+
+    # El cubo del histórico ya llega agregado desde el hilo de recarga.
+
+    df_cube = history.cube if usar_historico else get_cube(cube_key, df_combined, tuple(streamed_cubes))
+
+    span.rows_out = len(df_cube)
+
+factors_key = factors_signature()
+
+with profiler.span('emisiones', rows_in=len(df_cube)):
+
+    df_cube = get_emissions_cube(cube_key, factors_key, df_cube)
+
+with profiler.span('indice_filtros', rows_in=len(df_cube)):
+
+    cube_index = get_filter_index(cube_key, df_cube)
+
+
+
+if not df_cube.empty:
 
     st.sidebar.markdown("### 📅 Filtro Temporal")
 
-    selected_year = st.sidebar.selectbox('Seleccionar Año', sorted(df_combined['Año'].unique(), reverse=True))
+    available_years = sorted(df_cube['Año'].dropna().unique().tolist(), reverse=True)
+
+    latest_year = latest_billed_year(df_combined, df_cube)
+
+    selected_year = st.sidebar.selectbox('Seleccionar Año', available_years,
+
+                                         index=available_years.index(latest_year) if latest_year in available_years else 0)
 
     
 
@@ -469,7 +629,7 @@ if not df_combined.empty:
 
     st.sidebar.markdown("### 💡 Filtro de Energía")
 
-    energy_types = ['Ambos'] + sorted(df_combined['Tipo de Energía'].unique().tolist())
+    energy_types = ['Ambos'] + sorted(df_cube['Tipo de Energía'].unique().tolist())
 
     selected_energy_type = st.sidebar.selectbox("Tipo de Energía", energy_types)
 
@@ -479,7 +639,7 @@ if not df_combined.empty:
 
     st.sidebar.markdown("### 🌍 Filtro Geográfico")
 
-    lista_comunidades = sorted(df_combined['Comunidad Autónoma'].unique().tolist())
+    lista_comunidades = sorted(df_cube['Comunidad Autónoma'].unique().tolist())
 
     selected_communities = st.sidebar.multiselect('Seleccionar Comunidades', lista_comunidades, default=lista_comunidades)
 
@@ -493,7 +653,7 @@ if not df_combined.empty:
 
     if vista_por_centro:
 
-        centros_disponibles = sorted(df_combined[df_combined['Comunidad Autónoma'].isin(selected_communities)]['Centro'].unique().tolist())
+        centros_disponibles = sorted(cube_index.values('Centro', cube_index.select(FilterSpec(communities=tuple(selected_communities)))))
 
         if centros_disponibles:
 
@@ -509,11 +669,11 @@ if not df_combined.empty:
 
     # Solo muestra el filtro de tensión si hay datos de electricidad
 
-    if not df_electricidad.empty:
+    if 'Electricidad' in cube_index.values('Tipo de Energía'):
 
         st.sidebar.markdown("### ⚡ Filtro de Tensión (Electricidad)")
 
-        tension_types = sorted(df_electricidad['Tipo de Tensión'].unique().tolist())
+        tension_types = sorted(df_cube.loc[df_cube['Tipo de Energía'] == 'Electricidad', 'Tipo de Tensión'].unique().tolist())
 
         selected_tension = st.sidebar.multiselect('Tipo de Tensión', tension_types, default=tension_types)
 
@@ -527,59 +687,53 @@ if not df_combined.empty:
 
 # --- Lógica de la Aplicación Principal ---
 
-if not df_combined.empty:
-
-    
-
-    # Aplicar filtros
-
-    df_filtered = df_combined[
-
-        (df_combined['Año'] == selected_year) &
+# La comparativa entre años y las anomalías usan siempre el histórico completo de la carpeta.
 
-        (df_combined['Comunidad Autónoma'].isin(selected_communities))
+if not df_cube.empty and (comparar_anos or detectar_anomalias) and history is None:
 
-    ].copy()
+    history = load_invoice_history(DATA_DIR)
 
 
 
-    if selected_energy_type != 'Ambos':
-
-        df_filtered = df_filtered[df_filtered['Tipo de Energía'] == selected_energy_type]
+if not df_cube.empty:
 
     
 
-    # Aplica filtro de tensión solo a la parte de electricidad
+    # Aplicar filtros (el de tensión solo afecta a la parte de electricidad)
 
-    if selected_tension:
+    filtro = FilterSpec(
 
-        df_electricidad_filtered = df_filtered[df_filtered['Tipo de Energía'] == 'Electricidad']
+        year=selected_year,
 
-        df_gas_filtered = df_filtered[df_filtered['Tipo de Energía'] == 'Gas']
+        energy=None if selected_energy_type == 'Ambos' else selected_energy_type,
 
-        
+        communities=tuple(selected_communities),
 
-        # Filtra solo si la columna 'Tipo de Tensión' existe para evitar errores
+        centros=tuple(selected_centros) if vista_por_centro and selected_centros else None,
 
-        if 'Tipo de Tensión' in df_electricidad_filtered.columns:
+        tensions=tuple(selected_tension) if selected_tension else None,
 
-            df_electricidad_filtered = df_electricidad_filtered[df_electricidad_filtered['Tipo de Tensión'].isin(selected_tension)]
+    )
 
-        
+    with profiler.span('filtro', rows_in=len(df_cube)) as span:
 
-        df_filtered = pd.concat([df_electricidad_filtered, df_gas_filtered])
+        if usar_sql:
 
+            sql_backend = get_sql_backend(history.signature, factors_key)
 
+            df_filtered = sql_backend.cube(filtro)
 
-    if vista_por_centro and selected_centros:
+        else:
+
+            df_filtered = cube_index.apply(df_cube, filtro)
 
-        df_filtered = df_filtered[df_filtered['Centro'].isin(selected_centros)]
+        span.rows_out = len(df_filtered)
 
     
 
     # --- KPIs ---
 
-    st.title(f"Informe Energético Anual - {selected_year}")
+    page_title.title(f"Informe Energético Anual - {selected_year}")
 
     st.markdown("---")
 
@@ -587,25 +741,9 @@ if not df_combined.empty:
 
     if not df_filtered.empty:
 
-        kwh_elec = df_filtered[df_filtered['Tipo de Energía'] == 'Electricidad']['Consumo_kWh'].sum()
-
-        cost_elec = df_filtered[df_filtered['Tipo de Energía'] == 'Electricidad']['Coste Total'].sum()
+        with profiler.span('kpis', rows_in=len(df_filtered)):
 
-        kwh_gas = df_filtered[df_filtered['Tipo de Energía'] == 'Gas']['Consumo_kWh'].sum()
-
-        cost_gas = df_filtered[df_filtered['Tipo de Energía'] == 'Gas']['Coste Total'].sum()
-
-        
-
-        total_kwh = kwh_elec + kwh_gas
-
-        total_cost = cost_elec + cost_gas
-
-        num_suministros = df_filtered['CUPS'].nunique()
-
-        emisiones_co2 = (kwh_elec * CO2_FACTOR) / 1000 
-
-        coste_medio = total_cost / total_kwh if total_kwh > 0 else 0
+            kpis = sql_backend.kpis(filtro) if usar_sql else compute_kpis(df_filtered, CO2_FACTOR)
 
 
 
@@ -613,13 +751,15 @@ if not df_combined.empty:
 
         kpi_main1, kpi_main2, kpi_main3, kpi_main4 = st.columns(4)
 
-        kpi_main1.metric("Consumo Energético TOTAL", f"{total_kwh:,.0f} kWh")
+        kpi_main1.metric("Consumo Energético TOTAL", f"{kpis['total_kwh']:,.0f} kWh")
+
+        kpi_main2.metric("Coste Energético TOTAL", f"€ {kpis['total_cost']:,.2f}")
 
-        kpi_main2.metric("Coste Energético TOTAL", f"€ {total_cost:,.2f}")
+        kpi_main3.metric("Emisiones CO₂e", f"{kpis['emisiones_co2']:,.2f} tCO₂e",
 
-        kpi_main3.metric("Emisiones CO₂ (Eléctricas)", f"{emisiones_co2:,.2f} tCO₂e")
+                         help=f"Alcance 1 (gas): {kpis['emisiones_alcance1']:,.2f} tCO₂e · Alcance 2 (electricidad): {kpis['emisiones_alcance2']:,.2f} tCO₂e")
 
-        kpi_main4.metric("Nº Suministros Activos", f"{num_suministros}")
+        kpi_main4.metric("Nº Suministros Activos", f"{kpis['num_suministros']}")
 
         
 
@@ -629,15 +769,15 @@ if not df_combined.empty:
 
         kpi_sub1, kpi_sub2, kpi_sub3, kpi_sub4, kpi_sub5 = st.columns(5)
 
-        kpi_sub1.metric("Consumo Eléctrico", f"{kwh_elec:,.0f} kWh")
+        kpi_sub1.metric("Consumo Eléctrico", f"{kpis['kwh_elec']:,.0f} kWh")
 
-        kpi_sub2.metric("Coste Eléctrico", f"€ {cost_elec:,.2f}")
+        kpi_sub2.metric("Coste Eléctrico", f"€ {kpis['cost_elec']:,.2f}")
 
-        kpi_sub3.metric("Consumo Gas", f"{kwh_gas:,.0f} kWh")
+        kpi_sub3.metric("Consumo Gas", f"{kpis['kwh_gas']:,.0f} kWh")
 
-        kpi_sub4.metric("Coste Gas", f"€ {cost_gas:,.2f}")
+        kpi_sub4.metric("Coste Gas", f"€ {kpis['cost_gas']:,.2f}")
 
-        kpi_sub5.metric("Coste Medio Total", f"€ {coste_medio:.3f}/kWh")
+        kpi_sub5.metric("Coste Medio Total", f"€ {kpis['coste_medio']:.3f}/kWh")
 
         st.markdown("---")
 
@@ -649,6 +789,12 @@ if not df_combined.empty:
 
         
 
+        # plotly.express tarda en importarse: solo se carga cuando hay gráficos que dibujar
+
+        import plotly.express as px
+
+
+
         # --- Desglose de Costes y Mapa ---
 
         st.subheader(f"Análisis Geográfico y Desglose de Costes")
@@ -659,261 +805,596 @@ if not df_combined.empty:
 
             st.markdown(f"**Desglose de Costes Eléctricos**")
 
-            cost_components = ['Coste Energía', 'Coste Potencia', 'Coste Impuestos', 'Coste Alquiler', 'Coste Otros']
+            with profiler.span('grafico_desglose_costes', rows_in=len(df_filtered)):
+
+                df_cost_breakdown = cost_breakdown(df_filtered)
+
+                if not df_cost_breakdown.empty:
+
+                    fig_cost_pie = px.pie(df_cost_breakdown, names='Componente', values='Coste', hole=0.4)
+
+                    st.plotly_chart(fig_cost_pie, use_container_width=True)
+
+                else:
+
+                    st.info("No hay datos de costes eléctricos para mostrar.")
+
+
+
+        with map_col:
+
+            st.markdown(f"**Análisis Geográfico por Consumo**")
+
+            with profiler.span('geojson'):
+
+                geojson = get_geojson()
+
+            if geojson and not df_filtered.empty:
+
+                with profiler.span('grafico_mapa', rows_in=len(df_filtered)):
+
+                    df_map = df_filtered.groupby('Comunidad Autónoma', observed=True)['Consumo_kWh'].sum().reset_index()
+
+                    df_map['location_key'] = df_map['Comunidad Autónoma'].astype(str).map(get_community_index())
+
+                    df_map.dropna(subset=['location_key'], inplace=True)
+
+
+
+                    if not df_map.empty:
+
+                        fig_map = px.choropleth_mapbox(df_map,
+
+                                                       geojson=geojson,
+
+                                                       locations='location_key',
+
+                                                       featureidkey="properties.name",
+
+                                                       color='Consumo_kWh',
+
+                                                       color_continuous_scale="Viridis",
+
+                                                       mapbox_style="carto-positron",
+
+                                                       zoom=4.5, center={"lat": 40.4168, "lon": -3.7038},
+
+                                                       title="Consumo por Comunidad Autónoma")
+
+                        st.plotly_chart(fig_map, use_container_width=True)
+
+                    else:
+
+                        st.warning("No se pudieron mapear los datos geográficos.")
+
+
+
+        # --- Evolución y Comparativas ---
+
+        st.subheader("Análisis Detallado y Evolución")
+
+        col1, col2 = st.columns(2, gap="large")
+
+        with col1:
+
+            st.markdown(f"**Consumo por {columna_agrupar} y Tipo de Energía**")
+
+            with profiler.span('grafico_consumo_por_grupo', rows_in=len(df_filtered)):
+
+                fig_bar_energy = get_figure(('consumo_por_grupo', cube_key, filtro, columna_agrupar),
+
+                                            lambda: energy_by_group_figure(consumption_by(df_filtered, columna_agrupar), columna_agrupar))
+
+                st.plotly_chart(fig_bar_energy, use_container_width=True)
 
-            df_elec_costs = df_filtered[df_filtered['Tipo de Energía'] == 'Electricidad']
+                if df_filtered[columna_agrupar].nunique() > TOP_N:
+
+                    st.caption(f"Se muestran los {TOP_N} grupos con mayor consumo; el resto se suma en \"{OTHERS_LABEL}\".")
 
             
 
-            # Asegurarse de que las columnas existen antes de sumar
+        with col2:
+
+            st.markdown("**Evolución Mensual del Consumo**")
+
+
+
+            if (df_filtered['Año'] == selected_year).any():
+
+                with profiler.span('grafico_evolucion_mensual', rows_in=len(df_filtered)):
+
+                    df_to_plot = monthly_consumption(df_filtered, selected_year)
+
+
+                    fig_line = px.line(df_to_plot,
+
+                                       x='Fecha',
+
+                                       y='Consumo_kWh',
 
-            cost_components_exist = [col for col in cost_components if col in df_elec_costs.columns]
+                                       color='Tipo de Energía',
 
-            if not df_elec_costs.empty and cost_components_exist:
+                                       title="Consumo Mensual por Tipo de Energía",
 
-                cost_breakdown = df_elec_costs[cost_components_exist].sum().reset_index()
+                                       markers=True,
 
-                cost_breakdown.columns = ['Componente', 'Coste']
+                                       labels={'Fecha': 'Mes', 'Consumo_kWh': 'Consumo (kWh)'})
 
-                fig_cost_pie = px.pie(cost_breakdown, names='Componente', values='Coste', hole=0.4)
 
-                st.plotly_chart(fig_cost_pie, use_container_width=True)
+
+                    fig_line.update_xaxes(dtick="M1", tickformat="%b", range=[f'{selected_year}-01-01', f'{selected_year}-12-31'])
+
+                    st.plotly_chart(fig_line, use_container_width=True)
 
             else:
 
-                st.info("No hay datos de costes eléctricos para mostrar.")
+                st.warning("No hay datos de consumo para mostrar en el gráfico de evolución.")
 
 
 
-        with map_col:
+        # --- Periodos Tarifarios (P1-P6) ---
 
-            st.markdown(f"**Análisis Geográfico por Consumo**")
+        if period_files and selected_energy_type != 'Gas':
 
-            geojson = get_geojson()
+            with profiler.span('periodos_carga', ficheros=len(period_files)) as span:
 
-            if geojson and not df_filtered.empty:
+                periods, period_index = get_period_matrices('periodos', tuple(period_files), files_signature)
 
-                geojson_names = list({f['properties']['name'] for f in geojson['features']})
+                period_rows = period_index.select(FilterSpec(
 
+                    year=selected_year, communities=filtro.communities, centros=filtro.centros, tensions=filtro.tensions
 
+                ))
 
-                df_map = df_filtered.groupby('Comunidad Autónoma')['Consumo_kWh'].sum().reset_index()
+                span.rows_out = len(period_rows)
 
-                data_names = list(df_map['Comunidad Autónoma'].unique())
+            if len(period_rows):
 
+                st.markdown("---")
 
+                st.subheader("Análisis por Periodos Tarifarios")
 
-                name_mapping = {}
+                with profiler.span('periodos_resumen', rows_in=len(period_rows)):
 
-                for data_name in data_names:
+                    df_periods = period_summary(periods, by=columna_agrupar, rows=period_rows)
 
-                    match = process.extractOne(data_name, geojson_names)
+                col1, col2 = st.columns(2, gap="large")
 
-                    if match and match[1] > 80: # Umbral de coincidencia
+                with col1:
 
-                        name_mapping[data_name] = match[0]
+                    st.markdown(f"**Reparto del Consumo Eléctrico por Periodo y {columna_agrupar}**")
 
+                    fig_mix = get_figure(('reparto_periodos', files_signature, tuple(period_files), filtro, columna_agrupar),
 
+                                         lambda: period_mix_figure(df_periods, columna_agrupar, PERIODS))
 
-                df_map['location_key'] = df_map['Comunidad Autónoma'].map(name_mapping)
+                    st.plotly_chart(fig_mix, use_container_width=True)
 
-                df_map.dropna(subset=['location_key'], inplace=True)
+                    if len(df_periods) > TOP_N:
 
+                        st.caption(f"Se muestran los {TOP_N} grupos con mayor consumo; el resto se suma en \"{OTHERS_LABEL}\".")
 
 
-                if not df_map.empty:
 
-                    fig_map = px.choropleth_mapbox(df_map,
+                with col2:
 
-                                                   geojson=geojson,
+                    st.markdown("**Precio Efectivo del Término de Energía por Periodo**")
 
-                                                   locations='location_key',
+                    fig_price = get_figure(('precio_periodos', files_signature, tuple(period_files), filtro, columna_agrupar),
 
-                                                   featureidkey="properties.name",
+                                           lambda: price_box_figure(df_periods, columna_agrupar, PERIODS))
 
-                                                   color='Consumo_kWh',
+                    st.plotly_chart(fig_price, use_container_width=True)
 
-                                                   color_continuous_scale="Viridis",
 
-                                                   mapbox_style="carto-positron",
 
-                                                   zoom=4.5, center={"lat": 40.4168, "lon": -3.7038},
+                st.markdown("**Suministros con Mayor Cuota de Consumo en Punta (P1)**")
 
-                                                   title="Consumo por Comunidad Autónoma")
+                with profiler.span('periodos_resumen_cups', rows_in=len(period_rows)):
 
-                    st.plotly_chart(fig_map, use_container_width=True)
+                    df_periods_cups = period_summary(periods, by='CUPS', rows=period_rows)
 
-                else:
+                st.dataframe(
 
-                    st.warning("No se pudieron mapear los datos geográficos.")
+                    df_periods_cups.sort_values(['Ahorro potencial (€)', 'Cuota punta (%)'], ascending=False)[
 
+                        ['CUPS', 'Centro', 'Comunidad Autónoma', 'Tarifa de acceso', 'Consumo_kWh', 'Cuota punta (%)',
 
+                         '€/kWh P1', '€/kWh medio', 'Ahorro potencial (€)', 'Desglose TE (%)']
 
-        # --- Evolución y Comparativas ---
+                    ].head(25),
 
-        st.subheader("Análisis Detallado y Evolución")
+                    use_container_width=True, hide_index=True,
 
-        col1, col2 = st.columns(2, gap="large")
+                    column_config={
 
-        with col1:
+                        'Consumo_kWh': st.column_config.NumberColumn('Consumo (kWh)', format="%.0f"),
 
-            st.markdown(f"**Consumo por {columna_agrupar} y Tipo de Energía**")
+                        'Cuota punta (%)': st.column_config.NumberColumn(format="%.1f %%"),
 
-            df_grouped_energy = df_filtered.groupby([columna_agrupar, 'Tipo de Energía'])['Consumo_kWh'].sum().reset_index()
+                        '€/kWh P1': st.column_config.NumberColumn(format="%.4f"),
 
-            fig_bar_energy = px.bar(df_grouped_energy.sort_values(by='Consumo_kWh', ascending=False),
+                        '€/kWh medio': st.column_config.NumberColumn(format="%.4f"),
 
-                                     x=columna_agrupar, y='Consumo_kWh', color='Tipo de Energía', barmode='stack')
+                        'Ahorro potencial (€)': st.column_config.NumberColumn(
 
-            fig_bar_energy.update_layout(xaxis={'categoryorder':'total descending'})
+                            format="€ %.2f", help="Desplazando el 10 % del consumo en punta al periodo valle de la tarifa."),
 
-            st.plotly_chart(fig_bar_energy, use_container_width=True)
+                        'Desglose TE (%)': st.column_config.NumberColumn(
 
-            
+                            format="%.0f %%", help="Parte del importe de energía con desglose real por periodo en la factura."),
 
-        with col2:
+                    }
 
-            st.markdown("**Evolución Mensual del Consumo**")
+                )
 
 
 
-            tipos_energia_esperados = ['Electricidad', 'Gas']
+        # --- Optimización de la Potencia Contratada ---
 
-            fechas_del_ano = pd.to_datetime([f'{selected_year}-{m}-01' for m in range(1, 13)])
+        if optimizar_potencia and period_files and selected_energy_type != 'Gas':
 
-            
+            with profiler.span('potencia_carga', ficheros=len(period_files)) as span:
 
-            plantilla_completa = pd.MultiIndex.from_product(
+                power, power_index = get_period_matrices('potencia', tuple(period_files), files_signature)
 
-                [fechas_del_ano, tipos_energia_esperados],
+                power_rows = power_index.select(FilterSpec(
 
-                names=['Fecha', 'Tipo de Energía']
+                    year=selected_year, communities=filtro.communities, centros=filtro.centros, tensions=filtro.tensions
 
-            ).to_frame(index=False)
+                ))
 
+                span.rows_out = len(power_rows)
 
+            if len(power_rows):
 
-            df_chart_source = df_filtered[df_filtered['Año'] == selected_year].copy()
+                st.markdown("---")
 
+                st.subheader("Optimización de la Potencia Contratada")
 
+                with profiler.span('potencia_optimizacion', rows_in=len(power_rows)) as span:
 
-            if not df_chart_source.empty:
+                    df_power = optimize_power(power, rows=power_rows)
 
-                df_chart_source['Fecha'] = pd.to_datetime(df_chart_source['Año'].astype(str) + '-' + df_chart_source['Mes'].astype(str) + '-01')
+                    span.rows_out = len(df_power)
 
-                df_consumo_real = df_chart_source.groupby(['Fecha', 'Tipo de Energía'])['Consumo_kWh'].sum().reset_index()
+                df_power_savings = df_power[df_power['Ahorro anual (€)'] > 0]
 
+                pot_col1, pot_col2, pot_col3 = st.columns(3)
 
+                pot_col1.metric("Ahorro anual estimado", f"€ {df_power_savings['Ahorro anual (€)'].sum():,.2f}")
 
-                df_to_plot = pd.merge(plantilla_completa, df_consumo_real, on=['Fecha', 'Tipo de Energía'], how='left').fillna(0)
+                pot_col2.metric("Suministros con ahorro", f"{len(df_power_savings)} de {len(df_power)}")
 
-                
+                pot_col3.metric("Coste anual de potencia actual", f"€ {df_power['Coste anual actual (€)'].sum():,.2f}",
 
-                fig_line = px.line(df_to_plot,
+                                help=f"Simulado con la potencia actual. Facturado: € {df_power['Coste anual facturado (€)'].sum():,.2f}.")
 
-                                   x='Fecha',
+                st.caption("Coste del término de potencia y de los excesos simulado con las facturas del año para cada combinación de potencias P1-P6. "
 
-                                   y='Consumo_kWh',
+                           "En suministros de más de 50 kW y en 2.0TD solo se proponen potencias que cubren el maxímetro de cada periodo. "
 
-                                   color='Tipo de Energía',
+                           "Los excesos se simulan con los maxímetros: si el export no trae los excesos facturados, el coste actual simulado "
 
-                                   title="Consumo Mensual por Tipo de Energía",
+                           "puede superar al facturado.")
 
-                                   markers=True,
+                sin_lecturas = int((df_power['Lecturas maxímetro'] == 0).sum())
 
-                                   labels={'Fecha': 'Mes', 'Consumo_kWh': 'Consumo (kWh)'})
+                if sin_lecturas:
 
+                    st.info(f"{sin_lecturas} suministro(s) sin lecturas de maxímetro en la selección: se mantiene su potencia actual.")
 
+                st.dataframe(
 
-                fig_line.update_xaxes(dtick="M1", tickformat="%b", range=[f'{selected_year}-01-01', f'{selected_year}-12-31'])
+                    df_power_savings.head(25)[
 
-                st.plotly_chart(fig_line, use_container_width=True)
+                        ['CUPS', 'Centro', 'Tarifa de acceso', 'Ahorro anual (€)', 'Ahorro (%)', 'Coste anual facturado (€)',
 
-            else:
+                         'Coste anual actual (€)', 'Coste anual óptimo (€)']
 
-                st.warning("No hay datos de consumo para mostrar en el gráfico de evolución.")
+                        + [f'Potencia actual {p}' for p in PERIODS] + [f'Potencia óptima {p}' for p in PERIODS]
+
+                    ],
+
+                    use_container_width=True, hide_index=True,
+
+                    column_config={
+
+                        'Ahorro anual (€)': st.column_config.NumberColumn(format="€ %.2f"),
+
+                        'Ahorro (%)': st.column_config.NumberColumn(format="%.1f %%"),
+
+                        'Coste anual facturado (€)': st.column_config.NumberColumn(format="€ %.2f"),
+
+                        'Coste anual actual (€)': st.column_config.NumberColumn('Coste anual simulado (€)', format="€ %.2f"),
+
+                        'Coste anual óptimo (€)': st.column_config.NumberColumn(format="€ %.2f"),
+
+                        **{f'Potencia actual {p}': st.column_config.NumberColumn(f'Actual {p} (kW)', format="%.1f") for p in PERIODS},
+
+                        **{f'Potencia óptima {p}': st.column_config.NumberColumn(f'Óptima {p} (kW)', format="%.1f") for p in PERIODS},
+
+                    }
+
+                )
+
+
+
+        # --- Penalizaciones por Energía Reactiva ---
+
+        if analizar_reactiva and period_files and selected_energy_type != 'Gas':
+
+            with profiler.span('reactiva_carga', ficheros=len(period_files)) as span:
+
+                reactive, reactive_index = get_period_matrices('reactiva', tuple(period_files), files_signature)
+
+                # Todos los años cargados: el retorno de la batería se calcula con la penalización media anual.
 
+                reactive_rows = reactive_index.select(FilterSpec(
 
+                    communities=filtro.communities, centros=filtro.centros, tensions=filtro.tensions
 
-        # --- Comparativa Anual ---
+                ))
 
-        if comparar_anos and not df_comparativa.empty and not df_filtered.empty:
+                span.rows_out = len(reactive_rows)
+
+            if len(reactive_rows):
+
+                st.markdown("---")
+
+                st.subheader("Penalizaciones por Energía Reactiva")
+
+                with profiler.span('reactiva_resumen', rows_in=len(reactive_rows)):
+
+                    df_reactive = reactive_summary(reactive, rows=reactive_rows)
+
+                df_reactive_penalized = df_reactive[df_reactive['Penalización anual (€)'] > 0]
+
+                rea_col1, rea_col2, rea_col3 = st.columns(3)
+
+                rea_col1.metric("Penalización anual", f"€ {df_reactive_penalized['Penalización anual (€)'].sum():,.2f}")
+
+                rea_col2.metric("Suministros penalizados", f"{len(df_reactive_penalized)} de {len(df_reactive)}")
+
+                rea_col3.metric("Inversión en baterías", f"€ {df_reactive_penalized['Inversión (€)'].sum():,.0f}")
+
+                st.caption("Con todas las facturas cargadas de cada suministro. Se penalizan los kVArh por encima del 33 % de la activa "
+
+                           "(cos φ menor que 0,95) en todos los periodos salvo el valle; la batería se dimensiona para un cos φ de 0,98.")
+
+                st.dataframe(
+
+                    df_reactive_penalized.head(25)[
+
+                        ['CUPS', 'Centro', 'Tarifa de acceso', 'cos φ', 'Facturas penalizadas', 'kVArh penalizados',
+
+                         'Penalización anual (€)', 'Importe TR facturado (€)', 'Batería (kVAr)', 'Inversión (€)', 'Retorno (años)']
+
+                    ],
+
+                    use_container_width=True, hide_index=True,
+
+                    column_config={
+
+                        'cos φ': st.column_config.NumberColumn(format="%.3f"),
+
+                        'kVArh penalizados': st.column_config.NumberColumn(format="%.0f"),
+
+                        'Penalización anual (€)': st.column_config.NumberColumn(format="€ %.2f"),
+
+                        'Importe TR facturado (€)': st.column_config.NumberColumn(format="€ %.2f"),
+
+                        'Batería (kVAr)': st.column_config.NumberColumn(format="%.0f"),
+
+                        'Inversión (€)': st.column_config.NumberColumn(format="€ %.0f", help="Coste aproximado de la batería instalada."),
+
+                        'Retorno (años)': st.column_config.NumberColumn(format="%.1f"),
+
+                    }
+
+                )
+
+
+
+        # --- Emisiones de Alcance 1 y 2 ---
+
+        if informe_emisiones:
 
             st.markdown("---")
 
-            st.subheader("Comparativa Anual de Electricidad")
+            st.subheader("Emisiones de Alcance 1 y 2")
 
-            df_comp_filtered = df_comparativa.copy()
+            # Todos los años cargados, con el resto de filtros de la barra lateral
 
-            if selected_communities:
+            filtro_emisiones = FilterSpec(energy=filtro.energy, communities=filtro.communities, centros=filtro.centros, tensions=filtro.tensions)
 
-                df_comp_filtered = df_comp_filtered[df_comp_filtered['Comunidad Autónoma'].isin(selected_communities)]
+            with profiler.span('emisiones_informe', rows_in=len(df_cube)) as span:
 
-            if selected_tension:
+                df_emisiones = scope_report(cube_index.apply(df_cube, filtro_emisiones), columna_agrupar)
 
-                df_comp_filtered = df_comp_filtered[df_comp_filtered['Tipo de Tensión'].isin(selected_tension)]
+                span.rows_out = len(df_emisiones)
 
-            
+            em_col1, em_col2, em_col3 = st.columns(3)
+
+            em_col1.metric("Alcance 1 (gas)", f"{kpis['emisiones_alcance1']:,.2f} tCO₂e")
+
+            em_col2.metric("Alcance 2 (electricidad)", f"{kpis['emisiones_alcance2']:,.2f} tCO₂e")
+
+            em_col3.metric("Intensidad", f"{kpis['emisiones_co2'] * 1000 / kpis['total_kwh'] if kpis['total_kwh'] > 0 else 0:.3f} kgCO₂e/kWh")
+
+            st.caption(f"Indicadores de {selected_year}; el gráfico y la tabla incluyen todos los años cargados. "
+
+                       "Los factores de emisión se pueden ajustar por año, mes, comercializadora o CUPS en `consumo/data/factores_emision.csv`.")
+
+            emisiones_por_ano = df_emisiones.groupby('Año')[SCOPE_COLUMNS].sum()
+
+            fig_emisiones = get_figure(('emisiones_alcance', cube_key, factors_key, filtro_emisiones),
+
+                                       lambda: stacked_bar([str(year) for year in emisiones_por_ano.index],
+
+                                                           {'Alcance 1': emisiones_por_ano['Alcance 1 (tCO₂e)'], 'Alcance 2': emisiones_por_ano['Alcance 2 (tCO₂e)']},
+
+                                                           x_title='Año', y_title='tCO₂e', legend_title='Alcance', value_format=',.1f'))
+
+            st.plotly_chart(fig_emisiones, use_container_width=True)
+
+            st.dataframe(
+
+                df_emisiones.sort_values(['Año', 'Total (tCO₂e)'], ascending=[False, False]),
+
+                use_container_width=True, hide_index=True,
+
+                column_config={
+
+                    'Alcance 1 (tCO₂e)': st.column_config.NumberColumn(format="%.2f"),
+
+                    'Alcance 2 (tCO₂e)': st.column_config.NumberColumn(format="%.2f"),
 
-            if vista_por_centro and selected_centros:
+                    'Total (tCO₂e)': st.column_config.NumberColumn(format="%.2f"),
 
-                df_comp_filtered = df_comp_filtered[df_comp_filtered['Centro'].isin(selected_centros)]
+                    'Consumo_kWh': st.column_config.NumberColumn("Consumo (kWh)", format="%.0f"),
 
+                    'Intensidad (kgCO₂e/kWh)': st.column_config.NumberColumn(format="%.3f"),
 
+                }
 
-            if not df_comp_filtered.empty:
+            )
 
-                prev_year = df_comp_filtered['Año'].iloc[0]
+            st.download_button("Descargar emisiones (CSV)", df_emisiones.to_csv(index=False).encode('utf-8'),
 
+                               file_name="emisiones_alcance_1_2.csv", mime="text/csv")
 
 
-                plantilla_meses = pd.DataFrame({'Mes': range(1, 13)})
 
+        # --- Comparativa entre Años ---
 
+        if comparar_anos and history is not None:
 
-                df_current_year_monthly = df_filtered[df_filtered['Tipo de Energía'] == 'Electricidad'].groupby('Mes')['Consumo_kWh'].sum().reset_index()
+            st.markdown("---")
+
+            st.subheader("Comparativa entre Años")
+
+            with profiler.span('series_historico'):
+
+                series = get_monthly_series(history)
+
+            comp_col1, comp_col2, comp_col3 = st.columns([0.6, 0.2, 0.2])
+
+            default_years = [year for year in (selected_year - 1, selected_year) if year in series.years]
+
+            selected_years = comp_col1.multiselect("Años a comparar", series.years, default=default_years)
+
+            comp_energy = comp_col2.selectbox("Energía", ENERGY_TYPES,
+
+                                              index=ENERGY_TYPES.index(selected_energy_type) if selected_energy_type in ENERGY_TYPES else 0)
+
+            acumulado_12m = comp_col3.toggle("Acumulado 12 meses", help="Suma móvil de los últimos 12 meses en cada mes.")
+
+
+
+            # Los filtros geográficos y de tensión se aplican a las series; el año lo eligen los controles de arriba.
+
+            with profiler.span('grafico_comparativa', rows_in=len(series.meta)) as span:
+
+                series_rows = series.select(FilterSpec(energy=comp_energy, communities=filtro.communities,
+
+                                                       centros=filtro.centros, tensions=filtro.tensions))
+
+                span.rows_out = len(series_rows)
+
+                if not selected_years or not len(series_rows):
+
+                    st.warning(f"No hay datos de {comp_energy.lower()} para los años y filtros seleccionados.")
+
+                elif acumulado_12m:
+
+                    rolling = series.rolling(series_rows)
+
+                    rolling = rolling[rolling.index.year.isin(selected_years)].dropna()
+
+                    fig_comp = px.line(x=rolling.index, y=rolling.to_numpy(), markers=True,
+
+                                       title=f"Consumo de {comp_energy} en los 12 meses anteriores",
+
+                                       labels={'x': 'Mes', 'y': 'Consumo 12 meses (kWh)'})
 
-                df_prev_year_monthly = df_comp_filtered.groupby('Mes')['Consumo_kWh'].sum().reset_index()
+                    st.plotly_chart(fig_comp, use_container_width=True)
 
+                else:
+
+                    comparison_df = series.yearly(sorted(selected_years), series_rows)
+
+                    fig_comp = px.bar(comparison_df, x='Mes_str', y=[str(year) for year in sorted(selected_years)], barmode='group',
+
+                                      title=f"Consumo Mensual de {comp_energy}: {' vs. '.join(str(year) for year in sorted(selected_years))}",
+
+                                      labels={'value': f'Consumo de {comp_energy} (kWh)', 'Mes_str': 'Mes', 'variable': 'Año'},
+
+                                      category_orders={"Mes_str": MONTH_NAMES})
+
+                    st.plotly_chart(fig_comp, use_container_width=True)
+
+
+
+        # --- Facturas Anómalas ---
+
+        if detectar_anomalias and history is not None:
+
+            st.markdown("---")
 
+            st.subheader("Facturas Anómalas")
 
-                df_current_full = pd.merge(plantilla_meses, df_current_year_monthly, on='Mes', how='left').fillna(0)
+            with profiler.span('anomalias') as span:
 
-                df_prev_full = pd.merge(plantilla_meses, df_prev_year_monthly, on='Mes', how='left').fillna(0)
+                df_anomalias, anomalias_index = get_anomalies(history)
 
+                anomalias_rows = anomalias_index.select(filtro)
 
+                span.rows_out = len(anomalias_rows)
 
-                comparison_df = pd.DataFrame({
+            if len(anomalias_rows):
 
-                    'Mes': plantilla_meses['Mes'],
+                st.caption(f"{len(anomalias_rows)} facturas de {selected_year} se alejan de lo habitual en su suministro "
 
-                    str(selected_year): df_current_full['Consumo_kWh'],
+                           f"(consumo diario desestacionalizado o precio medio con z robusto mayor que {DEFAULT_THRESHOLD}).")
 
-                    str(prev_year): df_prev_full['Consumo_kWh']
+                st.dataframe(
 
-                })
+                    df_anomalias.take(anomalias_rows).head(50)[
 
-                
+                        ['Puntuación', 'Motivo', 'CUPS', 'Centro', 'Tipo de Energía', 'Fecha desde', 'Fecha hasta',
 
-                months_order = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
+                         'Consumo_kWh', 'kWh/día', 'kWh/día esperado', '€/kWh', '€/kWh esperado', 'Número de factura']
 
-                comparison_df['Mes_str'] = comparison_df['Mes'].apply(lambda x: months_order[x-1])
+                    ],
 
+                    use_container_width=True, hide_index=True,
 
+                    column_config={
 
-                fig_comp = px.bar(comparison_df, x='Mes_str', y=[str(selected_year), str(prev_year)], barmode='group',
+                        'Puntuación': st.column_config.NumberColumn(format="%.1f", help="z robusto frente al histórico del suministro."),
 
-                                  title=f'Comparativa de Consumo Mensual: {selected_year} vs. {prev_year}',
+                        'Fecha desde': st.column_config.DateColumn(format="DD/MM/YYYY"),
 
-                                  labels={'value': 'Consumo Eléctrico (kWh)', 'Mes_str': 'Mes'},
+                        'Fecha hasta': st.column_config.DateColumn(format="DD/MM/YYYY"),
 
-                                  category_orders={"Mes_str": months_order})
+                        'Consumo_kWh': st.column_config.NumberColumn('Consumo (kWh)', format="%.0f"),
 
-                st.plotly_chart(fig_comp, use_container_width=True)
+                        'kWh/día': st.column_config.NumberColumn(format="%.1f"),
+
+                        'kWh/día esperado': st.column_config.NumberColumn(format="%.1f"),
+
+                        '€/kWh': st.column_config.NumberColumn(format="%.4f"),
+
+                        '€/kWh esperado': st.column_config.NumberColumn(format="%.4f"),
+
+                    }
+
+                )
 
             else:
 
-                st.warning(f"No hay datos de electricidad del año anterior para los filtros seleccionados.")
+                st.info("No se han detectado facturas anómalas para los filtros seleccionados.")
 
 
 
@@ -921,8 +1402,115 @@ if not df_combined.empty:
 
         st.warning("No se encontraron datos para los filtros aplicados. Por favor, ajusta tu selección.")
 
+
+
+    # --- Consultas SQL libres sobre el histórico ---
+
+    if usar_sql:
+
+        st.markdown("---")
+
+        with st.expander("Consulta SQL"):
+
+            st.caption("Una única consulta SELECT. Vistas: `facturas`, `facturas_mensuales` (repartida por meses naturales), `facturas_electricidad` y `facturas_gas` (incluyen las anuladas).")
+
+            consulta = st.text_area("Consulta", 'SELECT "Comunidad Autónoma", sum(Consumo_kWh) AS kWh, sum("Coste Total") AS coste\nFROM facturas_mensuales\nGROUP BY ALL ORDER BY kWh DESC', height=120)
+
+            if st.button("Ejecutar consulta"):
+
+                try:
+
+                    with profiler.span('consulta_sql') as span:
+
+                        resultado = sql_backend.query(consulta)
+
+                        span.rows_out = len(resultado)
+
+                    st.dataframe(resultado, use_container_width=True)
+
+                except ValueError as e:
+
+                    # Consultas rechazadas antes de ejecutarse (varias sentencias o algo distinto de SELECT).
+
+                    st.error(f"Consulta no permitida: {e}")
+
+                except Exception as e:
+
+                    st.error(f"Error en la consulta: {e}")
+
 else:
 
     st.warning("No hay datos cargados para mostrar. Por favor, selecciona archivos en la barra lateral.")
 
 
+
+# --- Recarga del histórico en segundo plano ---
+
+# El hilo de recarga solo existe si alguna vista ha pedido el histórico (histórico consolidado, SQL, comparativa o anomalías).
+
+if history is not None:
+
+    with st.sidebar:
+
+        history_status(history.signature)
+
+
+
+# --- Diagnóstico de rendimiento ---
+
+st.sidebar.markdown("---")
+
+st.sidebar.toggle("Diagnóstico de rendimiento", key='debug_profiling',
+
+                  help="Mide el tiempo y las filas de cada etapa del informe, y la memoria si el servidor se arrancó con "
+
+                       f"{MEMORY_TRACING_ENV}=1 (tracemalloc ralentiza a todas las sesiones, por eso no se activa desde aquí).")
+
+if profiler.enabled:
+
+    with st.sidebar.expander("Tiempos por etapa", expanded=True):
+
+        df_profile = profiler.to_frame()
+
+        st.caption(f"Ejecución completa: {profiler.total_ms():,.0f} ms")
+
+        if profiler.trace_memory:
+
+            st.caption("Memoria del proceso completo: con otras sesiones midiendo a la vez, el pico se deja en blanco.")
+
+        if not df_profile.empty:
+
+            df_profile['etapa'] = ['\u00a0\u00a0' * nivel + etapa for nivel, etapa in zip(df_profile['nivel'], df_profile['etapa'])]
+
+            st.dataframe(df_profile.drop(columns=['nivel', 'inicio_ms']), use_container_width=True, hide_index=True,
+
+                         column_config={
+
+                             'duracion_ms': st.column_config.NumberColumn('ms', format="%.1f"),
+
+                             'memoria_asignada_kb': st.column_config.NumberColumn('Memoria (KB)', format="%.0f"),
+
+                             'memoria_pico_kb': st.column_config.NumberColumn('Pico (KB)', format="%.0f"),
+
+                         })
+
+        st.download_button("Descargar JSON", profiler.to_json(), file_name='perfil.json', mime='application/json')
+
+        st.download_button("Descargar traza (Chrome/Perfetto)", profiler.to_chrome_trace(),
+
+                           file_name='perfil.trace.json', mime='application/json')
+
+
+    with st.sidebar.expander("Caché de datos compartida"):
+
+        cache_stats = get_dataset_cache().stats()
+
+        st.caption(f"{cache_stats['entradas']} datasets, {cache_stats['memoria_mb']:,.1f} de {cache_stats['limite_mb']:,.0f} MB")
+
+        st.caption(f"Aciertos: {cache_stats['aciertos']} · Fallos: {cache_stats['fallos']} · Descartes: {cache_stats['descartes']}")
+
+        if st.button("Vaciar caché de datos"):
+
+            get_dataset_cache().invalidate()
+
+            st.rerun()
@@ -0,0 +1,18 @@
+import pandas as pd
+
+from consumo.emissions import DEFAULT_FACTORS, FACTORS_PATH, emission_factors, load_factors
+
+
+def test_shipped_factors_load():
+    factors = load_factors()
+    shipped = pd.read_csv(FACTORS_PATH)
+    assert list(shipped.columns) == ['Tipo de Energía', 'Año', 'Mes', 'Comercializadora', 'CUPS', 'Factor']
+    assert len(factors) == len(DEFAULT_FACTORS) + len(shipped)
+    assert set(factors['Tipo de Energía']) == {'Electricidad', 'Gas'}
+
+
+def test_shipped_factors_match_the_defaults():
+    df = pd.DataFrame({'Tipo de Energía': ['Electricidad', 'Gas'], 'Comercializadora': ['ENDESA', ''],
+                       'Año': [2024, 2025]})
+    expected = [row['Factor'] for row in DEFAULT_FACTORS]
+    assert emission_factors(df, load_factors()).tolist() == expected
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from consumo.periods import PERIODS
+from consumo.power import CONTRACTED_COLUMNS, MAXIMETER_COLUMNS, PowerData, optimize_power
+
+
+def power_invoices(cups, maximeter, contracted=(10.0, 10.0, 0, 0, 0, 0), tariff='2.0TD', coste_potencia=30.0):
+    starts = pd.date_range('2024-01-01', periods=len(maximeter), freq='MS')
+    df = pd.DataFrame({
+        'Número de factura': [f'{cups}-{i}' for i in range(len(maximeter))],
+        'CUPS': cups,
+        'Estado de factura': 'ACTIVA',
+        'Fecha desde': starts,
+        'Fecha hasta': starts + pd.offsets.MonthEnd(0),
+        'Centro': f'Centro {cups}',
+        'Comunidad Autónoma': 'Comunidad de Madrid',
+        'Tarifa de acceso': tariff,
+        'Coste Potencia': coste_potencia,
+    })
+    df[MAXIMETER_COLUMNS] = np.asarray(maximeter, dtype='float64')
+    df[CONTRACTED_COLUMNS] = np.tile(contracted, (len(maximeter), 1))
+    return df
+
+
+def test_supplies_without_maximeter_readings_keep_their_power():
+    data = PowerData(power_invoices('ES01', np.zeros((4, len(PERIODS)))))
+    summary = optimize_power(data)
+    assert len(summary) == 1
+    row = summary.iloc[0]
+    assert row['Lecturas maxímetro'] == 0
+    assert row['Ahorro anual (€)'] == 0
+    assert [row[f'Potencia óptima {p}'] for p in PERIODS] == [row[f'Potencia actual {p}'] for p in PERIODS]
+
+
+def test_mixed_selection_with_and_without_readings():
+    readings = np.zeros((4, len(PERIODS)))
+    readings[:, :2] = [[3.0, 2.0], [3.5, 2.5], [4.0, 2.0], [3.2, 2.1]]
+    df = pd.concat([power_invoices('ES01', np.zeros((4, len(PERIODS)))), power_invoices('ES02', readings)],
+                   ignore_index=True)
+    summary = optimize_power(PowerData(df)).set_index('CUPS')
+    assert summary.loc['ES01', 'Lecturas maxímetro'] == 0
+    assert summary.loc['ES02', 'Lecturas maxímetro'] == 8
+    # Sin excesos, el término de potencia simulado con la potencia actual es el facturado.
+    assert np.isclose(summary.loc['ES01', 'Coste anual actual (€)'], summary.loc['ES01', 'Coste anual facturado (€)'])
+    # En 2.0TD la potencia propuesta cubre el maxímetro y baja de los 10 kW contratados.
+    assert 4.0 <= summary.loc['ES02', 'Potencia óptima P1'] < 10.0
+    assert summary.loc['ES02', 'Ahorro anual (€)'] > 0
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from consumo.prorate import split_by_month
+
+
+def invoices(energy, periods, consumo=None):
+    return pd.DataFrame({
+        'Tipo de Energía': energy,
+        'Fecha desde': pd.to_datetime([start for start, _ in periods]),
+        'Fecha hasta': pd.to_datetime([end for _, end in periods]),
+        'Año': pd.array([pd.Timestamp(start).year if start else None for start, _ in periods], dtype='Int16'),
+        'Mes': pd.array([pd.Timestamp(start).month if start else None for start, _ in periods], dtype='Int8'),
+        'Consumo_kWh': consumo if consumo is not None else [31.0] * len(periods),
+    })
+
+
+def by_month(split):
+    return split.groupby(['Año', 'Mes'])['Consumo_kWh'].sum().to_dict()
+
+
+def test_electricity_starts_the_day_after_fecha_desde():
+    # Del 31/07 al 31/08 la electricidad cubre del 1 al 31 de agosto.
+    split = split_by_month(invoices('Electricidad', [('2024-07-31', '2024-08-31')]), ['Consumo_kWh'])
+    assert by_month(split) == {(2024, 8): 31.0}
+
+
+def test_gas_includes_fecha_desde():
+    # Del 01/08 al 31/08 el gas cubre los 31 días de agosto; la factura siguiente empieza el 01/09.
+    df = invoices('Gas', [('2024-08-01', '2024-08-31'), ('2024-09-01', '2024-09-30')], consumo=[31.0, 30.0])
+    assert by_month(split_by_month(df, ['Consumo_kWh'])) == {(2024, 8): 31.0, (2024, 9): 30.0}
+
+
+def test_gas_split_counts_the_first_day():
+    # 16/01 a 14/02 son 30 días: 16 en enero y 14 en febrero.
+    split = split_by_month(invoices('Gas', [('2024-01-16', '2024-02-14')], consumo=[30.0]), ['Consumo_kWh'])
+    assert by_month(split) == {(2024, 1): 16.0, (2024, 2): 14.0}
+
+
+def test_single_day_gas_invoice_is_kept_in_its_month():
+    split = split_by_month(invoices('Gas', [('2024-03-05', '2024-03-05')], consumo=[7.0]), ['Consumo_kWh'])
+    assert by_month(split) == {(2024, 3): 7.0}
+
+
+def test_missing_dates_fall_through_unprorated():
+    df = invoices('Electricidad', [('2024-01-15', None), (None, '2024-02-14'), ('2024-01-15', '2024-02-14')],
+                  consumo=[31.0, 31.0, 30.0])
+    split = split_by_month(df, ['Consumo_kWh'])
+    assert len(split) == 4
+    assert split['Consumo_kWh'].sum() == df['Consumo_kWh'].sum()
+    assert split.loc[0, ['Año', 'Mes']].tolist() == [2024, 1]
+    assert split.loc[1, ['Año', 'Mes']].isna().all()
+    assert np.isclose(split.loc[2:, 'Consumo_kWh'], [16.0, 14.0]).all()
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip('duckdb')
+
+from consumo.sql import check_select
+
+
+@pytest.mark.parametrize('sql', [
+    'SELECT 1',
+    'SELECT 1;',
+    'WITH t AS (SELECT 1 AS x) SELECT x FROM t',
+    'FROM facturas_mensuales',
+])
+def test_single_select_is_accepted(sql):
+    check_select(sql)
+
+
+@pytest.mark.parametrize('sql', [
+    'DROP VIEW facturas',
+    'CREATE TABLE t AS SELECT 1',
+    'SELECT 1; DROP VIEW facturas',
+    'SET threads = 1',
+    '',
+])
+def test_anything_else_is_rejected(sql):
+    with pytest.raises(ValueError):
+        check_select(sql)